@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""Show the query plans for the hot revision, attribute and lock lookups with
+and without the indexes added by migrations 0010 and 0013.
+
+This builds a corpus of ``--revisions`` revisions (a million by default) in the
+database configured for the sample project, runs ``EXPLAIN ANALYZE`` for each
+lookup before and after creating the indexes, and then rolls everything back,
+so it is safe to point at a development database. It needs Postgres.
+
+Usage::
+
+    cd sample_project
+    python ../benchmarks/revision_indexes.py --revisions 1000000
+"""
+import argparse
+import datetime
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'sample_project'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mirrors_server.settings')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from mirrors.models import Component, ComponentAttribute
+from mirrors.models import ComponentLock, ComponentRevision
+
+index_migration = importlib.import_module(
+    'mirrors.migrations.0010_revision_attribute_lock_indexes')
+descriptor_migration = importlib.import_module(
+    'mirrors.migrations.0013_componentrevision_descriptors')
+
+# the revision indexes from 0010 were replaced by ones on the descriptors
+REPLACED = set(name for name, _ in descriptor_migration.OLD_INDEXES)
+INDEXES = ([(name, create) for name, create in index_migration.INDEXES
+            if name not in REPLACED] +
+           descriptor_migration.INDEXES)
+
+BATCH_SIZE = 10000
+
+
+class Rollback(Exception):
+    pass
+
+
+def build_corpus(n_components, n_revisions):
+    """Fill the tables with ``n_revisions`` revisions spread evenly over
+    ``n_components`` components, plus a handful of attributes and locks for
+    each component.
+    """
+    Component.objects.bulk_create(
+        [Component(slug='bench-{}'.format(i), head_version=0)
+         for i in range(n_components)],
+        batch_size=BATCH_SIZE)
+    ids = list(Component.objects.filter(slug__startswith='bench-')
+                                .values_list('pk', flat=True))
+
+    per_component = max(1, n_revisions // len(ids))
+    batch = []
+    for component_id in ids:
+        for version in range(1, per_component + 1):
+            # most revisions are autosaves that only touch the metadata.
+            # bulk_create doesn't send pre_save, so fill in the descriptors
+            rev = ComponentRevision(
+                component_id=component_id,
+                version=version,
+                metadata={'v': version} if version % 10 else None,
+                data=b'x' * 64 if version % 10 == 0 else None)
+            rev.describe()
+            batch.append(rev)
+
+            if len(batch) >= BATCH_SIZE:
+                ComponentRevision.objects.bulk_create(batch)
+                batch = []
+    ComponentRevision.objects.bulk_create(batch)
+
+    attrs = []
+    for n, component_id in enumerate(ids):
+        for weight in range(10):
+            attrs.append(ComponentAttribute(
+                parent_id=component_id,
+                child_id=ids[(n + weight + 1) % len(ids)],
+                name='list_{}'.format(weight % 3),
+                weight=weight * 100))
+    ComponentAttribute.objects.bulk_create(attrs, batch_size=BATCH_SIZE)
+
+    user, _ = User.objects.get_or_create(username='bench-user')
+    ended = timezone.now() - datetime.timedelta(days=1)
+    ComponentLock.objects.bulk_create(
+        [ComponentLock(component_id=component_id, locked_by=user,
+                       lock_ends_at=ended, broken=(n % 2 == 0))
+         for n, component_id in enumerate(ids) for _ in range(5)],
+        batch_size=BATCH_SIZE)
+
+    return ids
+
+
+def lookups(component_id):
+    component = Component.objects.get(pk=component_id)
+    version = component.revisions.count() // 2
+    now = timezone.now()
+
+    return [
+        ('revision by version',
+         component.revisions.filter(version=version)),
+        ('metadata at version',
+         component.revisions.filter(has_metadata=True,
+                                    version__lte=version)
+                            .order_by('-version')[:1]),
+        ('data at version',
+         component.revisions.filter(has_data=True,
+                                    version__lte=version)
+                            .order_by('-version')[:1]),
+        ('attribute list',
+         component.attributes.filter(name='list_1').order_by('weight')),
+        ('current lock',
+         component.locks.exclude(broken=True)
+                        .exclude(lock_ends_at__lte=now)[:1]),
+    ]
+
+
+def explain(label, queries):
+    print('=' * 78)
+    print(label)
+    print('=' * 78)
+
+    cursor = connection.cursor()
+    for name, qs in queries:
+        sql, params = qs.query.sql_with_params()
+        cursor.execute('EXPLAIN ANALYZE ' + sql, params)
+
+        print('--- {}'.format(name))
+        for row in cursor.fetchall():
+            print(row[0])
+        print()
+
+
+def drop_indexes():
+    cursor = connection.cursor()
+    for name, _ in index_migration.INDEXES + INDEXES:
+        cursor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+    cursor.execute("SELECT conname FROM pg_constraint "
+                   "WHERE conrelid = 'mirrors_componentrevision'::regclass "
+                   "AND contype = 'u'")
+    for (name,) in cursor.fetchall():
+        cursor.execute('ALTER TABLE mirrors_componentrevision '
+                       'DROP CONSTRAINT {}'.format(name))
+
+
+def create_indexes():
+    cursor = connection.cursor()
+    cursor.execute('ALTER TABLE mirrors_componentrevision '
+                   'ADD UNIQUE (component_id, version)')
+    for _, create in INDEXES:
+        cursor.execute(create)
+
+
+def analyze():
+    cursor = connection.cursor()
+    for table in ('mirrors_component', 'mirrors_componentrevision',
+                  'mirrors_componentattribute', 'mirrors_componentlock'):
+        cursor.execute('ANALYZE {}'.format(table))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--revisions', type=int, default=1000000)
+    parser.add_argument('--components', type=int, default=2000)
+    args = parser.parse_args()
+
+    try:
+        with transaction.atomic():
+            drop_indexes()
+
+            print('building a corpus of {} revisions...'.format(
+                args.revisions))
+            ids = build_corpus(args.components, args.revisions)
+            sample = ids[len(ids) // 2]
+
+            analyze()
+            explain('before', lookups(sample))
+
+            create_indexes()
+            analyze()
+            explain('after', lookups(sample))
+
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Counting how often components are read, to know which ones are worth
+warming the cache with (see :mod:`mirrors.warmup`).
+
+Reads are counted in memory and added to the
+:class:`mirrors.models.ComponentAccessStat` rows in one batch every
+``MIRRORS_ACCESS_FLUSH_INTERVAL`` seconds (60 unless set; None turns counting
+off), by whichever request comes along once that has passed, and when the
+process exits. So counting costs a couple of queries per process per interval
+rather than a write per read, and a process that dies loses at most one
+interval's worth of counts.
+"""
+import atexit
+import collections
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils import timezone
+
+from mirrors.models import ComponentAccessStat
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 60
+
+# the counter of this process, made by get_counter(); False when counting is
+# turned off
+_counter = None
+_counter_lock = threading.Lock()
+
+# adds the counts to the rows that exist, returning the slugs of those
+UPDATE_COUNTS_SQL = """
+UPDATE mirrors_componentaccessstat s SET
+    count = s.count + v.hits,
+    last_accessed = GREATEST(s.last_accessed, %s)
+FROM (VALUES {}) v(slug, hits)
+JOIN mirrors_component c ON c.slug = v.slug
+WHERE s.component_id = c.id
+RETURNING c.slug
+"""
+
+# makes rows for the rest; slugs that aren't components any more are dropped
+INSERT_COUNTS_SQL = """
+INSERT INTO mirrors_componentaccessstat (component_id, count, last_accessed)
+SELECT c.id, v.hits, %s
+FROM (VALUES {}) v(slug, hits)
+JOIN mirrors_component c ON c.slug = v.slug
+"""
+
+
+class AccessCounter(object):
+    """Counts reads in memory and writes them out in batches.
+
+    :param interval: how many seconds to count for before writing the
+                     counts out
+    :type interval: float
+    """
+    def __init__(self, interval=DEFAULT_FLUSH_INTERVAL):
+        self.interval = interval
+
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._flushed_at = time.time()
+
+    def add(self, slug, count=1):
+        """Count a read of a component, writing out the counts if it has
+        been long enough since the last time.
+
+        :param slug: the slug of the component
+        :type slug: str
+        :param count: how many reads to count
+        :type count: int
+        """
+        with self._lock:
+            self._counts[slug] += count
+            due = time.time() - self._flushed_at >= self.interval
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Add the counts so far to the database and start again from
+        zero.
+        """
+        with self._lock:
+            counts = self._counts
+            self._counts = collections.Counter()
+            self._flushed_at = time.time()
+
+        if not counts:
+            return
+
+        try:
+            write_counts(counts, timezone.now())
+        except Exception:
+            # losing an interval's worth of counts isn't worth failing a
+            # request over
+            LOGGER.exception('failed to write out access counts')
+
+    def __len__(self):
+        return len(self._counts)
+
+
+def write_counts(counts, now):
+    """Add some read counts to the database, in a statement or two.
+
+    :param counts: the number of reads of each component, by slug
+    :type counts: dict
+    :param now: the time of the reads
+    :type now: :class:`datetime.datetime`
+    """
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                _write_counts(counts, now)
+            return
+        except IntegrityError:
+            # another process made some of the same rows first; they will
+            # be updated the second time
+            if attempt:
+                raise
+
+
+def _write_counts(counts, now):
+    cursor = connection.cursor()
+
+    values = ', '.join(['(%s, %s)'] * len(counts))
+    params = [v for item in counts.items() for v in item]
+    cursor.execute(UPDATE_COUNTS_SQL.format(values), [now] + params)
+    updated = set(row[0] for row in cursor.fetchall())
+
+    rest = [(slug, n) for slug, n in counts.items() if slug not in updated]
+    if rest:
+        values = ', '.join(['(%s, %s)'] * len(rest))
+        cursor.execute(INSERT_COUNTS_SQL.format(values),
+                       [now] + [v for item in rest for v in item])
+
+
+def get_counter():
+    """Get the access counter of this process.
+
+    :rtype: :class:`AccessCounter`, or None if counting is turned off
+    """
+    global _counter
+
+    with _counter_lock:
+        if _counter is None:
+            interval = getattr(settings, 'MIRRORS_ACCESS_FLUSH_INTERVAL',
+                               DEFAULT_FLUSH_INTERVAL)
+            _counter = AccessCounter(interval) if interval is not None \
+                else False
+
+        return _counter or None
+
+
+def record_access(slug):
+    """Count a read of a component.
+
+    :param slug: the slug of the component
+    :type slug: str
+    """
+    counter = get_counter()
+    if counter is not None:
+        counter.add(slug)
+
+
+def flush():
+    """Write out the counts of this process so far."""
+    counter = get_counter()
+    if counter is not None:
+        counter.flush()
+
+
+@atexit.register
+def _flush_at_exit():
+    if _counter:
+        _counter.flush()
+
+
+@receiver(setting_changed)
+def _reset_counter(sender, setting, **kwargs):
+    global _counter
+
+    if setting == 'MIRRORS_ACCESS_FLUSH_INTERVAL':
+        with _counter_lock:
+            _counter = None
+
+
+def hottest(count, since=None):
+    """Find the components that have been read the most.
+
+    :param count: how many to find
+    :type count: int
+    :param since: only count components read since then
+    :type since: :class:`datetime.datetime`
+    :rtype: list of slugs, most read first
+    """
+    stats = ComponentAccessStat.objects.all()
+    if since is not None:
+        stats = stats.filter(last_accessed__gte=since)
+
+    return list(stats.order_by('-count', 'component__slug').values_list(
+        'component__slug', flat=True)[:count])
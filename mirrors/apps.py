@@ -25,6 +25,9 @@ class MirrorsConfig(apps.AppConfig):
             else:
                 add_components(comps)
 
+        # connects the receivers that invalidate cached component trees
+        from mirrors import cache  # noqa
+
 
 def add_components(comps):
     for component_name in dir(comps):
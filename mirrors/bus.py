@@ -0,0 +1,240 @@
+"""Telling every process when cached component trees have gone stale.
+
+Each process keeps its own copy of the components it has served most recently
+(see :class:`mirrors.cache.LocalCache`), in front of the cache they all share.
+When a write invalidates some trees in the shared cache, the slugs are
+published on an invalidation bus, and every process listening on it drops its
+own copies of them.
+
+The bus is the class named by the ``MIRRORS_INVALIDATION_BUS`` setting,
+instantiated with the keyword arguments in
+``MIRRORS_INVALIDATION_BUS_OPTIONS``. :class:`LocalBus`, the default, only
+reaches the current process, which is enough for a single process and for
+tests; :class:`PostgresBus` reaches every process that uses the same database,
+through ``LISTEN``/``NOTIFY``.
+"""
+import json
+import logging
+import os
+import select
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+
+import psycopg2
+import psycopg2.extensions
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BUS = 'mirrors.bus.LocalBus'
+
+_bus = None
+_bus_pid = None
+_bus_lock = threading.Lock()
+
+# NOTIFY payloads have to be shorter than 8000 bytes
+MAX_PAYLOAD = 7000
+
+
+def get_bus():
+    """Get the invalidation bus of this process, starting it the first time,
+    and again in a process forked from one that had started it, since the
+    threads of the parent don't carry over.
+
+    :rtype: :class:`InvalidationBus`
+    """
+    global _bus, _bus_pid
+
+    with _bus_lock:
+        if _bus is None or _bus_pid != os.getpid():
+            bus_class = import_string(getattr(
+                settings, 'MIRRORS_INVALIDATION_BUS', DEFAULT_BUS))
+            options = getattr(settings, 'MIRRORS_INVALIDATION_BUS_OPTIONS',
+                              {})
+
+            _bus = bus_class(**options)
+            _bus_pid = os.getpid()
+            _bus.start()
+
+        return _bus
+
+
+def reset_bus():
+    """Stop the invalidation bus of this process, so that the next call to
+    :func:`get_bus` starts a new one, with the current settings.
+    """
+    global _bus
+
+    with _bus_lock:
+        if _bus is not None:
+            _bus.stop()
+            _bus = None
+
+
+class InvalidationBus(object):
+    """Carries the slugs of components whose trees have gone stale to every
+    process that subscribed to it.
+    """
+    # whether publishing reaches every process using the same cache, so
+    # that subscribers can rely on it alone
+    reaches_all_processes = False
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """Call ``callback`` with a list of slugs whenever some are published,
+        or with None when messages might have been missed and everything
+        should be treated as stale.
+
+        :param callback: the function to call
+        :type callback: callable
+        """
+        self._subscribers.append(callback)
+
+    def publish(self, slugs):
+        """Tell every subscriber, in every process, that the trees of
+        ``slugs`` are stale.
+
+        :param slugs: the slugs of the components
+        :type slugs: list of str
+        """
+        raise NotImplementedError
+
+    def dispatch(self, slugs):
+        for callback in self._subscribers:
+            try:
+                callback(slugs)
+            except Exception:
+                LOGGER.exception('invalidation subscriber failed')
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class LocalBus(InvalidationBus):
+    """A bus that only reaches the process it is in."""
+    def publish(self, slugs):
+        self.dispatch(list(slugs))
+
+
+class PostgresBus(InvalidationBus):
+    """A bus over Postgres ``NOTIFY``, which reaches every process connected
+    to the same database.
+
+    Messages are sent on the Django connection, so they are only delivered
+    once the transaction that sent them commits, and never if it rolls back.
+    Each process listens on a connection of its own, in a background thread.
+    Whenever that connection has to be made again, messages may have been
+    missed, so subscribers are told to treat everything as stale. That isn't
+    done the first time, so that the trees a process warmed up before it
+    forked (see :mod:`mirrors.warmup`) survive its workers starting to
+    listen.
+
+    :param channel: the name of the channel to notify and listen on
+    :type channel: str
+    :param database: the alias of the database to use
+    :type database: str
+    :param poll_interval: the longest the listener waits for messages before
+                          checking whether it has been stopped, and how long
+                          it waits before connecting again after an error, in
+                          seconds
+    :type poll_interval: float
+    """
+    reaches_all_processes = True
+
+    def __init__(self, channel='mirrors_invalidate', database='default',
+                 poll_interval=5.0):
+        super(PostgresBus, self).__init__()
+
+        self.channel = channel
+        self.database = database
+        self.poll_interval = poll_interval
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def publish(self, slugs):
+        cursor = connections[self.database].cursor()
+
+        for chunk in self._chunks(slugs):
+            cursor.execute('SELECT pg_notify(%s, %s)',
+                           [self.channel, json.dumps(chunk)])
+
+    def _chunks(self, slugs):
+        chunk = []
+        size = 2
+
+        for slug in slugs:
+            length = len(json.dumps(slug)) + 2
+            if chunk and size + length > MAX_PAYLOAD:
+                yield chunk
+                chunk = []
+                size = 2
+
+            chunk.append(slug)
+            size += length
+
+        if chunk:
+            yield chunk
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._listen,
+                                        name='mirrors-invalidation-bus')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+        if self._thread is not None:
+            self._thread.join(self.poll_interval * 2)
+            self._thread = None
+
+    def _connect(self):
+        params = connections[self.database].get_connection_params()
+        conn = psycopg2.connect(**params)
+        conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+        conn.cursor().execute('LISTEN "{}"'.format(
+            self.channel.replace('"', '""')))
+        return conn
+
+    def _listen(self):
+        connected = False
+
+        while not self._stopped.is_set():
+            conn = None
+
+            try:
+                conn = self._connect()
+                if connected:
+                    # anything published while reconnecting may have been
+                    # missed
+                    self.dispatch(None)
+                connected = True
+
+                while not self._stopped.is_set():
+                    readable, _, _ = select.select([conn], [], [],
+                                                   self.poll_interval)
+                    if not readable:
+                        continue
+
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.dispatch(json.loads(notify.payload))
+            except (psycopg2.Error, select.error, ValueError):
+                LOGGER.exception('lost the invalidation bus connection')
+                self._stopped.wait(self.poll_interval)
+            finally:
+                if conn is not None:
+                    conn.close()
@@ -0,0 +1,955 @@
+"""Caching of serialized components.
+
+Each component's serialized form is cached on its own, with its attributes
+given as slugs, under a key made of its slug, its head version, its attribute
+generation and the time it was last updated. Every write to a component
+(:meth:`mirrors.models.Component.new_revision`, attribute changes, ``PATCH``
+requests) changes at least one of those, so a write makes the old entry
+unreachable and there is nothing to delete; stale entries just age out.
+
+Rendering a component looks up the keys of everything in its tree with one
+query, fetches them all from the cache at once, renders only the ones that
+are missing (from a single :class:`mirrors.tree.ComponentTree`) and then puts
+the tree together. Hits and misses are counted in each process and added to
+counts in the cache itself every ``MIRRORS_CACHE_STATS_FLUSH_INTERVAL``
+seconds (10 unless set), so that :func:`stats` covers every process that
+shares it without costing every request a round trip per count.
+
+Fully expanded components, which is what the publishing front end asks for,
+are also cached whole by :func:`render_tree`, along with the ``(component,
+version)`` pairs they were made from. Those entries can't tell by themselves
+that one of the components below has changed, so every write sends
+:data:`mirrors.models.component_changed`, and :func:`invalidate` walks the
+attributes upward from the component that changed and invalidates the trees
+of it and of everything that includes it, and nothing else.
+
+In front of the shared cache, each process keeps the documents and trees it
+has used most recently in a :class:`LocalCache`. Documents never go stale,
+since their keys change instead; trees are dropped from every process's copy
+by the invalidation bus (see :mod:`mirrors.bus`) when they are invalidated,
+and are never kept for longer than ``MIRRORS_LOCAL_CACHE_TIMEOUT`` seconds in
+case a message is lost. With a bus that only reaches the current process,
+such as the default one, each use of a tree copy checks its generation in the
+shared cache instead.
+
+The cache is configured with the ``MIRRORS_CACHE`` setting, which names one
+of the caches in ``CACHES`` (``'default'`` unless set; None turns caching
+off), and ``MIRRORS_CACHE_TIMEOUT``, in seconds. ``MIRRORS_LOCAL_CACHE_SIZE``
+is how many entries each process keeps (0 turns that off). Expanded trees are
+only cached if ``MIRRORS_CACHE_TREES`` is set, or failing that if the cache
+is shared between processes (see :func:`trees_cached`).
+"""
+import atexit
+import collections
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+
+from mirrors import bus
+
+from mirrors.models import Component, component_changed
+from mirrors.serializers import ComponentSerializer
+from mirrors.serializers import ComponentWithDataSerializer
+from mirrors.tree import ComponentTree
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 60 * 60 * 24
+DEFAULT_LOCAL_SIZE = 1000
+DEFAULT_LOCAL_TIMEOUT = 60
+DEFAULT_STALE_TIMEOUT = 60 * 5
+DEFAULT_LOCK_TIMEOUT = 10
+DEFAULT_STATS_FLUSH_INTERVAL = 10
+
+# how often a process waiting for another one to render something checks
+# whether it has finished, in seconds
+POLL_INTERVAL = 0.05
+
+KEY_PREFIX = 'mirrors'
+STATS_KEYS = {
+    'hits': KEY_PREFIX + ':stats:hits',
+    'misses': KEY_PREFIX + ':stats:misses',
+    'tree_hits': KEY_PREFIX + ':stats:tree_hits',
+    'tree_misses': KEY_PREFIX + ':stats:tree_misses',
+    'suppressed': KEY_PREFIX + ':stats:suppressed',
+    'stale': KEY_PREFIX + ':stats:stale',
+}
+
+# the in-process tier, made by get_local_cache(), and the pid it belongs to
+_local_cache = None
+_local_pid = None
+_local_lock = threading.Lock()
+
+# the hit and miss counts of this process that haven't been added to the
+# shared cache yet, when they last were, and the pid they were counted in
+_pending_stats = collections.Counter()
+_stats_flushed_at = time.time()
+_stats_pid = os.getpid()
+_stats_lock = threading.Lock()
+
+# what single_flight() is rendering in this process, by cache key
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def get_cache():
+    """Get the cache that serialized components are kept in.
+
+    :rtype: a Django cache, or None if caching is turned off
+    """
+    alias = getattr(settings, 'MIRRORS_CACHE', 'default')
+
+    if alias is None:
+        return None
+    else:
+        return caches[alias]
+
+
+def trees_cached():
+    """Decide whether expanded trees are cached whole. A tree entry is only
+    correct for as long as every write invalidates it, and writes only reach
+    the cache of the process that made them if it is kept in process memory,
+    so unless ``MIRRORS_CACHE_TREES`` says otherwise, trees are only cached
+    when the cache is shared.
+
+    :rtype: bool
+    """
+    cache = get_cache()
+    if cache is None:
+        return False
+
+    setting = getattr(settings, 'MIRRORS_CACHE_TREES', None)
+    if setting is not None:
+        return setting
+
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+def get_local_cache():
+    """Get the cache this process keeps in front of the shared one, creating
+    it and subscribing it to the invalidation bus the first time. A process
+    forked from one that had it keeps the entries, and subscribes them to a
+    bus of its own.
+
+    :rtype: :class:`LocalCache`, or None if it is turned off
+    """
+    global _local_cache, _local_pid
+
+    with _local_lock:
+        if _local_cache is None:
+            size = getattr(settings, 'MIRRORS_LOCAL_CACHE_SIZE',
+                           DEFAULT_LOCAL_SIZE)
+
+            if get_cache() is None or not size:
+                _local_cache = False
+            else:
+                _local_cache = LocalCache(
+                    size, getattr(settings, 'MIRRORS_LOCAL_CACHE_TIMEOUT',
+                                  DEFAULT_LOCAL_TIMEOUT))
+                bus.get_bus().subscribe(_local_cache.evict_trees)
+                _local_pid = os.getpid()
+        elif _local_cache and _local_pid != os.getpid():
+            bus.get_bus().subscribe(_local_cache.evict_trees)
+            _local_pid = os.getpid()
+
+        return _local_cache or None
+
+
+@receiver(setting_changed)
+def _reset_local_cache(sender, setting, **kwargs):
+    global _local_cache
+
+    if setting == 'CACHES' or setting.startswith('MIRRORS_'):
+        with _local_lock:
+            _local_cache = None
+        with _stats_lock:
+            _pending_stats.clear()
+        bus.reset_bus()
+
+
+class LocalCache(object):
+    """A bounded cache of the entries used most recently, kept in this
+    process and shared by its threads. Entries expire after ``timeout``
+    seconds however recently they were used.
+
+    :param max_entries: how many entries to keep
+    :type max_entries: int
+    :param timeout: how many seconds to keep an entry for
+    :type timeout: float
+    """
+    def __init__(self, max_entries=DEFAULT_LOCAL_SIZE,
+                 timeout=DEFAULT_LOCAL_TIMEOUT):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # bumped whenever entries are evicted, so that something rendered
+        # before that can't be stored after it
+        self.evictions = 0
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """Get the entries with the given keys that are in the cache, marking
+        them as just used.
+
+        :rtype: dict of key to value
+        """
+        now = time.time()
+        found = {}
+
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+
+                if entry is None:
+                    continue
+                elif entry[1] < now:
+                    del self._entries[key]
+                else:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[0]
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def set(self, key, value, since=None):
+        self.set_many({key: value}, since)
+
+    def set_many(self, mapping, since=None):
+        """Store some entries, dropping the ones used least recently if there
+        isn't room.
+
+        :param mapping: the entries to store
+        :type mapping: dict of key to value
+        :param since: if given, the value of :attr:`evictions` from before the
+                      entries were made; they aren't stored if anything has
+                      been evicted since
+        :type since: int
+        """
+        expires = time.time() + self.timeout
+
+        with self._lock:
+            if since is not None and since != self.evictions:
+                return
+
+            for key, value in mapping.items():
+                self._entries[key] = (value, expires)
+                self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            self.evictions += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.evictions += 1
+            self._entries.clear()
+
+    def evict_trees(self, slugs):
+        """Drop the expanded trees of some components, or every tree if
+        ``slugs`` is None. This is what the invalidation bus calls.
+
+        :param slugs: the slugs of the components
+        :type slugs: list of str
+        """
+        if slugs is None:
+            with self._lock:
+                self.evictions += 1
+                for key in [key for key in self._entries
+                            if key.startswith(KEY_PREFIX + ':tree:')]:
+                    del self._entries[key]
+        else:
+            self.delete_many([tree_key(slug, shared) for slug in slugs
+                              for shared in (False, True)])
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_timeout():
+    """Get how many seconds serialized components are kept in the cache.
+
+    :rtype: int
+    """
+    return getattr(settings, 'MIRRORS_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def get_stale_timeout():
+    """Get how many seconds past its expiry, or after it was invalidated, a
+    tree may still be served while a new one is being made.
+
+    :rtype: int
+    """
+    return getattr(settings, 'MIRRORS_CACHE_STALE_TIMEOUT',
+                   DEFAULT_STALE_TIMEOUT)
+
+
+def get_lock_timeout():
+    """Get how many seconds a process may take to render something before
+    others stop waiting for it and render it themselves.
+
+    :rtype: int
+    """
+    return getattr(settings, 'MIRRORS_CACHE_LOCK_TIMEOUT',
+                   DEFAULT_LOCK_TIMEOUT)
+
+
+class Flight(object):
+    """Something being rendered by one thread, that others are waiting
+    for.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = True
+
+
+def single_flight(key, build, ready=None, stale=None):
+    """Call ``build`` to make whatever is cached under ``key``, unless it is
+    already being made, so that a miss on something popular makes it once
+    rather than once per request.
+
+    Only one thread in a process makes it at a time; the others wait for its
+    result. Across processes, the one that gets a lock in the shared cache
+    makes it, and the others wait for ``ready`` to find it in the cache or for
+    the lock to go away, when they make it themselves. Either way, a caller
+    with a ``stale`` value is given that right away instead of waiting.
+
+    :param key: the cache key of what is being made
+    :type key: str
+    :param build: makes it, and caches it
+    :type build: callable
+    :param ready: gets it from the shared cache once it has been made, or
+                  returns None
+    :type ready: callable
+    :param stale: an out of date value that can be used in the meantime
+    :rtype: whatever ``build`` returns
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight()
+
+    if not leader:
+        if stale is not None:
+            record(suppressed=1, stale=1)
+            return stale
+
+        if flight.done.wait(get_lock_timeout()) and not flight.failed:
+            record(suppressed=1)
+            return flight.result
+
+        return build()
+
+    try:
+        flight.result = _single_flight_across(key, build, ready, stale)
+        flight.failed = False
+        return flight.result
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def _single_flight_across(key, build, ready, stale):
+    cache = get_cache()
+    if cache is None:
+        return build()
+
+    lock_key = key + ':lock'
+    timeout = get_lock_timeout()
+
+    if cache.add(lock_key, True, timeout):
+        try:
+            return build()
+        finally:
+            cache.delete(lock_key)
+
+    if stale is not None:
+        record(suppressed=1, stale=1)
+        return stale
+
+    deadline = time.time() + timeout
+    while True:
+        time.sleep(POLL_INTERVAL)
+
+        # the lock is checked first, so that if it's gone and the result
+        # isn't there the process holding it must have given up
+        locked = cache.get(lock_key) is not None
+        result = ready() if ready is not None else None
+
+        if result is not None:
+            record(suppressed=1)
+            return result
+        if not locked or time.time() >= deadline:
+            return build()
+
+
+class StaleDocument(collections.OrderedDict):
+    """An expanded tree served by :func:`render_tree` while a new one is
+    being made. It was made from an older state of the component than the
+    current one, so it mustn't be sent with the validators of that.
+    """
+
+
+def node_key(node):
+    """Get the cache key for the serialized form of a component.
+
+    :param node: the component, or a :class:`mirrors.models.TreeNode`
+    :rtype: str
+    """
+    return '{}:component:{}:{}:{}:{:%Y%m%d%H%M%S%f}'.format(
+        KEY_PREFIX, node.slug, node.head_version, node.attribute_generation,
+        node.updated_at)
+
+
+def render_node(component, tree):
+    """Serialize a single component, with its attributes given as slugs and
+    with ``data_uri`` if it has data.
+
+    :param component: the component to serialize
+    :type component: :class:`mirrors.models.Component`
+    :param tree: a tree the component is part of
+    :type tree: :class:`mirrors.tree.ComponentTree`
+    :rtype: :class:`collections.OrderedDict`
+    """
+    if component.data_uri is not None:
+        serializer_class = ComponentWithDataSerializer
+    else:
+        serializer_class = ComponentSerializer
+
+    data = serializer_class(component, tree=tree, references=True).data
+    return collections.OrderedDict(data)
+
+
+def tree_key(slug, shared=False):
+    """Get the cache key for the fully expanded serialized form of a
+    component.
+
+    :param slug: the slug of the component
+    :type slug: str
+    :param shared: whether it's the form with a ``components`` map
+    :type shared: bool
+    :rtype: str
+    """
+    return '{}:tree:{}:{}'.format(KEY_PREFIX, slug,
+                                  'shared' if shared else 'nested')
+
+
+def generation_key(slug):
+    """Get the cache key for the current generation of the expanded forms of
+    a component. A cached tree is only used if it was made in the current
+    generation, and :func:`invalidate` starts a new one.
+
+    :param slug: the slug of the component
+    :type slug: str
+    :rtype: str
+    """
+    return '{}:tree:{}:generation'.format(KEY_PREFIX, slug)
+
+
+def get_documents(slug, nodes=None):
+    """Get the serialized form of a component and of everything reachable
+    from it, from the cache where possible.
+
+    :param slug: the slug of the component
+    :type slug: str
+    :param nodes: the tree, if it has already been looked up with
+                  :meth:`mirrors.models.ComponentManager.tree_nodes`
+    :type nodes: list of :class:`mirrors.models.TreeNode`
+    :rtype: dict of slug to :class:`collections.OrderedDict`, empty if there
+            is no such component
+    """
+    cache = get_cache()
+    if nodes is None:
+        nodes = Component.objects.tree_nodes(slug)
+
+    if len(nodes) == 0:
+        return {}
+
+    keys = dict((node_key(node), node.slug) for node in nodes)
+    local = get_local_cache()
+
+    found = local.get_many(list(keys.keys())) if local is not None else {}
+    remaining = [key for key in keys if key not in found]
+    if cache is not None and remaining:
+        shared = cache.get_many(remaining)
+        if local is not None:
+            local.set_many(shared)
+        found.update(shared)
+
+    documents = dict((keys[key], doc) for key, doc in found.items())
+
+    missing = len(nodes) - len(documents)
+    if missing:
+        wanted = dict((key, keys[key]) for key in keys if key not in found)
+
+        def ready():
+            done = cache.get_many(list(wanted.keys()))
+            if len(done) == len(wanted):
+                return dict((wanted[key], doc) for key, doc in done.items())
+
+        rendered = single_flight(
+            '{}:documents:{}'.format(KEY_PREFIX, slug),
+            lambda: _render_documents(slug, documents), ready=ready)
+        documents.update(rendered)
+
+        if any(node.slug not in documents for node in nodes):
+            # somebody else rendered a different state of the tree
+            documents.update(_render_documents(slug, documents))
+
+    if cache is not None:
+        record(hits=len(found), misses=missing)
+
+    return documents
+
+
+def _render_documents(slug, documents):
+    # render and cache the documents of the tree under slug that aren't in
+    # documents already
+    cache = get_cache()
+    local = get_local_cache()
+
+    root = Component.objects.get(slug=slug)
+    tree = ComponentTree.load(root)
+    result = {}
+    rendered = {}
+
+    for component in tree:
+        if component.slug not in documents:
+            doc = render_node(component, tree)
+            result[component.slug] = doc
+            # keyed by the state it was rendered from, which may be newer
+            # than what tree_nodes saw
+            rendered[node_key(component)] = doc
+
+    if cache is not None:
+        cache.set_many(rendered, get_timeout())
+    if local is not None:
+        local.set_many(rendered)
+
+    return result
+
+
+def render_component(slug, max_depth=None, shared=False):
+    """Serialize a component the way :class:`ComponentSerializer` would,
+    including ``data_uri`` if it has data, using the cache.
+
+    :param slug: the slug of the component
+    :type slug: str
+    :param max_depth: how many attributes deep to render components in full
+    :type max_depth: int
+    :param shared: whether to render every component once, in a top-level
+                   ``components`` map
+    :type shared: bool
+    :rtype: :class:`collections.OrderedDict`, or None if there is no such
+            component
+    """
+    if max_depth is None:
+        return render_tree(slug, shared)
+
+    documents = get_documents(slug)
+
+    if slug not in documents:
+        return None
+
+    if shared:
+        return share(documents, slug, max_depth)
+    else:
+        return expand(documents, slug, (slug,), max_depth)
+
+
+def render_tree(slug, shared=False):
+    """Serialize a component fully expanded, using the cached tree if it is
+    still current, which takes no queries at all.
+
+    :param slug: the slug of the component
+    :type slug: str
+    :param shared: whether to render every component once, in a top-level
+                   ``components`` map
+    :type shared: bool
+    :rtype: :class:`collections.OrderedDict`, a :class:`StaleDocument` if an
+            out of date tree is served while a new one is being made, or None
+            if there is no such component
+    """
+    if not trees_cached():
+        documents = get_documents(slug)
+        return _assemble(documents, slug, shared)
+
+    cache = get_cache()
+
+    key = tree_key(slug, shared)
+    gen_key = generation_key(slug)
+
+    local = get_local_cache()
+    if local is not None:
+        evictions = local.evictions
+        held = local.get(key)
+
+        # a bus that reaches every process drops this copy when the tree is
+        # invalidated anywhere; with one that doesn't, the copy is checked
+        # against the generation in the shared cache, which is much smaller
+        # than the tree
+        if held is not None and (bus.get_bus().reaches_all_processes or
+                                 cache.get(gen_key) == held[0]):
+            record(tree_hits=1)
+            return held[1]
+
+    found = cache.get_many([key, gen_key])
+    generation = found.get(gen_key)
+    if generation is None:
+        cache.add(gen_key, uuid.uuid4().hex, None)
+        generation = cache.get(gen_key)
+
+    entry = found.get(key)
+    if _is_current(entry, generation):
+        record(tree_hits=1)
+        if local is not None:
+            local.set(key, (generation, entry['document']), since=evictions)
+        return entry['document']
+
+    def build():
+        # the generation is read before the tree, so if the tree changes
+        # while this is rendering the entry is already out of date when it
+        # is stored
+        nodes = Component.objects.tree_nodes(slug)
+        documents = get_documents(slug, nodes)
+        document = _assemble(documents, slug, shared)
+        record(tree_misses=1)
+
+        if document is not None:
+            timeout = get_timeout()
+            cache.set(key, {
+                'generation': generation,
+                'expires': time.time() + timeout,
+                'depends': [(node.slug, node.head_version,
+                             node.attribute_generation) for node in nodes],
+                'document': document,
+            }, timeout + get_stale_timeout())
+
+            if local is not None:
+                local.set(key, (generation, document), since=evictions)
+
+        return document
+
+    def ready():
+        entry = cache.get(key)
+        if _is_current(entry, generation):
+            return entry['document']
+
+    return single_flight(key, build, ready=ready,
+                         stale=StaleDocument(entry['document']) if entry
+                         else None)
+
+
+def _is_current(entry, generation):
+    # whether a cached tree can be used as it is; one that isn't may still
+    # be served while somebody else makes a new one
+    return (entry is not None and entry['generation'] == generation and
+            entry['expires'] > time.time())
+
+
+def tree_dependencies(slug, shared=False):
+    """Get the components that the cached expanded form of a component was
+    made from, as they were at the time.
+
+    :param slug: the slug of the component
+    :type slug: str
+    :param shared: whether it's the form with a ``components`` map
+    :type shared: bool
+    :rtype: list of ``(slug, version, attribute generation)`` tuples, or None
+            if it isn't cached
+    """
+    if not trees_cached():
+        return None
+
+    cache = get_cache()
+    entry = cache.get(tree_key(slug, shared))
+    if not _is_current(entry, cache.get(generation_key(slug))):
+        return None
+
+    return [tuple(dep) for dep in entry['depends']]
+
+
+def invalidate(component_ids):
+    """Invalidate the cached expanded forms of some components and of every
+    component that includes them, however far up.
+
+    :param component_ids: the ids of the components that have changed
+    :type component_ids: list of int
+    """
+    if not trees_cached():
+        return
+
+    slugs = Component.objects.ancestor_slugs(component_ids)
+    _invalidate_slugs(get_cache(), slugs)
+
+
+def _invalidate_slugs(cache, slugs, keep_stale=True):
+    if not slugs:
+        return
+
+    # a new generation rather than deleting the generation key, so that an
+    # entry can't become current again if the key is evicted and re-added.
+    # the old trees are left in place to be served while new ones are made.
+    cache.set_many(dict((generation_key(slug), uuid.uuid4().hex)
+                        for slug in slugs), None)
+    if not keep_stale:
+        cache.delete_many([tree_key(slug, shared) for slug in slugs
+                           for shared in (False, True)])
+
+    # this process's copies go right away, and everybody else's once the
+    # message gets to them
+    local = get_local_cache()
+    if local is not None:
+        local.evict_trees(slugs)
+        bus.get_bus().publish(slugs)
+
+    LOGGER.debug('invalidated the trees of {}'.format(', '.join(slugs)))
+
+
+@receiver(component_changed)
+def _component_changed(sender, component_id, **kwargs):
+    invalidate([component_id])
+
+
+@receiver(post_delete, sender=Component)
+def _component_deleted(sender, instance, **kwargs):
+    # the components that included it have already been invalidated when its
+    # attributes were deleted along with it
+    if trees_cached():
+        _invalidate_slugs(get_cache(), [instance.slug], keep_stale=False)
+
+
+def _assemble(documents, slug, shared):
+    if slug not in documents:
+        return None
+
+    if shared:
+        return share(documents, slug)
+    else:
+        return expand(documents, slug, (slug,))
+
+
+def _child_document(documents, slug):
+    doc = collections.OrderedDict(documents[slug])
+    doc.pop('data_uri', None)
+    return doc
+
+
+def _refs(value):
+    return value if isinstance(value, list) else [value]
+
+
+def expand(documents, slug, path, max_depth=None):
+    """Put together the nested serialized form of a component from the
+    documents of its tree, the same way :class:`ComponentSerializer` nests
+    them.
+
+    :param documents: the documents, by slug, as from :func:`get_documents`
+    :param slug: the slug of the component to start from
+    :param path: the slugs of the components it is nested in, and its own
+    :rtype: :class:`collections.OrderedDict`
+    """
+    if len(path) == 1:
+        doc = collections.OrderedDict(documents[slug])
+    else:
+        doc = _child_document(documents, slug)
+
+    attributes = {}
+    for name, value in doc['attributes'].items():
+        expanded = []
+
+        for child in _refs(value):
+            if (child in path or child not in documents or
+                    (max_depth is not None and len(path) > max_depth)):
+                expanded.append(child)
+            else:
+                expanded.append(expand(documents, child, path + (child,),
+                                       max_depth))
+
+        attributes[name] = expanded if isinstance(value, list) \
+            else expanded[0]
+
+    doc['attributes'] = attributes
+    return doc
+
+
+def share(documents, slug, max_depth=None):
+    """Put together the serialized form of a component with every component
+    below it in a ``components`` map, the way :class:`ComponentSerializer`
+    does with ``shared``.
+
+    :param documents: the documents, by slug, as from :func:`get_documents`
+    :param slug: the slug of the component to start from
+    :rtype: :class:`collections.OrderedDict`
+    """
+    doc = collections.OrderedDict(documents[slug])
+    components = collections.OrderedDict()
+
+    seen = set([slug])
+    level = [slug]
+    depth = 0
+
+    while level and (max_depth is None or depth < max_depth):
+        depth += 1
+        next_level = []
+
+        for parent in level:
+            for value in documents[parent]['attributes'].values():
+                for child in _refs(value):
+                    if child not in seen and child in documents:
+                        seen.add(child)
+                        next_level.append(child)
+                        components[child] = _child_document(documents, child)
+
+        level = next_level
+
+    doc['components'] = components
+    return doc
+
+
+def record(hits=0, misses=0, tree_hits=0, tree_misses=0, suppressed=0,
+           stale=0):
+    """Add to the hit and miss counts of the cache. They are kept in this
+    process until :func:`flush_stats` adds them to the shared counts, which
+    happens here once ``MIRRORS_CACHE_STATS_FLUSH_INTERVAL`` seconds have
+    passed since the last time.
+
+    :param hits: how many documents were found in the cache
+    :type hits: int
+    :param misses: how many had to be rendered
+    :type misses: int
+    :param tree_hits: how many expanded trees were found in the cache
+    :type tree_hits: int
+    :param tree_misses: how many had to be put together
+    :type tree_misses: int
+    :param suppressed: how many renders were saved by waiting for another
+                       one, or by serving a stale tree
+    :type suppressed: int
+    :param stale: how many stale trees were served
+    :type stale: int
+    """
+    global _stats_pid
+
+    if get_cache() is None:
+        return
+
+    counts = {'hits': hits, 'misses': misses, 'tree_hits': tree_hits,
+              'tree_misses': tree_misses, 'suppressed': suppressed,
+              'stale': stale}
+    interval = getattr(settings, 'MIRRORS_CACHE_STATS_FLUSH_INTERVAL',
+                       DEFAULT_STATS_FLUSH_INTERVAL)
+
+    with _stats_lock:
+        if _stats_pid != os.getpid():
+            # forked; the parent adds what it counted before that itself
+            _pending_stats.clear()
+            _stats_pid = os.getpid()
+
+        _pending_stats.update(counts)
+        due = time.time() - _stats_flushed_at >= interval
+
+    if due:
+        flush_stats()
+
+
+def flush_stats():
+    """Add the hit and miss counts of this process to the ones in the
+    shared cache, with one ``incr`` per count that has changed.
+    """
+    global _pending_stats, _stats_flushed_at
+
+    with _stats_lock:
+        counts = _pending_stats
+        _pending_stats = collections.Counter()
+        _stats_flushed_at = time.time()
+
+    cache = get_cache()
+    if cache is None:
+        return
+
+    for name, count in counts.items():
+        if count:
+            key = STATS_KEYS[name]
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                # add() only sets the key if it's still missing, so it
+                # doesn't race with other processes counting
+                if not cache.add(key, count, None):
+                    try:
+                        cache.incr(key, count)
+                    except ValueError:
+                        # evicted again; losing a count isn't worth more
+                        pass
+
+
+@atexit.register
+def _flush_stats_at_exit():
+    if _pending_stats:
+        try:
+            flush_stats()
+        except Exception:
+            LOGGER.exception('failed to write out cache stats')
+
+
+def stats():
+    """Get the hit and miss counts of the cache, across every process that
+    shares it. Those other processes have counted since their last
+    :func:`flush_stats` aren't in them yet.
+
+    :rtype: dict with ``hits``, ``misses`` and ``hit_rate`` keys for
+            single components, ``tree_hits``, ``tree_misses`` and
+            ``tree_hit_rate`` for expanded trees, and ``suppressed`` and
+            ``stale`` for renders saved by :func:`single_flight`
+    """
+    flush_stats()
+
+    cache = get_cache()
+    counts = cache.get_many(list(STATS_KEYS.values())) \
+        if cache is not None else {}
+
+    result = dict((name, counts.get(key, 0))
+                  for name, key in STATS_KEYS.items())
+
+    for prefix in ('', 'tree_'):
+        hits = result[prefix + 'hits']
+        total = hits + result[prefix + 'misses']
+        result[prefix + 'hit_rate'] = float(hits) / total if total else None
+
+    return result
+
+
+def reset_stats():
+    """Set the hit and miss counts back to zero."""
+    with _stats_lock:
+        _pending_stats.clear()
+
+    cache = get_cache()
+    if cache is not None:
+        cache.delete_many(list(STATS_KEYS.values()))
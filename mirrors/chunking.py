@@ -0,0 +1,84 @@
+import hashlib
+
+from django.conf import settings
+
+
+# blobs at least this large are split into chunks; None, the default, turns
+# chunking off, since splitting costs CPU time on every upload
+DEFAULT_THRESHOLD = None
+
+MIN_CHUNK_SIZE = 8 * 1024
+MAX_CHUNK_SIZE = 128 * 1024
+
+# each byte value is given a fixed random bit, and a boundary is placed after
+# the first run of 15 bytes whose bits spell out BOUNDARY_PATTERN. That makes
+# chunks 32KB long on average, plus the minimum that is skipped.
+BIT_TABLE = bytes.maketrans(
+    bytes(range(256)),
+    bytes(b'01'[hashlib.sha256(bytes([b])).digest()[0] & 1]
+          for b in range(256)))
+BOUNDARY_PATTERN = b'011010001110110'
+
+
+def should_chunk(size):
+    """Decide whether a blob of ``size`` bytes is stored as chunks, according
+    to the ``MIRRORS_CHUNKING_THRESHOLD`` setting.
+
+    :rtype: bool
+    """
+    threshold = getattr(settings, 'MIRRORS_CHUNKING_THRESHOLD',
+                        DEFAULT_THRESHOLD)
+
+    return threshold is not None and size >= threshold
+
+
+def find_boundary(data):
+    """Find where the first chunk of ``data`` ends. Boundaries only depend
+    on the 15 bytes before them, so an edit only moves the boundaries close to
+    it and the rest of the chunks come out the same as before. The bytes are
+    translated and searched with :meth:`bytes.translate` and
+    :meth:`bytes.find`, rather than looked at one at a time in Python.
+
+    :param data: the data to split
+    :type data: bytes
+    :rtype: int
+    """
+    if len(data) <= MIN_CHUNK_SIZE:
+        return len(data)
+
+    limit = min(len(data), MAX_CHUNK_SIZE)
+    bits = data[:limit].translate(BIT_TABLE)
+
+    start = MIN_CHUNK_SIZE - len(BOUNDARY_PATTERN)
+    found = bits.find(BOUNDARY_PATTERN, start)
+    if found == -1:
+        return limit
+
+    return found + len(BOUNDARY_PATTERN)
+
+
+def split(f):
+    """Split the content of a file into content-defined chunks, reading it a
+    piece at a time.
+
+    :param f: the file to split
+    :type f: file-like object
+    :rtype: generator of bytes
+    """
+    buf = b''
+    eof = False
+
+    while True:
+        while not eof and len(buf) < MAX_CHUNK_SIZE:
+            block = f.read(MAX_CHUNK_SIZE)
+            if block:
+                buf += block
+            else:
+                eof = True
+
+        if not buf:
+            return
+
+        cut = find_boundary(buf)
+        yield buf[:cut]
+        buf = buf[cut:]
@@ -0,0 +1,158 @@
+import fnmatch
+import gzip
+import json
+import lzma
+import zlib
+
+from django.conf import settings
+
+
+# the encodings blobs can be stored in. gzip is also an HTTP content coding,
+# so gzipped blobs can be sent to clients as they are.
+ENCODINGS = {
+    'gzip': '.gz',
+    'lzma': '.xz',
+}
+
+HTTP_ENCODINGS = ('gzip',)
+
+# (content type pattern, encoding, level); the first matching entry wins and
+# content types that match nothing aren't compressed
+DEFAULT_POLICY = [
+    ('text/*', 'gzip', 6),
+    ('application/json', 'gzip', 6),
+    ('application/javascript', 'gzip', 6),
+    ('application/xml', 'gzip', 6),
+    ('application/x-markdown', 'gzip', 6),
+    ('image/svg+xml', 'gzip', 6),
+]
+
+# metadata that serializes to fewer bytes than this is stored as it is
+DEFAULT_METADATA_THRESHOLD = 1024
+DEFAULT_METADATA_LEVEL = 6
+
+
+def get_policy(content_type):
+    """Work out how data of the given content type should be compressed,
+    according to the ``MIRRORS_COMPRESSION`` setting. The setting is a list of
+    ``(pattern, encoding, level)`` tuples, where ``pattern`` is matched
+    against the content type with shell-style wildcards, ``encoding`` is one
+    of ``'gzip'`` or ``'lzma'`` (or None to leave matching data alone) and
+    ``level`` is passed on to the compressor.
+
+    :param content_type: the content type of the data
+    :type content_type: str
+    :rtype: an ``(encoding, level)`` tuple, or ``(None, None)``
+    """
+    policy = getattr(settings, 'MIRRORS_COMPRESSION', DEFAULT_POLICY)
+
+    if content_type:
+        content_type = content_type.split(';')[0].strip().lower()
+
+        for pattern, encoding, level in policy:
+            if fnmatch.fnmatchcase(content_type, pattern):
+                return encoding, level
+
+    return None, None
+
+
+def get_compressor(encoding, level):
+    """Get an object that compresses data a chunk at a time, with the same
+    ``compress()``/``flush()`` interface as :func:`zlib.compressobj`.
+
+    :raises: :class:`ValueError` for unknown encodings
+    """
+    if encoding == 'gzip':
+        # wbits of 16 + 15 makes zlib write a gzip header and trailer
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif encoding == 'lzma':
+        return lzma.LZMACompressor(preset=level)
+    else:
+        raise ValueError('unknown encoding {}'.format(encoding))
+
+
+class DecodedFile(object):
+    """A read-only file that decompresses another one as it is read. Seeking
+    works, but going backwards means decompressing from the start again.
+    Closing it closes the underlying file too.
+    """
+    def __init__(self, raw, encoding):
+        self.raw = raw
+
+        if encoding == 'gzip':
+            self.decoded = gzip.GzipFile(fileobj=raw, mode='rb')
+        elif encoding == 'lzma':
+            self.decoded = lzma.LZMAFile(raw)
+        else:
+            raise ValueError('unknown encoding {}'.format(encoding))
+
+    def read(self, size=-1):
+        return self.decoded.read(size)
+
+    def seek(self, offset, whence=0):
+        return self.decoded.seek(offset, whence)
+
+    def tell(self):
+        return self.decoded.tell()
+
+    def close(self):
+        try:
+            self.decoded.close()
+        finally:
+            self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def decode(raw, encoding):
+    """Wrap a file of stored content so that reading it gives the original
+    content back.
+
+    :param raw: the stored content
+    :type raw: file-like object
+    :param encoding: how the content was compressed, or ``''`` if it wasn't
+    :type encoding: str
+    :rtype: file-like object
+    """
+    if not encoding:
+        return raw
+    else:
+        return DecodedFile(raw, encoding)
+
+
+def pack_metadata(metadata):
+    """Compress metadata whose JSON form is at least
+    ``MIRRORS_METADATA_COMPRESSION_THRESHOLD`` bytes long (1024 by default;
+    None turns it off).
+
+    :param metadata: the metadata to store
+    :rtype: a ``(metadata, packed)`` tuple, where exactly one of the two is
+            what should be stored and the other is None
+    """
+    threshold = getattr(settings, 'MIRRORS_METADATA_COMPRESSION_THRESHOLD',
+                        DEFAULT_METADATA_THRESHOLD)
+
+    if metadata is None or threshold is None:
+        return metadata, None
+
+    serialized = json.dumps(metadata).encode('UTF-8')
+    if len(serialized) < threshold:
+        return metadata, None
+
+    level = getattr(settings, 'MIRRORS_METADATA_COMPRESSION_LEVEL',
+                    DEFAULT_METADATA_LEVEL)
+    return None, zlib.compress(serialized, level)
+
+
+def unpack_metadata(packed):
+    """Get back metadata compressed by :func:`pack_metadata`.
+
+    :param packed: the compressed metadata
+    :type packed: bytes
+    :rtype: dict
+    """
+    return json.loads(zlib.decompress(bytes(packed)).decode('UTF-8'))
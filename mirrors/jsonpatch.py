@@ -0,0 +1,113 @@
+"""A small implementation of JSON Patch (RFC 6902), enough to store metadata
+revisions as the differences between them. :func:`diff` only produces
+``add``, ``remove`` and ``replace`` operations, and :func:`apply` only
+understands those.
+"""
+import copy
+
+
+def _escape(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def diff(src, dst, path=''):
+    """Work out the operations that turn ``src`` into ``dst``. Dictionaries are
+    compared key by key and lists of the same length item by item; anything
+    else that differs, including in type (``1``, ``1.0`` and ``True`` are all
+    different in JSON), is replaced whole.
+
+    :param src: the original document
+    :param dst: the new document
+    :param path: the JSON pointer to the documents, when they are part of a
+                 larger one
+    :type path: str
+    :rtype: list of dict
+    """
+    if isinstance(src, dict) and isinstance(dst, dict):
+        ops = []
+
+        for key in src:
+            if key not in dst:
+                ops.append({'op': 'remove',
+                            'path': path + '/' + _escape(key)})
+
+        for key, value in dst.items():
+            child = path + '/' + _escape(key)
+
+            if key not in src:
+                ops.append({'op': 'add', 'path': child, 'value': value})
+            else:
+                ops.extend(diff(src[key], value, child))
+
+        return ops
+
+    if (isinstance(src, list) and isinstance(dst, list) and
+            len(src) == len(dst)):
+        ops = []
+
+        for i, (old, new) in enumerate(zip(src, dst)):
+            ops.extend(diff(old, new, '{}/{}'.format(path, i)))
+
+        return ops
+
+    # == alone would take True for 1, and 1.0 for 1
+    if type(src) is type(dst) and src == dst:
+        return []
+
+    return [{'op': 'replace', 'path': path, 'value': dst}]
+
+
+def _resolve(doc, tokens):
+    for token in tokens:
+        if isinstance(doc, list):
+            doc = doc[int(token)]
+        else:
+            doc = doc[token]
+
+    return doc
+
+
+def apply(doc, patch):
+    """Apply the operations in ``patch`` to a copy of ``doc``.
+
+    :param doc: the document to start from, which isn't changed
+    :param patch: the operations to apply, as made by :func:`diff`
+    :type patch: list of dict
+    :rtype: the patched document
+    :raises: :class:`ValueError` for operations it doesn't understand
+    """
+    doc = copy.deepcopy(doc)
+
+    for op in patch:
+        if op['path'] == '':
+            if op['op'] in ('add', 'replace'):
+                doc = copy.deepcopy(op['value'])
+                continue
+            else:
+                raise ValueError('cannot {} the whole document'.format(
+                    op['op']))
+
+        tokens = [_unescape(t) for t in op['path'].split('/')[1:]]
+        parent = _resolve(doc, tokens[:-1])
+        key = tokens[-1]
+
+        if isinstance(parent, list):
+            key = len(parent) if key == '-' else int(key)
+
+        if op['op'] == 'remove':
+            del parent[key]
+        elif op['op'] == 'replace':
+            parent[key] = copy.deepcopy(op['value'])
+        elif op['op'] == 'add':
+            if isinstance(parent, list):
+                parent.insert(key, copy.deepcopy(op['value']))
+            else:
+                parent[key] = copy.deepcopy(op['value'])
+        else:
+            raise ValueError('unsupported operation {}'.format(op['op']))
+
+    return doc
@@ -0,0 +1,31 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mirrors import cache
+
+
+class Command(BaseCommand):
+    help = ('Show how often serialized components and trees were found in '
+            'the cache')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--reset', action='store_true', default=False,
+                    help='set the counts back to zero afterwards'),
+    )
+
+    def handle(self, *args, **options):
+        counts = cache.stats()
+
+        for prefix, name in (('', 'Components'), ('tree_', 'Trees')):
+            self.stdout.write('{}: {} hits, {} misses'.format(
+                name, counts[prefix + 'hits'], counts[prefix + 'misses']))
+            if counts[prefix + 'hit_rate'] is not None:
+                self.stdout.write('{} hit rate: {:.1%}'.format(
+                    name, counts[prefix + 'hit_rate']))
+
+        self.stdout.write('Renders suppressed: {} ({} served stale)'.format(
+            counts['suppressed'], counts['stale']))
+
+        if options['reset']:
+            cache.reset_stats()
@@ -0,0 +1,64 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mirrors import retention
+
+
+class Command(BaseCommand):
+    args = '[slug ...]'
+    help = ('Remove old revisions according to the retention policy, then '
+            'remove blobs and chunks that are no longer used')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--keep-days', type='int', default=30,
+                    help='keep every revision this many days old or newer'),
+        make_option('--daily-days', type='int', default=365,
+                    help='keep the last revision of each day for revisions '
+                         'up to this many days old'),
+        make_option('--no-monthly', action='store_false', dest='monthly',
+                    default=True,
+                    help="don't keep the last revision of each month for "
+                         'revisions older than that'),
+        make_option('--batch-size', type='int', default=500,
+                    help='how many rows to delete per transaction'),
+        make_option('--after-id', type='int', default=None,
+                    help='resume after the component with this id'),
+        make_option('--sleep', type='float', default=0,
+                    help='seconds to wait between transactions'),
+        make_option('--gc-grace-hours', type='float', default=24,
+                    help='only remove unused blobs and chunks older than '
+                         'this'),
+        make_option('--no-gc', action='store_false', dest='collect',
+                    default=True,
+                    help="don't remove unused blobs and chunks"),
+        make_option('--dry-run', action='store_true', default=False,
+                    help='only report what would be removed'),
+    )
+
+    def handle(self, *slugs, **options):
+        policy = retention.RetentionPolicy(
+            keep_all_days=options['keep_days'],
+            daily_days=options['daily_days'],
+            monthly=options['monthly']
+        )
+
+        report = retention.compact(
+            policy=policy,
+            slugs=slugs,
+            after_id=options['after_id'],
+            batch_size=options['batch_size'],
+            collect=options['collect'],
+            gc_grace=datetime.timedelta(hours=options['gc_grace_hours']),
+            pause=options['sleep'],
+            dry_run=options['dry_run']
+        )
+
+        if options['dry_run']:
+            self.stdout.write('Dry run, nothing was removed')
+        self.stdout.write(str(report))
+        if report.last_component_id is not None:
+            self.stdout.write('Last component: {} (resume with --after-id '
+                              '{})'.format(report.last_component_id,
+                                           report.last_component_id))
@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mirrors.models import Component
+
+
+class Command(BaseCommand):
+    args = '<slug> <version>'
+    help = ('Pin a revision of a component, so that compact_revisions never '
+            'removes it and autosaves are never merged into it')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--unpin', action='store_true', default=False,
+                    help='unpin the revision instead'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: pin_revision {}'.format(self.args))
+
+        slug, version = args
+        try:
+            component = Component.objects.get(slug=slug)
+            component.pin(int(version), pinned=not options['unpin'])
+        except Component.DoesNotExist:
+            raise CommandError('No component {}'.format(slug))
+        except (IndexError, ValueError):
+            raise CommandError('No version {} of {}'.format(version, slug))
+
+        self.stdout.write('{} version {} of {}'.format(
+            'Unpinned' if options['unpin'] else 'Pinned', version, slug))
@@ -0,0 +1,25 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mirrors.models import Component
+
+
+class Command(BaseCommand):
+    help = ('Space out the weights of list attributes that have run out of '
+            'room between entries')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--min-gap', type='int', default=16,
+                    help='renumber lists with entries closer together than '
+                         'this'),
+    )
+
+    def handle(self, *args, **options):
+        crowded = Component.objects.crowded_attributes(options['min_gap'])
+
+        for component_id, name in crowded:
+            component = Component.objects.get(pk=component_id)
+            component.renumber_attribute(name)
+
+        self.stdout.write('Renumbered {} attributes'.format(len(crowded)))
@@ -0,0 +1,42 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mirrors import warmup
+
+
+class Command(BaseCommand):
+    args = '[slug ...]'
+    help = ('Render the trees of the components read the most, or of the '
+            'ones given, into the cache')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--top', type='int', default=warmup.DEFAULT_TOP,
+                    help='how many of the most read components to warm up'),
+        make_option('--schema', action='append', dest='schema_names',
+                    default=[],
+                    help='warm up components with this schema, most read '
+                         'first; can be given more than once'),
+        make_option('--since-days', type='float', default=None,
+                    help='only count components read in this many days'),
+        make_option('--workers', type='int', default=warmup.DEFAULT_WORKERS,
+                    help='how many components to render at a time'),
+        make_option('--shared', action='store_true', default=False,
+                    help='also render the form with a components map'),
+    )
+
+    def handle(self, *slugs, **options):
+        since = None
+        if options['since_days'] is not None:
+            since = timezone.now() - datetime.timedelta(
+                days=options['since_days'])
+
+        chosen = warmup.choose(top=options['top'], slugs=slugs,
+                               schema_names=options['schema_names'],
+                               since=since)
+        report = warmup.warm(chosen, workers=options['workers'],
+                             shared=options['shared'])
+
+        self.stdout.write(str(report))
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+def populate_head_revisions(apps, schema_editor):
+    Component = apps.get_model('mirrors', 'Component')
+
+    for component in Component.objects.all().iterator():
+        revs = component.revisions.order_by('-version')
+        head = revs.first()
+
+        Component.objects.filter(pk=component.pk).update(
+            head_version=head.version if head is not None else 0,
+            head_metadata_revision=revs.filter(metadata__isnull=False).first(),
+            head_data_revision=revs.filter(data__isnull=False).first()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0007_componentlock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='component',
+            name='head_version',
+            field=models.IntegerField(null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='component',
+            name='head_metadata_revision',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='mirrors.ComponentRevision', null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='component',
+            name='head_data_revision',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='mirrors.ComponentRevision', null=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(populate_head_revisions,
+                             reverse_code=lambda apps, schema_editor: None),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+def populate_effective_revisions(apps, schema_editor):
+    ComponentRevision = apps.get_model('mirrors', 'ComponentRevision')
+
+    component_id = None
+    metadata_rev = None
+    data_rev = None
+
+    revs = ComponentRevision.objects.order_by('component', 'version')
+    for rev in revs.iterator():
+        if rev.component_id != component_id:
+            component_id = rev.component_id
+            metadata_rev = None
+            data_rev = None
+
+        ComponentRevision.objects.filter(pk=rev.pk).update(
+            metadata_revision=(None if rev.metadata is not None
+                               else metadata_rev),
+            data_revision=None if rev.data is not None else data_rev
+        )
+
+        if rev.metadata is not None:
+            metadata_rev = rev.pk
+        if rev.data is not None:
+            data_rev = rev.pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0008_component_head_revisions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='componentrevision',
+            name='metadata_revision',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='mirrors.ComponentRevision', null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='componentrevision',
+            name='data_revision',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, to='mirrors.ComponentRevision', null=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(populate_effective_revisions,
+                             reverse_code=lambda apps, schema_editor: None),
+    ]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+from django.db import models, migrations
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# partial indexes can't be described by the model options, so they're managed
+# here directly. each entry is (index name, CREATE statement).
+INDEXES = [
+    ('mirrors_componentrevision_metadata_version',
+     'CREATE INDEX mirrors_componentrevision_metadata_version '
+     'ON mirrors_componentrevision (component_id, version DESC) '
+     'WHERE metadata IS NOT NULL'),
+    ('mirrors_componentrevision_data_version',
+     'CREATE INDEX mirrors_componentrevision_data_version '
+     'ON mirrors_componentrevision (component_id, version DESC) '
+     'WHERE data IS NOT NULL'),
+    ('mirrors_componentattribute_parent_name_weight',
+     'CREATE INDEX mirrors_componentattribute_parent_name_weight '
+     'ON mirrors_componentattribute (parent_id, name, weight)'),
+    ('mirrors_componentlock_active',
+     'CREATE INDEX mirrors_componentlock_active '
+     'ON mirrors_componentlock (component_id, lock_ends_at) '
+     'WHERE NOT broken'),
+]
+
+
+def renumber_duplicate_versions(apps, schema_editor):
+    # concurrent writers could give two revisions of a component the same
+    # version before versions were unique. the revisions of each component
+    # affected are numbered again in order, so that every one keeps a version
+    # of its own, and the new versions are logged.
+    Component = apps.get_model('mirrors', 'Component')
+    ComponentRevision = apps.get_model('mirrors', 'ComponentRevision')
+
+    cursor = schema_editor.connection.cursor()
+    cursor.execute('SELECT DISTINCT component_id '
+                   'FROM mirrors_componentrevision '
+                   'GROUP BY component_id, version HAVING COUNT(*) > 1')
+
+    for (component_id,) in cursor.fetchall():
+        revs = ComponentRevision.objects.filter(
+            component_id=component_id).order_by('version', 'created_at', 'pk')
+        version = 0
+
+        for version, rev in enumerate(revs, 1):
+            if rev.version != version:
+                LOGGER.warning('revision {} of component {} renumbered from '
+                               'version {} to {}'.format(
+                                   rev.pk, component_id, rev.version, version))
+                ComponentRevision.objects.filter(pk=rev.pk).update(
+                    version=version)
+
+        Component.objects.filter(pk=component_id).update(
+            head_version=version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0009_componentrevision_effective_revisions'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicate_versions,
+                             reverse_code=lambda apps, schema_editor: None),
+        migrations.AlterUniqueTogether(
+            name='componentrevision',
+            unique_together=set([('component', 'version')]),
+        ),
+    ] + [
+        migrations.RunSQL(create, 'DROP INDEX {}'.format(name))
+        for name, create in INDEXES
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0010_revision_attribute_lock_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('sha256', models.CharField(max_length=64, serialize=False, primary_key=True)),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AddField(
+            model_name='componentrevision',
+            name='blob',
+            field=models.ForeignKey(related_name='revisions', on_delete=django.db.models.deletion.PROTECT, blank=True, to='mirrors.Blob', null=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0011_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='component',
+            name='attribute_generation',
+            field=models.IntegerField(default=0),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import models, migrations
+
+
+# the partial indexes from 0010 that are replaced by ones on the descriptors
+OLD_INDEXES = [
+    ('mirrors_componentrevision_metadata_version',
+     'CREATE INDEX mirrors_componentrevision_metadata_version '
+     'ON mirrors_componentrevision (component_id, version DESC) '
+     'WHERE metadata IS NOT NULL'),
+    ('mirrors_componentrevision_data_version',
+     'CREATE INDEX mirrors_componentrevision_data_version '
+     'ON mirrors_componentrevision (component_id, version DESC) '
+     'WHERE data IS NOT NULL'),
+]
+
+INDEXES = [
+    ('mirrors_componentrevision_has_metadata_version',
+     'CREATE INDEX mirrors_componentrevision_has_metadata_version '
+     'ON mirrors_componentrevision (component_id, version DESC) '
+     'WHERE has_metadata'),
+    ('mirrors_componentrevision_has_data_version',
+     'CREATE INDEX mirrors_componentrevision_has_data_version '
+     'ON mirrors_componentrevision (component_id, version DESC) '
+     'WHERE has_data'),
+]
+
+
+def describe_revisions(apps, schema_editor):
+    ComponentRevision = apps.get_model('mirrors', 'ComponentRevision')
+
+    revs = ComponentRevision.objects.select_related('blob')
+    for rev in revs.iterator():
+        fields = {
+            'has_metadata': rev.metadata is not None,
+            'has_data': False,
+            'data_size': None,
+            'data_hash': None,
+        }
+
+        if rev.blob_id is not None:
+            fields.update(has_data=True, data_size=rev.blob.size,
+                          data_hash=rev.blob_id)
+        elif rev.data is not None:
+            content = bytes(rev.data)
+            fields.update(has_data=True, data_size=len(content),
+                          data_hash=hashlib.sha256(content).hexdigest())
+
+        ComponentRevision.objects.filter(pk=rev.pk).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0012_component_attribute_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='componentrevision',
+            name='has_metadata',
+            field=models.BooleanField(default=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='componentrevision',
+            name='has_data',
+            field=models.BooleanField(default=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='componentrevision',
+            name='data_size',
+            field=models.BigIntegerField(null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='componentrevision',
+            name='data_hash',
+            field=models.CharField(max_length=64, null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(describe_revisions,
+                             reverse_code=lambda apps, schema_editor: None),
+    ] + [
+        migrations.RunSQL('DROP INDEX {}'.format(name), create)
+        for name, create in OLD_INDEXES
+    ] + [
+        migrations.RunSQL(create, 'DROP INDEX {}'.format(name))
+        for name, create in INDEXES
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0013_componentrevision_descriptors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encoding',
+            field=models.CharField(default='', max_length=16, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(null=True, blank=True),
+            preserve_default=True,
+        ),
+        # everything stored so far was stored as it is
+        migrations.RunSQL('UPDATE mirrors_blob SET stored_size = size',
+                          'SELECT 1'),
+        migrations.AddField(
+            model_name='componentrevision',
+            name='packed_metadata',
+            field=models.BinaryField(null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0014_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Chunk',
+            fields=[
+                ('sha256', models.CharField(max_length=64, serialize=False, primary_key=True)),
+                ('size', models.IntegerField()),
+                ('encoding', models.CharField(default='', max_length=16, blank=True)),
+                ('stored_size', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='BlobChunk',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('index', models.IntegerField()),
+                ('offset', models.BigIntegerField()),
+                ('blob', models.ForeignKey(related_name='manifest', to='mirrors.Blob')),
+                ('chunk', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.PROTECT, to='mirrors.Chunk')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='blobchunk',
+            unique_together=set([('blob', 'index')]),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='chunked',
+            field=models.BooleanField(default=False),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0015_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='componentrevision',
+            name='metadata_delta',
+            field=jsonfield.fields.JSONField(default=None, null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='componentrevision',
+            name='metadata_keyframe',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.PROTECT, blank=True, to='mirrors.ComponentRevision', null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='componentrevision',
+            name='metadata_depth',
+            field=models.IntegerField(default=0),
+            preserve_default=True,
+        ),
+    ]
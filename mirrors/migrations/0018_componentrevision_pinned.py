@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0017_componentrevision_created_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='componentrevision',
+            name='pinned',
+            field=models.BooleanField(default=False),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# lets ComponentManager.referenced_by walk from children to parents with
+# index-only scans, rather than through the plain index on child_id
+INDEXES = [
+    ('mirrors_componentattribute_child_parent',
+     'CREATE INDEX mirrors_componentattribute_child_parent '
+     'ON mirrors_componentattribute (child_id, parent_id)'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0018_componentrevision_pinned'),
+    ]
+
+    operations = [
+        migrations.RunSQL(create, 'DROP INDEX {}'.format(name))
+        for name, create in INDEXES
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mirrors', '0019_componentattribute_child_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComponentAccessStat',
+            fields=[
+                ('component', models.OneToOneField(related_name='access_stat', serialize=False, primary_key=True, to='mirrors.Component')),
+                ('count', models.BigIntegerField(default=0)),
+                ('last_accessed', models.DateTimeField(db_index=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -1,11 +1,21 @@
+import collections
+import contextlib
 import datetime
+import hashlib
+import io
+import json
+import logging
 import re
 import sys
+import threading
 
 from django.dispatch import receiver
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Max
+from django.db import connection, models, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal
 from django.utils.timezone import utc
 from django.utils import timezone
 from django.core.urlresolvers import reverse
@@ -13,8 +23,303 @@ from django.core.urlresolvers import reverse
 from jsonfield import JSONField
 
 
+from mirrors import compression, jsonpatch, storage
 from mirrors.exceptions import LockEnforcementError
 
+LOGGER = logging.getLogger(__name__)
+
+
+# conditions matching the revisions that carry their own metadata or data
+CARRIES = {
+    'metadata': Q(has_metadata=True),
+    'data': Q(has_data=True),
+}
+
+# the columns of a component that new_revision() and the attribute methods
+# keep up to date with statements of their own, and that an ordinary save()
+# of a component mustn't put back as it read them (see Component.save)
+DENORMALIZED_FIELDS = frozenset(['head_version', 'head_metadata_revision',
+                                 'head_data_revision',
+                                 'attribute_generation'])
+
+# the fields of a revision that hold its content, for working out which
+# descriptors a save with update_fields has to fill in again
+METADATA_FIELDS = frozenset(['metadata', 'packed_metadata', 'metadata_delta'])
+DATA_FIELDS = frozenset(['blob', 'blob_id', 'data'])
+
+# what attribute names look like
+ATTRIBUTE_NAME_RE = re.compile(r'^\w[-\w]*$')
+
+
+# how many metadata revisions can be stored as deltas after a full copy before
+# another full copy is stored, unless MIRRORS_METADATA_KEYFRAME_INTERVAL says
+# otherwise. reading metadata never has to replay more deltas than this.
+DEFAULT_KEYFRAME_INTERVAL = 10
+
+# bumps the version counter of a component (by 0 or 1) and returns the new
+# version along with the current head pointers, computing them first if they
+# never have been. the row stays locked until the transaction ends, so
+# concurrent writers to the same component queue up here instead of racing.
+ALLOCATE_VERSION_SQL = """
+UPDATE mirrors_component SET
+    head_version = COALESCE(
+        head_version,
+        (SELECT MAX(version) FROM mirrors_componentrevision
+         WHERE component_id = %s),
+        0) + %s,
+    head_metadata_revision_id = CASE
+        WHEN head_version IS NOT NULL THEN head_metadata_revision_id
+        ELSE (SELECT id FROM mirrors_componentrevision
+              WHERE component_id = %s AND has_metadata
+              ORDER BY version DESC LIMIT 1)
+        END,
+    head_data_revision_id = CASE
+        WHEN head_version IS NOT NULL THEN head_data_revision_id
+        ELSE (SELECT id FROM mirrors_componentrevision
+              WHERE component_id = %s AND has_data
+              ORDER BY version DESC LIMIT 1)
+        END,
+    updated_at = %s
+WHERE id = %s
+RETURNING head_version, head_metadata_revision_id, head_data_revision_id
+"""
+
+# entries of list attributes placed by Component.insert_attribute and
+# move_attribute are spaced this far apart, so that later ones can go in
+# between without touching their neighbours
+ATTRIBUTE_WEIGHT_GAP = 1024
+
+# sets the weights of several attributes at once; the VALUES list is filled in
+# with one (id, weight) pair per attribute
+UPDATE_WEIGHTS_SQL = """
+UPDATE mirrors_componentattribute AS a
+SET weight = v.weight
+FROM (VALUES {}) AS v(id, weight)
+WHERE a.id = v.id
+"""
+
+
+def coalescing_enabled():
+    """Whether metadata autosaves may be merged into the latest revision,
+    which is the case when either ``MIRRORS_AUTOSAVE_COALESCE_SECONDS`` or
+    ``MIRRORS_AUTOSAVE_COALESCE_LOCKS`` is set.
+
+    :rtype: bool
+    """
+    return (getattr(settings, 'MIRRORS_AUTOSAVE_COALESCE_SECONDS', None)
+            is not None or
+            getattr(settings, 'MIRRORS_AUTOSAVE_COALESCE_LOCKS', False))
+
+
+TreeState = collections.namedtuple('TreeState', ['etag', 'last_modified'])
+
+TreeNode = collections.namedtuple('TreeNode', ['id', 'slug', 'head_version',
+                                               'attribute_generation',
+                                               'updated_at'])
+
+Reference = collections.namedtuple('Reference', ['id', 'slug', 'depth'])
+
+# how many attributes up ComponentManager.referenced_by will go
+DEFAULT_REFERENCED_BY_MAX_DEPTH = 10
+
+# sent with the id of a component when anything that goes into its serialized
+# form has changed: a new revision, its attributes or its own fields. Writes
+# that run in a collect_changes() block send it once that has committed.
+component_changed = Signal(providing_args=['component_id'])
+
+_pending_changes = threading.local()
+
+
+@contextlib.contextmanager
+def collect_changes():
+    """Run a block in a transaction, and hold back :data:`component_changed`
+    for the components changed in it until that has committed, so that a
+    concurrent reader can't cache what it reads in the meantime as current.
+    Blocks nested in it add their changes to the outermost one, which sends
+    each id once; nothing is sent if it rolls back.
+
+    Writes to components use this themselves, so it is only needed around
+    several of them that have to be in one transaction.
+    """
+    if getattr(_pending_changes, 'ids', None) is not None:
+        with transaction.atomic():
+            yield
+        return
+
+    ids = _pending_changes.ids = collections.OrderedDict()
+    try:
+        with transaction.atomic():
+            yield
+    finally:
+        _pending_changes.ids = None
+
+    for component_id in ids:
+        component_changed.send(sender=Component, component_id=component_id)
+
+
+def send_changed(component_id):
+    """Send :data:`component_changed` for a component, or add it to those
+    the enclosing :func:`collect_changes` block sends once it has committed.
+
+    :param component_id: the id of the component that has changed
+    :type component_id: int
+    """
+    ids = getattr(_pending_changes, 'ids', None)
+
+    if ids is not None:
+        ids[component_id] = None
+    else:
+        component_changed.send(sender=Component, component_id=component_id)
+
+
+class ComponentManager(models.Manager):
+    def crowded_attributes(self, min_gap=2):
+        """Find the list attributes with entries whose weights are less than
+        ``min_gap`` apart, which leaves little or no room to insert or move
+        entries between them without renumbering.
+
+        :param min_gap: the smallest acceptable difference between weights
+        :type min_gap: int
+        :rtype: list of ``(component id, attribute name)`` tuples
+        """
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT parent_id, name
+            FROM (
+                SELECT parent_id, name,
+                       weight - LAG(weight) OVER (
+                           PARTITION BY parent_id, name ORDER BY weight
+                       ) AS gap
+                FROM mirrors_componentattribute
+            ) gaps
+            WHERE gap < %s
+            GROUP BY parent_id, name
+            ORDER BY parent_id, name
+        """, [min_gap])
+
+        return cursor.fetchall()
+
+    def tree_nodes(self, slug):
+        """Get the state of a :class:`Component` and of every component
+        reachable from it through its attributes, which is everything that
+        goes into its serialized form. This takes a single query and doesn't
+        load any revisions.
+
+        :param slug: the slug of the component
+        :type slug: str
+        :rtype: list of :class:`TreeNode`, empty if there is no such
+                component
+        """
+        cursor = connection.cursor()
+        cursor.execute("""
+            WITH RECURSIVE tree(id) AS (
+                SELECT id FROM mirrors_component WHERE slug = %s
+              UNION
+                SELECT a.child_id
+                FROM mirrors_componentattribute a
+                JOIN tree t ON a.parent_id = t.id
+            )
+            SELECT c.id, c.slug, c.head_version, c.attribute_generation,
+                   c.updated_at
+            FROM mirrors_component c
+            JOIN tree t ON c.id = t.id
+            ORDER BY c.id
+        """, [slug])
+
+        return [TreeNode(*row) for row in cursor.fetchall()]
+
+    def tree_state(self, slug):
+        """Summarize the state of a :class:`Component` and of every component
+        reachable from it through its attributes (see :meth:`tree_nodes`).
+
+        :param slug: the slug of the component
+        :type slug: str
+        :rtype: :class:`TreeState`, or None if there is no such component
+        """
+        nodes = self.tree_nodes(slug)
+
+        if len(nodes) == 0:
+            return None
+
+        digest = hashlib.sha1()
+        for node in nodes:
+            digest.update('{}:{}:{}:{};'.format(
+                node.id, node.head_version, node.attribute_generation,
+                node.updated_at).encode('UTF-8'))
+
+        return TreeState(etag=digest.hexdigest(),
+                         last_modified=max(node.updated_at for node in nodes))
+
+    def referenced_by(self, component, depth=1):
+        """Find the components that refer to ``component`` through their
+        attributes, and the ones that refer to those, and so on up to
+        ``depth`` attributes away, in a single query. A component that can be
+        reached in several ways is only listed once, at the smallest depth.
+
+        :param component: the component to start from
+        :type component: :class:`Component`
+        :param depth: how many attributes up to go; this is capped by the
+                      ``MIRRORS_REFERENCED_BY_MAX_DEPTH`` setting
+        :type depth: int
+        :rtype: list of :class:`Reference`, closest first
+        """
+        max_depth = getattr(settings, 'MIRRORS_REFERENCED_BY_MAX_DEPTH',
+                            DEFAULT_REFERENCED_BY_MAX_DEPTH)
+        depth = min(depth, max_depth)
+
+        cursor = connection.cursor()
+        cursor.execute("""
+            WITH RECURSIVE ancestors(id, depth) AS (
+                SELECT parent_id, 1
+                FROM mirrors_componentattribute
+                WHERE child_id = %s
+              UNION
+                SELECT a.parent_id, t.depth + 1
+                FROM mirrors_componentattribute a
+                JOIN ancestors t ON a.child_id = t.id
+                WHERE t.depth < %s
+            )
+            SELECT c.id, c.slug, r.depth
+            FROM (
+                SELECT id, MIN(depth) AS depth
+                FROM ancestors
+                GROUP BY id
+            ) r
+            JOIN mirrors_component c ON c.id = r.id
+            WHERE c.id <> %s
+            ORDER BY r.depth, c.slug
+        """, [component.pk, depth, component.pk])
+
+        return [Reference(*row) for row in cursor.fetchall()]
+
+    def ancestor_slugs(self, component_ids):
+        """Find the slugs of some components and of every component that
+        refers to them through its attributes, however far up, in a single
+        query. Unlike :meth:`referenced_by` this has no depth limit, since it
+        is used to find every serialized form a change shows up in.
+
+        :param component_ids: the ids of the components to start from
+        :type component_ids: list of int
+        :rtype: list of str
+        """
+        cursor = connection.cursor()
+        cursor.execute("""
+            WITH RECURSIVE ancestors(id) AS (
+                SELECT id FROM mirrors_component WHERE id = ANY(%s)
+              UNION
+                SELECT a.parent_id
+                FROM mirrors_componentattribute a
+                JOIN ancestors t ON a.child_id = t.id
+            )
+            SELECT c.slug
+            FROM mirrors_component c
+            JOIN ancestors t ON c.id = t.id
+            ORDER BY c.slug
+        """, [list(component_ids)])
+
+        return [row[0] for row in cursor.fetchall()]
+
+
 class Component(models.Model):
     """A ``Component`` is the basic type of object for all things in the Mirrors
     content repository. Anything that has a presence in the final output of the
@@ -32,25 +337,110 @@ class Component(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # denormalized pointers to the newest revision, and to the newest
+    # revisions that actually carry metadata and data. these are kept up to
+    # date by new_revision(); a NULL head_version means they haven't been
+    # computed yet (eg. rows loaded from fixtures) and refresh_head() will
+    # fill them in on first use.
+    head_version = models.IntegerField(null=True, blank=True)
+    head_metadata_revision = models.ForeignKey('ComponentRevision',
+                                               null=True, blank=True,
+                                               related_name='+',
+                                               on_delete=models.SET_NULL)
+    head_data_revision = models.ForeignKey('ComponentRevision',
+                                           null=True, blank=True,
+                                           related_name='+',
+                                           on_delete=models.SET_NULL)
+
+    # bumped every time one of this component's attributes changes
+    attribute_generation = models.IntegerField(default=0)
+
+    objects = ComponentManager()
+
+    def save(self, *args, **kwargs):
+        """Save the ``Component``. Saving one that already exists leaves the
+        head pointers and ``attribute_generation`` alone unless they are named
+        in ``update_fields``, since they are written by their own statements
+        and this instance may have been loaded before the latest of those.
+        """
+        if (self.pk is not None and not self._state.adding and
+                kwargs.get('update_fields') is None and
+                not kwargs.get('force_insert', False)):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in DENORMALIZED_FIELDS
+            ]
+
+        super(Component, self).save(*args, **kwargs)
+
     @property
     def data_uri(self):
-        """Get the URI for this ``Component``.
+        """Get the URI of the data of this ``Component``. It points at the
+        revision the current data was stored in rather than at the component,
+        so the content behind it never changes and it can be cached for long.
 
         :rtype: str
         """
-        if self.binary_data is not None:
-            return reverse('component-data', kwargs={'slug': self.slug})
-        else:
+        self._ensure_head()
+
+        if self.head_data_revision_id is None:
             return None
 
+        rev = self._loaded('head_data_revision')
+        if rev is not None:
+            version = rev.version
+        else:
+            # only the version is needed, not the revision
+            version = ComponentRevision.objects.filter(
+                pk=self.head_data_revision_id
+            ).values_list('version', flat=True).first()
+
+        return reverse('component-revision-data', kwargs={
+            'slug': self.slug,
+            'version': version
+        })
+
     @property
     def metadata(self):
         """Get the current metadata from the most recent revision of the
         component.
 
         :rtype: dict
+        :raises: :class:`IndexError`
+        """
+        self._ensure_head()
+
+        if self.head_version == 0:
+            raise IndexError('No such version')
+
+        rev = self.head_metadata_revision
+
+        if rev is not None:
+            return rev.read_metadata()
+        else:
+            return {}
+
+    @property
+    def data_revision(self):
+        """Get the revision that the current data comes from.
+
+        :rtype: :class:`ComponentRevision` or None
         """
-        return self.metadata_at_version(self.max_version)
+        self._ensure_head()
+
+        if self.head_data_revision_id is None:
+            return None
+
+        rev = self._loaded('head_data_revision')
+        if rev is not None:
+            return rev
+
+        # the descriptors and the blob say everything needed to send the
+        # data, so the content columns are only loaded if something reads them
+        return ComponentRevision.objects.select_related('blob').defer(
+            'data', *METADATA_FIELDS
+        ).filter(pk=self.head_data_revision_id).first()
 
     @property
     def binary_data(self):
@@ -58,9 +448,11 @@ class Component(models.Model):
 
         :rtype: bytes
         """
-        try:
-            return self.binary_data_at_version(self.max_version)
-        except IndexError:
+        rev = self.data_revision
+
+        if rev is not None:
+            return rev.read_data()
+        else:
             return None
 
     @property
@@ -71,26 +463,89 @@ class Component(models.Model):
 
         .. note :: If there are no revisions, max_version will be 0
         """
-        version = self.revisions.all().aggregate(Max('version'))
-        if version['version__max'] is None:
-            return 0
-        else:
-            return version['version__max']
+        self._ensure_head()
+        return self.head_version
 
     def _version_in_range(self, version):
         return (version > 0) and (version <= self.max_version)
 
-    def new_revision(self, data=None, metadata=None):
+    def has_version(self, version):
+        """Check whether the :class:`Component` has a revision at the provided
+        version, which it doesn't if the version is out of range or the
+        revision was compacted away by :mod:`mirrors.retention`.
+
+        :param version: The version of the `Component`
+        :type version: int
+
+        :rtype: bool
+        """
+        return (self._version_in_range(version) and
+                self.revisions.filter(version=version).exists())
+
+    def pin(self, version, pinned=True):
+        """Pin the revision at the provided version, so that it is never
+        compacted away by :mod:`mirrors.retention` and autosaves are never
+        merged into it, or unpin it again.
+
+        :param version: The version of the `Component` to pin
+        :type version: int
+        :param pinned: False to unpin the revision instead
+        :type pinned: bool
+
+        :raises: :class:`IndexError`
+        """
+        if not self.revisions.filter(version=version).update(pinned=pinned):
+            raise IndexError('No such version')
+
+    def _loaded(self, name):
+        # the object behind a foreign key, if it has been loaded already
+        return getattr(self, self._meta.get_field(name).get_cache_name(),
+                       None)
+
+    def _ensure_head(self):
+        if self.head_version is None:
+            self.refresh_head()
+
+    def refresh_head(self):
+        """Recalculate ``head_version``, ``head_metadata_revision`` and
+        ``head_data_revision`` from the revisions table and store them. This is
+        only needed for rows that weren't written through
+        :meth:`new_revision`, such as ones loaded from a fixture.
+        """
+        revs = self.revisions.order_by('-version')
+        head = revs.first()
+
+        self.head_version = head.version if head is not None else 0
+        self.head_metadata_revision = revs.filter(CARRIES['metadata']).first()
+        self.head_data_revision = revs.filter(CARRIES['data']).first()
+
+        if self.pk is not None:
+            Component.objects.filter(pk=self.pk).update(
+                head_version=self.head_version,
+                head_metadata_revision=self.head_metadata_revision,
+                head_data_revision=self.head_data_revision
+            )
+
+    def new_revision(self, data=None, metadata=None, user=None):
         """Create a new revision for this ``Component`` object. If the data is not in
         the correct format it will attempt to convert it into a bytes object.
+        The data is kept in the blob store, so content that has been stored
+        before isn't stored again.
 
         Passing None for one of the arguments will result in that data not
         being changed.
 
-        :param data: the actual content of the new revision
-        :type data: bytes
+        When autosave coalescing is turned on (see :meth:`_can_coalesce`), a
+        metadata-only change by the same user that made the latest revision
+        is merged into that revision instead of making a new one.
+
+        :param data: the actual content of the new revision, or a blob that
+                     has already been stored
+        :type data: bytes or :class:`Blob`
         :param metadata: the new metadata
         :type metadata: dict
+        :param user: the user making the change
+        :type user: :class:`django.contrib.auth.models.User`
 
         :rtype: :class:`ComponentRevision`
         :raises: :class:`ValueError`
@@ -98,21 +553,190 @@ class Component(models.Model):
         if not data and not metadata:
             raise ValueError('no new revision data was actually provided')
 
-        next_version = 1
-        cur_rev = self.revisions.all().order_by('-version').first()
-        if cur_rev is not None:
-            next_version = cur_rev.version + 1
+        if data is not None and not isinstance(data, Blob):
+            data = storage.store_blob(data, self.content_type)
+
+        with collect_changes():
+            new_rev = self._write_revision(data, metadata, user)
+            send_changed(self.pk)
+
+        return new_rev
+
+    def _write_revision(self, data, metadata, user):
+        # the part of new_revision that runs in its transaction
+        new_metadata = metadata is not None
 
+        if data is None and user is not None and coalescing_enabled():
+            # lock the component without taking a version, then see if the
+            # latest revision can absorb this change
+            self._allocate_version(increment=0)
+            head = self.head_metadata_revision
+
+            if (head is not None and head.version == self.head_version
+                    and self._can_coalesce(head, user)):
+                return self._coalesce(head, metadata)
+
+        version = self._allocate_version()
+
+        if new_metadata:
+            stored_metadata = self._encode_metadata(metadata)
+        else:
+            stored_metadata = {}
+
+        # a revision that doesn't carry its own metadata or data points
+        # at the one that does, so historical reads don't need to search
         new_rev = ComponentRevision.objects.create(
-            data=data,
-            metadata=metadata,
+            blob=data,
             component=self,
-            version=next_version
+            version=version,
+            created_by=user,
+            metadata_revision_id=(None if new_metadata
+                                  else self.head_metadata_revision_id),
+            data_revision_id=(None if data is not None
+                              else self.head_data_revision_id),
+            **stored_metadata
         )
-        new_rev.save()
+
+        heads = {}
+        if new_metadata:
+            self.head_metadata_revision = new_rev
+            heads['head_metadata_revision'] = new_rev
+        if data is not None:
+            self.head_data_revision = new_rev
+            heads['head_data_revision'] = new_rev
+
+        if heads:
+            Component.objects.filter(pk=self.pk).update(**heads)
 
         return new_rev
 
+    def _can_coalesce(self, rev, user):
+        """Decide whether a metadata change by ``user`` can be merged into
+        ``rev``, the latest revision. That is the case when ``user`` made
+        ``rev``, it only changed the metadata, and either it was last saved
+        less than ``MIRRORS_AUTOSAVE_COALESCE_SECONDS`` ago or, with
+        ``MIRRORS_AUTOSAVE_COALESCE_LOCKS`` set, ``user`` has held a lock on
+        the component since before it was made.
+
+        :rtype: bool
+        """
+        if rev.created_by_id != user.pk or rev.has_data or rev.pinned:
+            return False
+
+        now = timezone.now()
+        window = getattr(settings, 'MIRRORS_AUTOSAVE_COALESCE_SECONDS', None)
+        saved_at = rev.updated_at or rev.created_at
+
+        if window is not None and now - saved_at <= datetime.timedelta(
+                seconds=window):
+            return True
+
+        if getattr(settings, 'MIRRORS_AUTOSAVE_COALESCE_LOCKS', False):
+            lock = self.lock
+            if (lock is not None and lock.locked_by_id == user.pk and
+                    lock.locked_at <= rev.created_at):
+                return True
+
+        return False
+
+    def _coalesce(self, rev, metadata):
+        """Replace the metadata of ``rev`` with ``metadata`` in place.
+
+        :rtype: :class:`ComponentRevision`
+        """
+        for name, value in self._encode_metadata(metadata, rev).items():
+            setattr(rev, name, value)
+
+        rev.updated_at = timezone.now()
+        # only the metadata changes, so the data isn't described again
+        rev.save(update_fields=['metadata', 'packed_metadata',
+                                'metadata_delta', 'metadata_keyframe',
+                                'metadata_depth', 'has_metadata',
+                                'updated_at'])
+
+        LOGGER.debug("coalesced a metadata change into {}".format(rev))
+        return rev
+
+    def _allocate_version(self, increment=1):
+        """Take the next version number for a new revision of this component,
+        and bring the head pointers of this instance up to date with whatever
+        other writers have done. This must be called in a transaction, which
+        holds a lock on the component until it ends. With an ``increment`` of
+        0 the component is locked and touched without taking a version.
+
+        :rtype: int
+        """
+        now = timezone.now()
+
+        cursor = connection.cursor()
+        cursor.execute(ALLOCATE_VERSION_SQL,
+                       [self.pk, increment, self.pk, self.pk, now, self.pk])
+        version, metadata_id, data_id = cursor.fetchone()
+
+        self.head_version = version
+        self.updated_at = now
+
+        for name, pk in (('head_metadata_revision', metadata_id),
+                         ('head_data_revision', data_id)):
+            # drop the cached revision if somebody else has moved the head
+            cache_name = self._meta.get_field(name).get_cache_name()
+            cached = getattr(self, cache_name, None)
+            if cached is not None and cached.pk != pk:
+                delattr(self, cache_name)
+
+            setattr(self, name + '_id', pk)
+
+        return version
+
+    def _encode_metadata(self, metadata, replacing=None):
+        """Work out how ``metadata`` should be stored in a new revision, or in
+        place of the metadata of ``replacing``. It is stored as a JSON patch
+        against the metadata before it when that is smaller than the whole
+        thing, unless there have already been
+        ``MIRRORS_METADATA_KEYFRAME_INTERVAL`` - 1 deltas since the last full
+        copy (a keyframe), in which case it is stored in full.
+
+        :rtype: dict of :class:`ComponentRevision` field values
+        """
+        interval = getattr(settings, 'MIRRORS_METADATA_KEYFRAME_INTERVAL',
+                           DEFAULT_KEYFRAME_INTERVAL)
+        head = self.head_metadata_revision
+        base = None
+
+        if replacing is not None:
+            # a keyframe stays a keyframe, since nothing follows it yet
+            if replacing.metadata_delta is not None:
+                base = (replacing.read_metadata(before=True),
+                        replacing.metadata_keyframe_id,
+                        replacing.metadata_depth)
+        elif (head is not None and interval is not None and
+                head.metadata_depth + 1 < interval):
+            base = (head.read_metadata(),
+                    head.metadata_keyframe_id or head.pk,
+                    head.metadata_depth + 1)
+
+        if base is not None:
+            base_metadata, keyframe_id, depth = base
+            delta = jsonpatch.diff(base_metadata, metadata)
+
+            if len(json.dumps(delta)) < len(json.dumps(metadata)):
+                return {
+                    'metadata': None,
+                    'packed_metadata': None,
+                    'metadata_delta': delta,
+                    'metadata_keyframe_id': keyframe_id,
+                    'metadata_depth': depth,
+                }
+
+        metadata, packed_metadata = compression.pack_metadata(metadata)
+        return {
+            'metadata': metadata,
+            'packed_metadata': packed_metadata,
+            'metadata_delta': None,
+            'metadata_keyframe_id': None,
+            'metadata_depth': 0,
+        }
+
     def new_attribute(self, name, child, weight=-1):
         """Add a new named attribute to the ``Component`` object. This will overwrite
         an attribute if the child is unchanged. However, if the child has a
@@ -136,7 +760,7 @@ class Component(models.Model):
         if not child or child == self:
             raise ValueError('child cannot be None or self')
 
-        if not re.match('^\w[-\w]*$', name):
+        if not ATTRIBUTE_NAME_RE.match(name):
             raise KeyError('invalid attribute name')
 
         # attr never gets used again... just comented this out for now
@@ -152,6 +776,220 @@ class Component(models.Model):
 
         return new_attr
 
+    def set_attribute(self, name, children):
+        """Make the attribute ``name`` hold exactly ``children``, by working
+        out how they differ from what is stored and only inserting, deleting
+        or reweighting the rows that need it, a statement for each at most.
+
+        This bypasses the ``ComponentAttribute`` signals, so the component's
+        ``attribute_generation`` is bumped and :data:`component_changed` sent
+        here instead, once, after the change has committed.
+
+        :param name: the name of the attribute
+        :type name: str
+        :param children: the children and their weights, where each child is
+                         a :class:`Component` or its id
+        :type children: list of ``(child, weight)`` tuples
+        :rtype: bool, whether anything changed
+        """
+        wanted = [(getattr(child, 'pk', child), weight)
+                  for child, weight in children]
+
+        with collect_changes():
+            # concurrent replacements of the attribute go one at a time
+            Component.objects.select_for_update().filter(pk=self.pk).exists()
+
+            stored = collections.defaultdict(list)
+            for pk, child_id, weight in self.attributes.filter(
+                    name=name).order_by('weight', 'pk').values_list(
+                    'pk', 'child_id', 'weight'):
+                stored[child_id].append((pk, weight))
+
+            # rows that are already right are left alone first, so that a
+            # child that appears more than once keeps the right rows
+            unmatched = []
+            for child_id, weight in wanted:
+                rows = stored[child_id]
+                match = [row for row in rows if row[1] == weight]
+
+                if match:
+                    rows.remove(match[0])
+                else:
+                    unmatched.append((child_id, weight))
+
+            updates = []
+            inserts = []
+            for child_id, weight in unmatched:
+                rows = stored[child_id]
+
+                if rows:
+                    updates.append((rows.pop(0)[0], weight))
+                else:
+                    inserts.append(ComponentAttribute(parent=self, name=name,
+                                                      child_id=child_id,
+                                                      weight=weight))
+
+            deletes = [pk for rows in stored.values() for pk, weight in rows]
+
+            cursor = connection.cursor()
+
+            if deletes:
+                cursor.execute('DELETE FROM mirrors_componentattribute '
+                               'WHERE id = ANY(%s)', [deletes])
+
+            if updates:
+                values = ', '.join(['(%s, %s)'] * len(updates))
+                cursor.execute(UPDATE_WEIGHTS_SQL.format(values),
+                               [v for update in updates for v in update])
+
+            if inserts:
+                ComponentAttribute.objects.bulk_create(inserts)
+
+            changed = bool(deletes or updates or inserts)
+            if changed:
+                Component.objects.filter(pk=self.pk).update(
+                    attribute_generation=F('attribute_generation') + 1,
+                    updated_at=timezone.now()
+                )
+                send_changed(self.pk)
+
+        return changed
+
+    def insert_attribute(self, name, child, before=None, after=None):
+        """Add ``child`` to the list attribute ``name``, right before or after
+        the entry for another component, or at the end if neither is given.
+        The new entry gets a weight halfway between its neighbours, so no
+        other entry has to change unless there is no room left between them.
+
+        :param name: the name of the attribute
+        :type name: str
+        :param child: the component to add
+        :type child: :class:`Component`
+        :param before: the component whose entry the new one goes before
+        :type before: :class:`Component`
+        :param after: the component whose entry the new one goes after
+        :type after: :class:`Component`
+        :rtype: :class:`ComponentAttribute`
+        :raises: :class:`KeyError` if ``before`` or ``after`` isn't in the
+                 list, :class:`ValueError` if both are given
+        """
+        if not ATTRIBUTE_NAME_RE.match(name):
+            raise KeyError('invalid attribute name')
+
+        with collect_changes():
+            Component.objects.select_for_update().filter(pk=self.pk).exists()
+
+            weight = self._weight_between(name, before, after)
+            attr = ComponentAttribute(parent=self, child=child, name=name,
+                                      weight=weight)
+            attr.save()
+
+        return attr
+
+    def move_attribute(self, name, child, before=None, after=None):
+        """Move the entry for ``child`` in the list attribute ``name`` to right
+        before or after the entry for another component, or to the end if
+        neither is given. Only the moved entry is changed, unless there is no
+        room left between its new neighbours.
+
+        :param name: the name of the attribute
+        :type name: str
+        :param child: the component whose entry to move
+        :type child: :class:`Component`
+        :param before: the component whose entry it goes before
+        :type before: :class:`Component`
+        :param after: the component whose entry it goes after
+        :type after: :class:`Component`
+        :rtype: :class:`ComponentAttribute`
+        :raises: :class:`KeyError` if ``child``, ``before`` or ``after`` isn't
+                 in the list, :class:`ValueError` if both ``before`` and
+                 ``after`` are given
+        """
+        with collect_changes():
+            Component.objects.select_for_update().filter(pk=self.pk).exists()
+
+            attr = self.attributes.filter(name=name, child=child).order_by(
+                'weight', 'pk').first()
+            if attr is None:
+                raise KeyError("'{}' is not in '{}'".format(child.slug, name))
+
+            attr.weight = self._weight_between(name, before, after,
+                                               moving=attr)
+            attr.save(update_fields=['weight'])
+
+        return attr
+
+    def _weight_between(self, name, before, after, moving=None):
+        # the weight for an entry going just before or after another one,
+        # renumbering the list first if there is no room there
+        if before is not None and after is not None:
+            raise ValueError('only one of before and after can be given')
+
+        for attempt in range(2):
+            entries = self.attributes.filter(name=name)
+            if moving is not None:
+                entries = entries.exclude(pk=moving.pk)
+            entries = list(entries.order_by('weight', 'pk').values_list(
+                'child_id', 'weight'))
+
+            anchor = before if before is not None else after
+            if anchor is None:
+                if len(entries) == 0:
+                    return ATTRIBUTE_WEIGHT_GAP
+                return entries[-1][1] + ATTRIBUTE_WEIGHT_GAP
+
+            children = [child_id for child_id, weight in entries]
+            if anchor.pk not in children:
+                raise KeyError("'{}' is not in '{}'".format(anchor.slug,
+                                                            name))
+            index = children.index(anchor.pk)
+
+            if before is not None:
+                low = entries[index - 1][1] if index > 0 else 0
+                high = entries[index][1]
+            elif index + 1 < len(entries):
+                low = entries[index][1]
+                high = entries[index + 1][1]
+            else:
+                return entries[index][1] + ATTRIBUTE_WEIGHT_GAP
+
+            if high - low >= 2:
+                return (low + high) // 2
+
+            self.renumber_attribute(name)
+
+        raise ValueError('no room in the weights of {}'.format(name))
+
+    def renumber_attribute(self, name):
+        """Space the entries of the list attribute ``name`` evenly again,
+        keeping their order, so that there is room to put entries between
+        them. This is done when an insert or a move runs out of room, and by
+        the ``renumber_attributes`` management command.
+
+        :param name: the name of the attribute
+        :type name: str
+        """
+        with collect_changes():
+            Component.objects.select_for_update().filter(pk=self.pk).exists()
+
+            rows = self.attributes.filter(name=name).order_by(
+                'weight', 'pk').values_list('pk', flat=True)
+            updates = [(pk, (n + 1) * ATTRIBUTE_WEIGHT_GAP)
+                       for n, pk in enumerate(rows)]
+
+            if updates:
+                values = ', '.join(['(%s, %s)'] * len(updates))
+                connection.cursor().execute(
+                    UPDATE_WEIGHTS_SQL.format(values),
+                    [v for update in updates for v in update])
+
+                # the weights are part of what the attribute API returns
+                Component.objects.filter(pk=self.pk).update(
+                    attribute_generation=F('attribute_generation') + 1,
+                    updated_at=timezone.now()
+                )
+                send_changed(self.pk)
+
     def get_attribute(self, attribute_name):
         """Retrieve the `Component` object attached to this one by the
         attribute name if it is a regular attribute, or a list if it contains
@@ -186,15 +1024,10 @@ class Component(models.Model):
         :rtype: dict
         :raises: :class:`IndexError`
         """
-        if not self._version_in_range(version):
-            raise IndexError('No such version')
-
-        qs = self.revisions.filter(metadata__isnull=False,
-                                   version__lte=version).order_by('-version')
-        rev = qs.first()
+        rev = self._effective_revision(version, 'metadata')
 
         if rev is not None:
-            return rev.metadata
+            return rev.read_metadata()
         else:
             return {}
 
@@ -209,18 +1042,67 @@ class Component(models.Model):
         :rtype: bytes
         :raises: :class:`IndexError`
         """
+        rev = self.data_revision_at_version(version)
+
+        if rev is not None:
+            return rev.read_data()
+        else:
+            return None
 
+    def data_revision_at_version(self, version):
+        """Get the revision that the binary data of the :class:`Component`
+        came from as of the provided version.
+
+        :param version: The version of the `Component`
+        :type version: int
+
+        :rtype: :class:`ComponentRevision` or None
+        :raises: :class:`IndexError`
+        """
+        return self._effective_revision(version, 'data')
+
+    def _effective_revision(self, version, kind):
+        """Find the revision that supplies the ``kind`` (either ``'metadata'``
+        or ``'data'``) of this component as it was at ``version``.
+
+        Revisions written by :meth:`new_revision` point at the revision their
+        content comes from, so this is a single query. Older rows without that
+        pointer fall back to scanning backwards through the history. Versions
+        removed by compaction raise :class:`IndexError` like ones that never
+        existed.
+
+        :rtype: :class:`ComponentRevision` or None
+        :raises: :class:`IndexError`
+        """
         if not self._version_in_range(version):
             raise IndexError('No such version')
 
-        qs = self.revisions.filter(data__isnull=False,
-                                   version__lte=version).order_by('-version')
-        rev = qs.first()
+        # the descriptors say everything needed about the data, so don't
+        # drag inline data along with the revisions. sending the data needs
+        # the blob but not the metadata
+        pointer = '{}_revision'.format(kind)
+        related = [pointer]
+        deferred = ['data', pointer + '__data']
+        if kind == 'data':
+            related += ['blob', pointer + '__blob']
+            deferred += [prefix + name for prefix in ('', pointer + '__')
+                         for name in METADATA_FIELDS]
+
+        rev = self.revisions.select_related(*related).defer(
+            *deferred).filter(version=version).first()
+
+        if rev is None:
+            # compacted away by mirrors.retention
+            raise IndexError('No such version')
 
-        if rev is not None:
-            return bytes(rev.data)
-        else:
-            return None
+        if rev.carries(kind):
+            return rev
+        elif getattr(rev, pointer + '_id') is not None:
+            return getattr(rev, pointer)
+
+        qs = self.revisions.defer('data').filter(CARRIES[kind],
+                                                 version__lte=version)
+        return qs.order_by('-version').first()
 
     @property
     def lock(self):
@@ -297,6 +1179,8 @@ class ComponentAttribute(models.Model):
 
     added_time = models.DateTimeField(auto_now_add=True)
 
+    # (parent, name, weight) is indexed by migration 0010
+
     def __str__(self):
         if self.weight != -1:
             return "{}[{},{}] -> {}".format(self.parent.slug,
@@ -309,27 +1193,355 @@ class ComponentAttribute(models.Model):
                                         self.child.slug)
 
 
+@receiver(post_save, sender=ComponentAttribute)
+@receiver(post_delete, sender=ComponentAttribute)
+def _attribute_changed(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        # loading fixtures shouldn't look like an edit
+        return
+
+    Component.objects.filter(pk=instance.parent_id).update(
+        attribute_generation=F('attribute_generation') + 1,
+        updated_at=timezone.now()
+    )
+    # held back until the transaction the change is part of has committed,
+    # if it was made in a collect_changes() block
+    send_changed(instance.parent_id)
+
+
+@receiver(post_save, sender=Component)
+def _component_saved(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    send_changed(instance.pk)
+
+
+class Blob(models.Model):
+    """A piece of binary data in the blob store, identified by the SHA-256 hash
+    of its content. Identical content is only ever stored once, no matter how
+    many :class:`ComponentRevision` objects refer to it. The content itself
+    lives in the storage backend returned by
+    :func:`mirrors.storage.get_storage`.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+
+    # how the content is compressed in storage ('' if it isn't), and how much
+    # space it takes up there
+    encoding = models.CharField(max_length=16, blank=True, default='')
+    stored_size = models.BigIntegerField(null=True, blank=True)
+
+    # large blobs are stored as a manifest of chunks (see mirrors.chunking)
+    # rather than in one piece
+    chunked = models.BooleanField(default=False)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def open(self):
+        """Open the content of the blob for reading, decompressing it as it
+        is read.
+
+        :rtype: file-like object
+        """
+        if self.chunked:
+            return storage.ChunkedFile(self)
+        else:
+            return compression.decode(self.open_raw(), self.encoding)
+
+    def open_raw(self):
+        """Open the content of the blob as it is stored, which is compressed
+        if :attr:`encoding` is set.
+
+        :rtype: :class:`django.core.files.File`
+        :raises: :class:`ValueError` if the blob is chunked
+        """
+        if self.chunked:
+            raise ValueError('chunked blobs are not stored in one piece')
+
+        return storage.open_blob(self.sha256, self.encoding)
+
+    def __str__(self):
+        return self.sha256
+
+
+class Chunk(models.Model):
+    """A piece of the content of a chunked :class:`Blob`. Chunks are split off
+    by :func:`mirrors.chunking.split`, which cuts the same content into the
+    same chunks wherever it appears, so a chunk is shared by every blob that
+    contains it and a small edit to a large file only adds a few new chunks.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.IntegerField()
+
+    encoding = models.CharField(max_length=16, blank=True, default='')
+    stored_size = models.IntegerField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+
+class BlobChunk(models.Model):
+    """An entry in the manifest of a chunked :class:`Blob`: the ``index``-th
+    chunk of the blob, which starts ``offset`` bytes into it.
+    """
+    blob = models.ForeignKey('Blob', related_name='manifest',
+                             on_delete=models.CASCADE)
+    chunk = models.ForeignKey('Chunk', related_name='+',
+                              on_delete=models.PROTECT)
+    index = models.IntegerField()
+    offset = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ('blob', 'index')
+
+    def __str__(self):
+        return "{} #{}".format(self.blob_id, self.index)
+
+
 class ComponentRevision(models.Model):
-    """A revision of the data and metadata for a :class:`Component`. It contains
-    the binary data itself. Every time a ``Component``'s data is updated, a new
-    ``ComponentRevision`` is created.
+    """A revision of the data and metadata for a :class:`Component`. The binary
+    data is kept in the blob store and referred to by its hash; revisions made
+    before the blob store existed keep it inline in ``data``. Every time a
+    ``Component``'s data is updated, a new ``ComponentRevision`` is created.
 
     .. warning :: The implementation of this class is incomplete and may change
                   in the future.
 
     """
     data = models.BinaryField(null=True, blank=True)
+    blob = models.ForeignKey('Blob', null=True, blank=True,
+                             related_name='revisions',
+                             on_delete=models.PROTECT)
     metadata = JSONField(default=None, null=True, blank=True)
+    # large metadata is kept compressed here instead (see
+    # mirrors.compression.pack_metadata)
+    packed_metadata = models.BinaryField(null=True, blank=True)
+    # or, as the JSON patch that turns the previous metadata into this one.
+    # the patches are replayed on top of the last full copy, the keyframe;
+    # depth counts the patches since it.
+    metadata_delta = JSONField(default=None, null=True, blank=True)
+    metadata_keyframe = models.ForeignKey('self', null=True, blank=True,
+                                          related_name='+',
+                                          on_delete=models.PROTECT)
+    metadata_depth = models.IntegerField(default=0)
     version = models.IntegerField(null=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # set when an autosave is coalesced into this revision
+    updated_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(User, null=True, blank=True,
+                                   related_name='+',
+                                   on_delete=models.SET_NULL)
+
+    # pinned revisions (eg. ones that were published) are never compacted
+    # away by mirrors.retention, nor have autosaves merged into them
+    pinned = models.BooleanField(default=False)
 
     component = models.ForeignKey('Component', related_name='revisions')
 
+    # when this revision doesn't change the metadata or the data, these point
+    # at the earlier revision that the current value comes from
+    metadata_revision = models.ForeignKey('self', null=True, blank=True,
+                                          related_name='+',
+                                          on_delete=models.SET_NULL)
+    data_revision = models.ForeignKey('self', null=True, blank=True,
+                                      related_name='+',
+                                      on_delete=models.SET_NULL)
+
+    # descriptors of what this revision carries, kept up to date by
+    # _describe_revision so that nothing has to load the data to find out
+    has_metadata = models.BooleanField(default=False)
+    has_data = models.BooleanField(default=False)
+    data_size = models.BigIntegerField(null=True, blank=True)
+    data_hash = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        # partial indexes for the metadata/data lookups are created by
+        # migration 0013
+        unique_together = ('component', 'version')
+
+    def carries(self, kind):
+        """Whether this revision changed the ``kind`` (either ``'metadata'``
+        or ``'data'``) of its component.
+
+        :rtype: bool
+        """
+        if kind == 'data':
+            return self.has_data
+        else:
+            return self.has_metadata
+
+    def describe(self, data=True):
+        """Fill in the ``has_metadata``, ``has_data``, ``data_size`` and
+        ``data_hash`` descriptors from the content of this revision. This is
+        done automatically when a revision is saved, for the content being
+        saved; a save with ``update_fields`` has to list the descriptors of
+        the content it changes as well.
+
+        :param data: whether to describe the data too, which means loading
+                     the blob or hashing inline data, rather than just the
+                     metadata
+        :type data: bool
+        """
+        self.has_metadata = (self.metadata is not None or
+                             self.packed_metadata is not None or
+                             self.metadata_delta is not None)
+
+        if not data:
+            return
+
+        if self.blob_id is not None:
+            self.has_data = True
+            self.data_size = self.blob.size
+            self.data_hash = self.blob_id
+        elif self.data is not None:
+            content = bytes(self.data)
+
+            self.has_data = True
+            self.data_size = len(content)
+            self.data_hash = hashlib.sha256(content).hexdigest()
+        else:
+            self.has_data = False
+            self.data_size = None
+            self.data_hash = None
+
+    def read_metadata(self, before=False):
+        """Get the metadata stored with this revision itself, decompressing
+        it or replaying the deltas from its keyframe if need be. With
+        ``before``, get the metadata this revision's delta applies to instead.
+
+        :rtype: dict or None
+        """
+        if self.metadata_delta is not None:
+            return self._replay_metadata(before)
+        elif self.packed_metadata is not None:
+            return compression.unpack_metadata(self.packed_metadata)
+        else:
+            return self.metadata
+
+    def _replay_metadata(self, before=False):
+        # the keyframe and every delta up to this one, in a single query
+        if before:
+            upto = Q(version__lt=self.version)
+        else:
+            upto = Q(version__lte=self.version)
+
+        chain = ComponentRevision.objects.filter(
+            Q(pk=self.metadata_keyframe_id) |
+            Q(upto, metadata_keyframe_id=self.metadata_keyframe_id)
+        ).defer('data').order_by('version')
+
+        return _replay_chain(chain)
+
+    def read_data(self):
+        """Get the binary data stored with this revision itself.
+
+        :rtype: bytes or None
+        """
+        if not self.carries('data'):
+            return None
+
+        with self.open_data() as f:
+            return f.read()
+
+    def open_data(self):
+        """Open the binary data stored with this revision for reading, without
+        loading all of it.
+
+        :rtype: file-like object
+        :raises: :class:`ValueError` if the revision has no data
+        """
+        if self.blob_id is not None:
+            return self.blob.open()
+        elif self.data is not None:
+            return io.BytesIO(bytes(self.data))
+        else:
+            raise ValueError('revision has no data')
+
     def __str__(self):
         return "{} v{}".format(self.component.slug, self.version)
 
 
+def _replay_chain(chain):
+    # a keyframe followed by the deltas on top of it, in version order
+    metadata = None
+    for rev in chain:
+        if rev.metadata_delta is None:
+            metadata = rev.read_metadata()
+        else:
+            metadata = jsonpatch.apply(metadata, rev.metadata_delta)
+
+    return metadata
+
+
+def read_metadata_in_bulk(revisions):
+    """Get the metadata stored with each of ``revisions``, like
+    :meth:`ComponentRevision.read_metadata`, but with the deltas of all of
+    them replayed from a single query.
+
+    :param revisions: the revisions to read
+    :type revisions: list of :class:`ComponentRevision`
+    :rtype: dict of revision id to metadata
+    """
+    result = {}
+    deltas = []
+
+    for rev in revisions:
+        if rev.metadata_delta is None:
+            result[rev.pk] = rev.read_metadata()
+        else:
+            deltas.append(rev)
+
+    if len(deltas) == 0:
+        return result
+
+    keyframes = set(rev.metadata_keyframe_id for rev in deltas)
+    chains = collections.defaultdict(list)
+
+    for rev in ComponentRevision.objects.filter(
+            Q(pk__in=keyframes) | Q(metadata_keyframe_id__in=keyframes)
+    ).defer('data').order_by('version'):
+        chains[rev.metadata_keyframe_id or rev.pk].append(rev)
+
+    for rev in deltas:
+        chain = [link for link in chains[rev.metadata_keyframe_id]
+                 if link.version <= rev.version]
+        result[rev.pk] = _replay_chain(chain)
+
+    return result
+
+
+@receiver(pre_save, sender=ComponentRevision)
+def _describe_revision(sender, instance, raw=False, update_fields=None,
+                       **kwargs):
+    # this runs for fixture loads too, which don't go through save(). rows
+    # being inserted, or saved whole, are described in full; updates of
+    # some fields only describe what those fields hold.
+    if raw or instance.pk is None or update_fields is None:
+        instance.describe()
+    elif not DATA_FIELDS.isdisjoint(update_fields):
+        instance.describe()
+    elif not METADATA_FIELDS.isdisjoint(update_fields):
+        instance.describe(data=False)
+
+
+class ComponentAccessStat(models.Model):
+    """How often a :class:`Component` has been read through the API, used to
+    choose what to warm the cache with. The counts are kept in memory and
+    added to these rows in batches by :mod:`mirrors.access`.
+    """
+    component = models.OneToOneField('Component', primary_key=True,
+                                     related_name='access_stat')
+    count = models.BigIntegerField(default=0)
+    last_accessed = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return "{} read {} times".format(self.component.slug, self.count)
+
+
 class ComponentLock(models.Model):
     """ Determines whether a ``Component`` can be edited.
     """
@@ -340,6 +1552,9 @@ class ComponentLock(models.Model):
 
     broken = models.BooleanField(default=False)
 
+    # a partial (component, lock_ends_at) index on unbroken locks is created
+    # by migration 0010
+
     def extend_lock(self, *args, **kwargs):
         """Extend the life time of the current lock. The arguments excepted are the
         same as what is acceptable for use when creating a
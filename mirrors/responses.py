@@ -0,0 +1,271 @@
+import calendar
+import re
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.http import StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.utils.http import quote_etag
+
+from rest_framework import status
+
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# for the data of a particular revision. the bytes never change, but the
+# content type and filename it is sent with can, so it isn't immutable and
+# caches revalidate it (by its etag) once a day
+CACHE_VERSIONED = 'public, max-age=86400'
+
+
+def _timestamp(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+def is_not_modified(request, etag, last_modified):
+    """Decide whether the client already has the current representation of a
+    resource, according to the ``If-None-Match`` and ``If-Modified-Since``
+    headers of a ``GET`` or ``HEAD`` request.
+
+    :param request: the request being answered
+    :param etag: the current entity tag of the resource, unquoted
+    :type etag: str
+    :param last_modified: when the resource last changed
+    :type last_modified: :class:`datetime.datetime`
+    :rtype: bool
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+
+    if if_none_match is not None:
+        # If-Modified-Since is only considered when If-None-Match is absent
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+
+    if if_modified_since is not None and last_modified is not None:
+        since = parse_http_date_safe(if_modified_since)
+        return since is not None and _timestamp(last_modified) <= since
+
+    return False
+
+
+def accepts_encoding(request, encoding):
+    """Decide whether the client accepts responses with the given content
+    coding, according to the ``Accept-Encoding`` header of the request.
+
+    :param request: the request being answered
+    :param encoding: a content coding, eg. ``'gzip'``
+    :type encoding: str
+    :rtype: bool
+    """
+    qualities = {}
+
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        parts = item.split(';')
+        coding = parts[0].strip().lower()
+        quality = 1.0
+
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        if coding:
+            qualities[coding] = quality
+
+    # an explicit mention of the coding beats a wildcard
+    return qualities.get(encoding, qualities.get('*', 0.0)) > 0
+
+
+def set_validators(response, etag, last_modified):
+    """Add ``ETag`` and ``Last-Modified`` headers to a response.
+
+    :rtype: the response
+    """
+    response['ETag'] = quote_etag(etag)
+
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(_timestamp(last_modified))
+
+    return response
+
+
+def not_modified(etag, last_modified):
+    """Make a *304* response for a resource the client already has.
+
+    :rtype: :class:`django.http.HttpResponseNotModified`
+    """
+    return set_validators(HttpResponseNotModified(), etag, last_modified)
+
+
+def parse_range(header, size):
+    """Work out which bytes of a ``size`` byte resource a ``Range`` header
+    asks for. Only single byte ranges are supported; anything else (including
+    malformed headers) is ignored, which means the whole resource is sent.
+
+    :param header: the value of the ``Range`` header, if there was one
+    :type header: str
+    :param size: the total length of the resource
+    :type size: int
+    :rtype: a ``(first, last)`` tuple of inclusive offsets, or None
+    :raises: :class:`ValueError` if the range can't be satisfied
+    """
+    if not header:
+        return None
+
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+
+    if first == '' and last == '':
+        return None
+    elif first == '':
+        # a suffix range, eg. bytes=-500 for the last 500 bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError('unsatisfiable range')
+
+        return max(size - length, 0), size - 1
+
+    first = int(first)
+
+    if last != '' and int(last) < first:
+        return None
+
+    if first >= size:
+        raise ValueError('unsatisfiable range')
+
+    if last == '':
+        return first, size - 1
+    else:
+        return first, min(int(last), size - 1)
+
+
+class FileIterator(object):
+    """Reads ``length`` bytes from ``f``, starting at ``offset``, a chunk at a
+    time. The file is closed once it has been read, or when the response it
+    is sent with is closed, which also happens if it never gets read.
+
+    :param f: the file to read
+    :type f: file-like object
+    :param offset: where to start reading
+    :type offset: int
+    :param length: how many bytes to read
+    :type length: int
+    """
+    def __init__(self, f, offset, length):
+        self.f = f
+        self.offset = offset
+        self.length = length
+
+    def __iter__(self):
+        try:
+            self.f.seek(self.offset)
+            remaining = self.length
+
+            while remaining > 0:
+                chunk = self.f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        """Close the file. :class:`django.http.StreamingHttpResponse` calls
+        this when the response is closed.
+        """
+        self.f.close()
+
+
+def file_head_response(size, content_type, filename=None):
+    """Make the response to a ``HEAD`` request for a file, with the headers a
+    ``GET`` would have but without opening the file.
+
+    :param size: the length of the file
+    :type size: int
+    :param content_type: the value of the ``Content-Type`` header
+    :type content_type: str
+    :param filename: the filename to give in ``Content-Disposition``
+    :type filename: str
+    :rtype: :class:`django.http.HttpResponse`
+    """
+    resp = HttpResponse(content_type=content_type)
+    resp['Content-Length'] = str(size)
+    resp['Accept-Ranges'] = 'bytes'
+
+    if filename is not None:
+        resp['Content-Disposition'] = "inline; filename={}".format(filename)
+
+    return resp
+
+
+def file_response(request, f, size, content_type, filename=None,
+                  etag=None):
+    """Stream the contents of an open file back to the client, honoring any
+    ``Range`` header in the request. If an ``etag`` is given, an ``If-Range``
+    header that doesn't match it causes the whole file to be sent.
+
+    :param request: the request being answered
+    :param f: the file to send, which is closed when the response is done
+    :type f: file-like object
+    :param size: the length of the file
+    :type size: int
+    :param content_type: the value of the ``Content-Type`` header
+    :type content_type: str
+    :param filename: the filename to give in ``Content-Disposition``
+    :type filename: str
+    :param etag: the entity tag of the file, unquoted
+    :type etag: str
+    :rtype: :class:`django.http.StreamingHttpResponse`
+    """
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+
+    if if_range is not None and parse_etags(if_range) != [etag]:
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        f.close()
+
+        resp = HttpResponse(
+            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        resp['Content-Range'] = 'bytes */{}'.format(size)
+        return resp
+
+    if byte_range is None:
+        first, last = 0, size - 1
+        code = status.HTTP_200_OK
+    else:
+        first, last = byte_range
+        code = status.HTTP_206_PARTIAL_CONTENT
+
+    length = last - first + 1
+
+    resp = StreamingHttpResponse(FileIterator(f, first, length),
+                                 content_type=content_type,
+                                 status=code)
+    resp['Content-Length'] = str(length)
+    resp['Accept-Ranges'] = 'bytes'
+
+    if code == status.HTTP_206_PARTIAL_CONTENT:
+        resp['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, size)
+
+    if filename is not None:
+        resp['Content-Disposition'] = "inline; filename={}".format(filename)
+
+    return resp
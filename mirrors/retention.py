@@ -0,0 +1,420 @@
+"""Compaction of revision history.
+
+:func:`compact` walks through components, deletes the revisions a
+:class:`RetentionPolicy` doesn't want to keep, and then removes the blobs and
+chunks that nothing refers to any more. Revisions that are kept but got their
+metadata or data from a deleted revision are given a copy of it first, so
+every version that is still there reads exactly as it did before.
+
+The work is done one component, and one batch of revisions, per transaction,
+so the live site only ever waits on a single component for a moment, and an
+interrupted run can simply be started again (or resumed after the last
+component it reported).
+"""
+import datetime
+import logging
+import time
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from mirrors import compression, storage
+from mirrors.models import Blob, BlobChunk, Chunk, Component
+from mirrors.models import ComponentRevision
+from mirrors.models import collect_changes, send_changed
+
+
+LOGGER = logging.getLogger(__name__)
+
+REVISION_BYTES_SQL = """
+SELECT COALESCE(SUM(COALESCE(octet_length(data), 0) +
+                    COALESCE(octet_length(metadata), 0) +
+                    COALESCE(octet_length(packed_metadata), 0) +
+                    COALESCE(octet_length(metadata_delta), 0)), 0)
+FROM mirrors_componentrevision
+WHERE id = ANY(%s)
+"""
+
+
+class RetentionPolicy(object):
+    """Which revisions of a component to keep: every revision from the last
+    ``keep_all_days`` days, then the last revision of each day for revisions
+    up to ``daily_days`` days old, then (if ``monthly`` is set) the last
+    revision of each month. Pinned revisions and the ones that make up the
+    current state of the component are always kept.
+
+    :param keep_all_days: how long to keep every revision for
+    :type keep_all_days: int
+    :param daily_days: how long to keep a revision a day for, or None to go
+                       straight to monthly revisions
+    :type daily_days: int
+    :param monthly: whether to keep a revision a month after that
+    :type monthly: bool
+    """
+    def __init__(self, keep_all_days=30, daily_days=365, monthly=True):
+        self.keep_all = datetime.timedelta(days=keep_all_days)
+        if daily_days is not None:
+            self.daily = datetime.timedelta(days=daily_days)
+        else:
+            self.daily = None
+        self.monthly = monthly
+
+    def select(self, component, revisions, now):
+        """Pick the revisions of ``component`` to keep.
+
+        :param component: the component the revisions belong to
+        :type component: :class:`mirrors.models.Component`
+        :param revisions: all of its revisions, in version order
+        :type revisions: list of :class:`mirrors.models.ComponentRevision`
+        :param now: the time to measure ages from
+        :type now: :class:`datetime.datetime`
+        :rtype: set of revision ids
+        """
+        keep = set([component.head_metadata_revision_id,
+                    component.head_data_revision_id])
+        daily = {}
+        monthly = {}
+
+        for rev in revisions:
+            age = now - rev.created_at
+
+            if (rev.pinned or rev.version == component.head_version or
+                    age <= self.keep_all):
+                keep.add(rev.pk)
+            elif self.daily is not None and age <= self.daily:
+                # later revisions replace earlier ones, so the last of each
+                # day is what's left
+                daily[rev.created_at.date()] = rev.pk
+            elif self.monthly:
+                monthly[(rev.created_at.year, rev.created_at.month)] = rev.pk
+
+        keep.update(daily.values())
+        keep.update(monthly.values())
+        keep.discard(None)
+
+        return keep
+
+
+class RetentionReport(object):
+    """What a call to :func:`compact` did (or, for a dry run, would do)."""
+    def __init__(self):
+        self.components = 0
+        self.revisions = 0
+        self.materialized = 0
+        self.blobs = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.last_component_id = None
+
+    def __str__(self):
+        return ("{} components, {} revisions removed ({} kept revisions "
+                "filled in), {} blobs and {} chunks removed, {} bytes "
+                "reclaimed".format(self.components, self.revisions,
+                                   self.materialized, self.blobs, self.chunks,
+                                   self.bytes))
+
+
+def compact(policy=None, slugs=None, after_id=None, batch_size=500,
+            collect=True, gc_grace=datetime.timedelta(days=1), pause=0,
+            dry_run=False, now=None):
+    """Apply a retention policy to the revision history of every component
+    (or just the ones in ``slugs``), and then collect garbage.
+
+    :param policy: the policy to apply; the default keeps 30 days of every
+                   revision, then a year of dailies, then monthlies
+    :type policy: :class:`RetentionPolicy`
+    :param slugs: the components to compact, if not all of them
+    :type slugs: list of str
+    :param after_id: only compact components with a larger id, to resume an
+                     earlier run
+    :type after_id: int
+    :param batch_size: how many revisions to delete per transaction
+    :type batch_size: int
+    :param collect: whether to remove unreferenced blobs and chunks
+    :type collect: bool
+    :param gc_grace: how old an unreferenced blob or chunk has to be to be
+                     removed, so that uploads in progress are left alone
+    :type gc_grace: :class:`datetime.timedelta`
+    :param pause: seconds to sleep between transactions, to go easy on the
+                  database
+    :type pause: float
+    :param dry_run: only work out what would be removed
+    :type dry_run: bool
+    :param now: the time to measure revision ages from
+    :type now: :class:`datetime.datetime`
+    :rtype: :class:`RetentionReport`
+    """
+    policy = policy or RetentionPolicy()
+    now = now or timezone.now()
+    report = RetentionReport()
+
+    components = Component.objects.order_by('pk')
+    if slugs:
+        components = components.filter(slug__in=slugs)
+    if after_id is not None:
+        components = components.filter(pk__gt=after_id)
+
+    for component_id in components.values_list('pk', flat=True):
+        compact_component(component_id, policy, report, now=now,
+                          batch_size=batch_size, pause=pause,
+                          dry_run=dry_run)
+
+    if collect:
+        collect_garbage(report, grace=gc_grace, batch_size=batch_size,
+                        pause=pause, dry_run=dry_run)
+
+    LOGGER.info("compaction finished: {}".format(report))
+    return report
+
+
+def compact_component(component_id, policy, report, now=None,
+                      batch_size=500, pause=0, dry_run=False):
+    """Apply a retention policy to the history of a single component.
+
+    :param component_id: the id of the component
+    :type component_id: int
+    :param policy: the policy to apply
+    :type policy: :class:`RetentionPolicy`
+    :param report: where to add up what was done
+    :type report: :class:`RetentionReport`
+    """
+    now = now or timezone.now()
+
+    with transaction.atomic():
+        component = Component.objects.select_for_update().get(
+            pk=component_id)
+        component._ensure_head()
+
+        revisions = list(component.revisions.defer(
+            'data', 'metadata', 'packed_metadata', 'metadata_delta'
+        ).order_by('version'))
+
+        keep = policy.select(component, revisions, now)
+        doomed = [rev for rev in revisions if rev.pk not in keep]
+
+        if doomed:
+            fills = _plan_fills(revisions, set(rev.pk for rev in doomed))
+            report.materialized += len(fills)
+
+            if not dry_run:
+                _fill_in(fills)
+
+    report.components += 1
+    report.last_component_id = component_id
+
+    if not doomed:
+        return
+
+    # newest first, so that deltas go before the keyframes they are based on
+    doomed_ids = [rev.pk for rev in reversed(doomed)]
+
+    for start in range(0, len(doomed_ids), batch_size):
+        batch = doomed_ids[start:start + batch_size]
+
+        if dry_run:
+            report.revisions += len(batch)
+            report.bytes += _revision_bytes(batch)
+            continue
+
+        if pause and start:
+            time.sleep(pause)
+
+        with collect_changes():
+            # hold off writers to this component for the length of the batch
+            Component.objects.select_for_update().filter(
+                pk=component_id).exists()
+
+            report.bytes += _revision_bytes(batch)
+
+            revs = ComponentRevision.objects.filter(pk__in=batch)
+            revs.filter(metadata_keyframe__isnull=False).delete()
+            revs.delete()
+
+            # the history changed, so anything cached about it is stale;
+            # the trees that include it are invalidated once this commits
+            Component.objects.filter(pk=component_id).update(
+                updated_at=timezone.now())
+            send_changed(component_id)
+
+        report.revisions += len(batch)
+
+    LOGGER.info("compacted component {}: {} revisions removed".format(
+        component_id, len(doomed_ids)))
+
+
+def _effective(revisions, by_pk, rev, kind):
+    if rev.carries(kind):
+        return rev
+
+    pointer = getattr(rev, '{}_revision_id'.format(kind))
+    if pointer in by_pk:
+        return by_pk[pointer]
+
+    # older rows without pointers
+    earlier = [r for r in revisions
+               if r.version < rev.version and r.carries(kind)]
+    return earlier[-1] if earlier else None
+
+
+def _plan_fills(revisions, doomed):
+    """Work out which of the revisions that are kept need a copy of content
+    that is about to be deleted: those whose metadata or data comes from a
+    doomed revision, and those whose metadata is a delta with a doomed
+    revision earlier in its chain.
+
+    :rtype: list of ``(revision id, metadata source id, data source id)``
+            tuples, where a source id is None if that part is fine
+    """
+    by_pk = dict((rev.pk, rev) for rev in revisions)
+    fills = []
+
+    for rev in revisions:
+        if rev.pk in doomed:
+            continue
+
+        metadata_source = None
+        data_source = None
+
+        source = _effective(revisions, by_pk, rev, 'metadata')
+        if source is not None and source.pk in doomed:
+            metadata_source = source.pk
+        elif rev.metadata_keyframe_id is not None:
+            chain = [r for r in revisions
+                     if r.version < rev.version and
+                     (r.pk == rev.metadata_keyframe_id or
+                      r.metadata_keyframe_id == rev.metadata_keyframe_id)]
+            if any(r.pk in doomed for r in chain):
+                metadata_source = rev.pk
+
+        source = _effective(revisions, by_pk, rev, 'data')
+        if source is not None and source.pk in doomed:
+            data_source = source.pk
+
+        if metadata_source is not None or data_source is not None:
+            fills.append((rev.pk, metadata_source, data_source))
+
+    return fills
+
+
+def _fill_in(fills):
+    # read everything before writing anything, since filling in one revision
+    # changes the delta chains the others are read through
+    contents = []
+    for rev_id, metadata_source, data_source in fills:
+        metadata = None
+        if metadata_source is not None:
+            metadata = ComponentRevision.objects.get(
+                pk=metadata_source).read_metadata()
+
+        data = None
+        if data_source is not None:
+            data = ComponentRevision.objects.only(
+                'blob', 'data').get(pk=data_source)
+
+        contents.append((rev_id, metadata_source, metadata, data))
+
+    for rev_id, metadata_source, metadata, data in contents:
+        rev = ComponentRevision.objects.get(pk=rev_id)
+        fields = []
+
+        if metadata_source is not None:
+            rev.metadata, rev.packed_metadata = compression.pack_metadata(
+                metadata)
+            rev.metadata_delta = None
+            rev.metadata_keyframe = None
+            rev.metadata_depth = 0
+            rev.metadata_revision = None
+            fields += ['metadata', 'packed_metadata', 'metadata_delta',
+                       'metadata_keyframe', 'metadata_depth',
+                       'metadata_revision', 'has_metadata']
+
+        if data is not None:
+            rev.blob_id = data.blob_id
+            rev.data = data.data
+            rev.data_revision = None
+            fields += ['blob', 'data', 'data_revision', 'has_data',
+                       'data_size', 'data_hash']
+
+        # the data is only described again if it was filled in
+        rev.save(update_fields=fields)
+
+
+def _revision_bytes(ids):
+    cursor = connection.cursor()
+    cursor.execute(REVISION_BYTES_SQL, [list(ids)])
+    return cursor.fetchone()[0]
+
+
+def collect_garbage(report, grace=datetime.timedelta(days=1), batch_size=500,
+                    pause=0, dry_run=False):
+    """Remove the blobs that no revision refers to, and then the chunks that
+    no blob refers to, along with their stored content. Only things older
+    than ``grace`` are removed, since content is stored before the revision
+    that refers to it is made; storing content that is already there starts
+    its grace period again.
+
+    Each batch holds :data:`mirrors.storage.STORAGE_LOCK` from before its
+    rows are chosen until their files are gone, so nothing can be stored
+    against them in the meantime.
+
+    :param report: where to add up what was done
+    :type report: :class:`RetentionReport`
+    """
+    cutoff = timezone.now() - grace
+
+    referenced = ComponentRevision.objects.filter(
+        blob__isnull=False).values('blob_id')
+    blobs = Blob.objects.exclude(sha256__in=referenced).filter(
+        created_at__lt=cutoff)
+
+    _collect(blobs, report, 'blobs', batch_size, pause, dry_run,
+             lambda blob: (storage.blob_path(blob.sha256, blob.encoding)
+                           if not blob.chunked else None))
+
+    chunks = Chunk.objects.exclude(
+        sha256__in=BlobChunk.objects.values('chunk_id')).filter(
+        created_at__lt=cutoff)
+
+    _collect(chunks, report, 'chunks', batch_size, pause, dry_run,
+             lambda chunk: storage.chunk_path(chunk.sha256, chunk.encoding))
+
+
+def _collect(queryset, report, counter, batch_size, pause, dry_run, path_of):
+    backend = storage.get_storage()
+
+    if dry_run:
+        for obj in queryset:
+            setattr(report, counter, getattr(report, counter) + 1)
+            if path_of(obj) is not None:
+                report.bytes += obj.stored_size or 0
+        return
+
+    cursor = connection.cursor()
+
+    while True:
+        # held across the commit, so that the files are deleted before
+        # anybody can store the same content again
+        cursor.execute('SELECT pg_advisory_lock(%s)', [storage.STORAGE_LOCK])
+        try:
+            with transaction.atomic():
+                batch = list(queryset.select_for_update()[:batch_size])
+                if not batch:
+                    return
+
+                queryset.model.objects.filter(
+                    pk__in=[obj.pk for obj in batch]).delete()
+
+            for obj in batch:
+                path = path_of(obj)
+                if path is not None:
+                    report.bytes += obj.stored_size or 0
+                    if backend.exists(path):
+                        backend.delete(path)
+        finally:
+            cursor.execute('SELECT pg_advisory_unlock(%s)',
+                           [storage.STORAGE_LOCK])
+
+        setattr(report, counter, getattr(report, counter) + len(batch))
+
+        if pause:
+            time.sleep(pause)
@@ -1,3 +1,4 @@
+import collections
 import json
 import logging
 
@@ -6,6 +7,7 @@ from mirrors.models import Component
 from mirrors.models import ComponentLock
 from mirrors.models import ComponentAttribute
 from mirrors.models import ComponentRevision
+from mirrors.tree import ComponentTree
 
 
 LOGGER = logging.getLogger(__name__)
@@ -41,12 +43,24 @@ class ComponentSerializer(serializers.ModelSerializer):
 
     created_at = serializers.DateTimeField(read_only=True)
     updated_at = serializers.DateTimeField(read_only=True)
-    revisions = serializers.RelatedField(many=True, read_only=True)
+    revisions = serializers.SerializerMethodField('_get_revisions')
     attributes = serializers.SerializerMethodField('_get_attributes')
     metadata = WritableSerializerMethodField('_get_metadata',
                                              '_set_metadata')
 
     _version = None
+    # the ComponentTree that components are rendered from, so that the whole
+    # attribute graph is loaded in a few queries instead of node by node
+    _tree = None
+    # how many attributes deep to render components in full (None for no
+    # limit); components further down are referred to by slug
+    _max_depth = None
+    # whether to render every component below this one once, in a
+    # 'components' map, and refer to them by slug everywhere else
+    _shared = False
+    _references = False
+    # the components this one is nested in, to spot cycles
+    _path = ()
     # this is used to store the metadata that gets submitted as part of the
     # post process so that we can save it the correct way by overriding
     _metadata = None
@@ -58,6 +72,11 @@ class ComponentSerializer(serializers.ModelSerializer):
 
     def __init__(self, *args, **kwargs):
         self._version = kwargs.pop('version', None)
+        self._tree = kwargs.pop('tree', None)
+        self._max_depth = kwargs.pop('max_depth', None)
+        self._shared = kwargs.pop('shared', False)
+        self._references = self._shared or kwargs.pop('references', False)
+        self._path = kwargs.pop('path', ())
         super(ComponentSerializer, self).__init__(*args, **kwargs)
 
     def save_object(self, obj, **kwargs):
@@ -70,9 +89,19 @@ class ComponentSerializer(serializers.ModelSerializer):
         super(ComponentSerializer, self).save_object(obj, **kwargs)
 
         if self._metadata is not None:
-            self.object.new_revision(metadata=self._metadata)
+            self.object.new_revision(metadata=self._metadata,
+                                     user=self._get_user())
             self._metadata = None
 
+    def _get_user(self):
+        request = self.context.get('request', None)
+        user = getattr(request, 'user', None)
+
+        if user is not None and user.is_authenticated():
+            return user
+        else:
+            return None
+
     def restore_object(self, attrs, instance=None):
         """Given a dictionary of deserialized field values, either update an existing
         model instance, or create a new model instance.
@@ -114,16 +143,25 @@ class ComponentSerializer(serializers.ModelSerializer):
         else:
             return val
 
+    def _get_tree(self, obj):
+        if self._tree is None or obj not in self._tree:
+            self._tree = ComponentTree.load(obj)
+
+        return self._tree
+
     def _get_metadata(self, obj):
         try:
             if self._version is not None and self._version != 0:
                 return obj.metadata_at_version(self._version)
             else:
-                return obj.metadata
+                return self._get_tree(obj).metadata(obj)
         except IndexError as e:
             if str(e) == 'No such version':
                 return {}
 
+    def _get_revisions(self, obj):
+        return self._get_tree(obj).revisions(obj)
+
     def _set_metadata(self, data, *args, **kwargs):
         if 'metadata' in data:
             self.validate_metadata(data, 'metadata')
@@ -142,20 +180,48 @@ class ComponentSerializer(serializers.ModelSerializer):
 
         return attrs
 
+    def to_native(self, obj):
+        ret = super(ComponentSerializer, self).to_native(obj)
+
+        if self._shared and obj is not None:
+            ret['components'] = self._get_components(obj)
+
+        return ret
+
     def _get_attributes(self, obj):
         result = {}
-        attribute_names = [o.name for o in obj.attributes.distinct('name')]
-
-        for n in attribute_names:
-            attr = obj.get_attribute(n)
+        tree = self._get_tree(obj)
+        path = self._path + (obj.pk,)
 
+        for n, attr in tree.attributes(obj).items():
             if isinstance(attr, list):
-                result[n] = [ComponentSerializer(a).data for a in attr]
+                result[n] = [self._get_child(a, tree, path) for a in attr]
             else:
-                result[n] = ComponentSerializer(attr).data
+                result[n] = self._get_child(attr, tree, path)
 
         return result
 
+    def _get_child(self, child, tree, path):
+        # refer to the child by slug if it is in the components map, if it is
+        # too deep, or if it is one of its own ancestors
+        if (self._references or child.pk in path or
+                (self._max_depth is not None and
+                 len(path) > self._max_depth)):
+            return child.slug
+
+        return ComponentSerializer(child, tree=tree, max_depth=self._max_depth,
+                                   path=path).data
+
+    def _get_components(self, obj):
+        tree = self._get_tree(obj)
+        components = collections.OrderedDict()
+
+        for child, depth in tree.walk(obj, self._max_depth):
+            components[child.slug] = ComponentSerializer(
+                child, tree=tree, references=True).data
+
+        return components
+
 
 class ComponentWithDataSerializer(ComponentSerializer):
     """This is the exact same thing as a :py:class:`ComponentSerializer` but with
@@ -195,10 +261,10 @@ class ComponentRevisionSerializer(serializers.ModelSerializer):
     def _get_change_types(self, obj):
         changes = []
 
-        if obj.data is not None:
+        if obj.has_data:
             changes.append('data')
 
-        if obj.metadata is not None:
+        if obj.has_metadata:
             changes.append('metadata')
 
         return changes
@@ -0,0 +1,437 @@
+import bisect
+import hashlib
+import logging
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage, get_storage_class
+from django.db import IntegrityError, TransactionManagementError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from mirrors import chunking, compression
+
+
+LOGGER = logging.getLogger(__name__)
+
+# the key of the Postgres advisory lock that storing content holds shared,
+# and that mirrors.retention.collect_garbage holds exclusively while it
+# deletes unused blobs and chunks, so that content is never stored against a
+# row or a file that is about to be deleted
+STORAGE_LOCK = 0x6d697272
+
+
+def get_storage():
+    """Get the storage backend that blobs are kept in. This is the class named
+    by the ``MIRRORS_BLOB_STORAGE`` setting, instantiated with the keyword
+    arguments in ``MIRRORS_BLOB_STORAGE_OPTIONS``, or Django's
+    ``default_storage`` if that isn't set.
+
+    :rtype: :class:`django.core.files.storage.Storage`
+    """
+    storage_class = getattr(settings, 'MIRRORS_BLOB_STORAGE', None)
+
+    if storage_class is None:
+        return default_storage
+
+    options = getattr(settings, 'MIRRORS_BLOB_STORAGE_OPTIONS', {})
+    return get_storage_class(storage_class)(**options)
+
+
+def blob_path(sha256, encoding=''):
+    """Get the name a blob with the given hash is stored under. Blobs are
+    fanned out over two levels of directories so that no single directory
+    gets too large, and compressed blobs get an extension for their encoding.
+
+    :param sha256: the hex digest of the blob's content
+    :type sha256: str
+    :param encoding: how the stored content is compressed
+    :type encoding: str
+    :rtype: str
+    """
+    return 'blobs/{}/{}/{}{}'.format(sha256[:2], sha256[2:4], sha256,
+                                     compression.ENCODINGS.get(encoding, ''))
+
+
+def chunk_path(sha256, encoding=''):
+    """Get the name a chunk of a chunked blob is stored under.
+
+    :param sha256: the hex digest of the chunk's content
+    :type sha256: str
+    :param encoding: how the stored content is compressed
+    :type encoding: str
+    :rtype: str
+    """
+    return 'chunks/{}/{}/{}{}'.format(sha256[:2], sha256[2:4], sha256,
+                                      compression.ENCODINGS.get(encoding, ''))
+
+
+def store_blob(content, content_type=None):
+    """Store ``content`` in the blob store, unless a blob with the same
+    content is already there.
+
+    :param content: the data to store
+    :type content: bytes
+    :param content_type: the content type of the data, which decides whether
+                         it is compressed (see
+                         :func:`mirrors.compression.get_policy`)
+    :type content_type: str
+    :rtype: :class:`mirrors.models.Blob`
+    """
+    content = bytes(content)
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    return _save_blob(sha256, len(content), ContentFile(content),
+                      content_type)
+
+
+def store_file(f, sha256=None, content_type=None):
+    """Store the contents of a file in the blob store without reading it into
+    memory all at once. The file is read once to hash it and, if the content
+    isn't stored already, once more as the storage backend copies it. Uploads
+    that Django has spooled to disk are moved into place where the backend
+    supports it.
+
+    :param f: the file to store, generally an uploaded file
+    :type f: :class:`django.core.files.File`
+    :param sha256: the hash the client says the content has; if it doesn't
+                   match, nothing is stored
+    :type sha256: str
+    :param content_type: the content type of the data
+    :type content_type: str
+    :rtype: :class:`mirrors.models.Blob`
+    :raises: :class:`ValueError`
+    """
+    digest = hashlib.sha256()
+    size = 0
+
+    for chunk in f.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+
+    if sha256 is not None and digest.hexdigest() != sha256:
+        raise ValueError('content does not match the hash {}'.format(sha256))
+
+    f.seek(0)
+    return _save_blob(digest.hexdigest(), size, f, content_type)
+
+
+def store_stream(chunks, content_type=None):
+    """Store data that arrives as an iterable of byte strings. The data is
+    spooled to a temporary file while it is hashed, so memory use doesn't
+    depend on how large it is.
+
+    :param chunks: the data to store
+    :type chunks: iterable of bytes
+    :param content_type: the content type of the data
+    :type content_type: str
+    :rtype: :class:`mirrors.models.Blob`
+    """
+    with tempfile.TemporaryFile() as spool:
+        for chunk in chunks:
+            spool.write(chunk)
+
+        spool.seek(0)
+        return store_file(File(spool), content_type=content_type)
+
+
+def claim_blob(sha256):
+    """Find content that has already been stored, so that a revision can refer
+    to it without it being uploaded again. This has to be called in the
+    transaction that makes the revision: garbage collection is held off until
+    that ends, and the blob's grace period starts again in case it doesn't.
+
+    :param sha256: the SHA-256 hash of the content, in hex
+    :type sha256: str
+    :rtype: :class:`mirrors.models.Blob`, or None if it hasn't been stored
+    :raises: :class:`django.db.TransactionManagementError` outside of a
+             transaction
+    """
+    if not connection.in_atomic_block:
+        raise TransactionManagementError(
+            'claim_blob() has to be called in a transaction')
+
+    _lock_storage()
+    return _claim_blob(sha256)
+
+
+def _lock_storage():
+    # held until the end of the transaction; see STORAGE_LOCK
+    connection.cursor().execute('SELECT pg_advisory_xact_lock_shared(%s)',
+                                [STORAGE_LOCK])
+
+
+def _claim_blob(sha256):
+    from mirrors.models import Blob
+
+    # nothing may refer to it yet, so start its grace period again to keep
+    # garbage collection away until a revision does
+    if not Blob.objects.filter(sha256=sha256).update(
+            created_at=timezone.now()):
+        return None
+
+    return Blob.objects.get(sha256=sha256)
+
+
+def _save_blob(sha256, size, content, content_type=None):
+    with transaction.atomic():
+        _lock_storage()
+        return _save_blob_locked(sha256, size, content, content_type)
+
+
+def _save_blob_locked(sha256, size, content, content_type):
+    from mirrors.models import Blob
+
+    blob = _claim_blob(sha256)
+    if blob is not None:
+        return blob
+
+    if chunking.should_chunk(size):
+        return _save_chunked_blob(sha256, size, content, content_type)
+
+    encoding, level = compression.get_policy(content_type)
+    spool = None
+
+    if encoding is not None:
+        spool = _compress(content, encoding, level)
+        stored_size = spool.tell()
+
+        if stored_size < size:
+            spool.seek(0)
+            content = File(spool)
+        else:
+            # not worth it; keep the content as it is
+            encoding = None
+
+    if encoding is None:
+        encoding = ''
+        stored_size = size
+
+    try:
+        storage = get_storage()
+        path = blob_path(sha256, encoding)
+
+        # the name is derived from the content, so anything already stored at
+        # that path (eg. left over from an interrupted upload) is what we want
+        if not storage.exists(path):
+            storage.save(path, content)
+    finally:
+        if spool is not None:
+            spool.close()
+
+    LOGGER.info("stored blob {} ({} bytes, {} stored)".format(sha256, size,
+                                                              stored_size))
+
+    try:
+        with transaction.atomic():
+            return Blob.objects.create(sha256=sha256, size=size,
+                                       encoding=encoding,
+                                       stored_size=stored_size)
+    except IntegrityError:
+        # somebody else stored the same content at the same time
+        return Blob.objects.get(sha256=sha256)
+
+
+def _save_chunked_blob(sha256, size, content, content_type):
+    from mirrors.models import Blob, BlobChunk, Chunk
+
+    # the first pass only hashes the pieces, so that the ones already stored
+    # can be looked up with a single query
+    content.seek(0)
+    pieces = []
+    offset = 0
+    for piece in chunking.split(content):
+        pieces.append((hashlib.sha256(piece).hexdigest(), offset))
+        offset += len(piece)
+
+    chunks = Chunk.objects.in_bulk(set(h for h, _ in pieces))
+
+    # the second pass stores the pieces that weren't
+    content.seek(0)
+    new_chunks = {}
+    for (piece_hash, _), piece in zip(pieces, chunking.split(content)):
+        if piece_hash not in chunks and piece_hash not in new_chunks:
+            new_chunks[piece_hash] = _store_chunk(piece_hash, piece,
+                                                  content_type)
+
+    chunks.update(_create_chunks(list(new_chunks.values())))
+
+    manifest = [(chunks[piece_hash], offset) for piece_hash, offset in pieces]
+    stored_size = sum(chunk.stored_size for chunk, _ in manifest)
+
+    LOGGER.info("stored blob {} ({} bytes in {} chunks, {} new)".format(
+        sha256, size, len(manifest), len(new_chunks)))
+
+    try:
+        with transaction.atomic():
+            blob = Blob.objects.create(sha256=sha256, size=size,
+                                       stored_size=stored_size, chunked=True)
+            BlobChunk.objects.bulk_create([
+                BlobChunk(blob=blob, chunk=chunk, index=index, offset=offset)
+                for index, (chunk, offset) in enumerate(manifest)
+            ])
+            return blob
+    except IntegrityError:
+        return Blob.objects.get(sha256=sha256)
+
+
+def _store_chunk(sha256, content, content_type):
+    # write a chunk's content to storage, returning the (unsaved) row for it
+    from mirrors.models import Chunk
+
+    encoding, level = compression.get_policy(content_type)
+    stored = content
+
+    if encoding is not None:
+        compressor = compression.get_compressor(encoding, level)
+        stored = compressor.compress(content) + compressor.flush()
+
+        if len(stored) >= len(content):
+            stored = content
+            encoding = None
+
+    encoding = encoding or ''
+
+    storage = get_storage()
+    path = chunk_path(sha256, encoding)
+    # only chunks without a row get here, so a file that exists is left over
+    # from an interrupted upload and has the same content
+    if not storage.exists(path):
+        storage.save(path, ContentFile(stored))
+
+    return Chunk(sha256=sha256, size=len(content), encoding=encoding,
+                 stored_size=len(stored))
+
+
+def _create_chunks(new_chunks):
+    # make the rows for newly stored chunks, in one statement unless somebody
+    # else stored some of the same chunks at the same time
+    from mirrors.models import Chunk
+
+    if not new_chunks:
+        return {}
+
+    try:
+        with transaction.atomic():
+            Chunk.objects.bulk_create(new_chunks)
+    except IntegrityError:
+        for chunk in new_chunks:
+            try:
+                with transaction.atomic():
+                    chunk.save(force_insert=True)
+            except IntegrityError:
+                pass
+
+        return Chunk.objects.in_bulk([chunk.sha256 for chunk in new_chunks])
+
+    return dict((chunk.sha256, chunk) for chunk in new_chunks)
+
+
+def _compress(content, encoding, level):
+    compressor = compression.get_compressor(encoding, level)
+    spool = tempfile.TemporaryFile()
+
+    for chunk in content.chunks():
+        spool.write(compressor.compress(chunk))
+    spool.write(compressor.flush())
+
+    content.seek(0)
+    return spool
+
+
+def open_blob(sha256, encoding=''):
+    """Open the stored content of a blob for reading, as it is stored.
+
+    :param sha256: the hash of the blob to open
+    :type sha256: str
+    :param encoding: how the stored content is compressed
+    :type encoding: str
+    :rtype: :class:`django.core.files.File`
+    """
+    return get_storage().open(blob_path(sha256, encoding), 'rb')
+
+
+def open_chunk(sha256, encoding=''):
+    """Open the stored content of a chunk for reading, as it is stored.
+
+    :param sha256: the hash of the chunk to open
+    :type sha256: str
+    :param encoding: how the stored content is compressed
+    :type encoding: str
+    :rtype: :class:`django.core.files.File`
+    """
+    return get_storage().open(chunk_path(sha256, encoding), 'rb')
+
+
+class ChunkedFile(object):
+    """A read-only file over a blob that is stored as chunks. The manifest is
+    loaded when the file is opened; after that, only the chunks that are
+    actually read are fetched from storage, so reading a range of a large
+    blob is cheap.
+    """
+    def __init__(self, blob):
+        manifest = blob.manifest.order_by('index').values_list(
+            'offset', 'chunk_id', 'chunk__encoding')
+
+        self.offsets = []
+        self.chunks = []
+        for offset, sha256, encoding in manifest:
+            self.offsets.append(offset)
+            self.chunks.append((sha256, encoding))
+
+        self.size = blob.size
+        self.position = 0
+        self._loaded = (None, b'')
+
+    def _chunk(self, index):
+        if self._loaded[0] != index:
+            sha256, encoding = self.chunks[index]
+            raw = open_chunk(sha256, encoding)
+
+            with compression.decode(raw, encoding) as f:
+                self._loaded = (index, f.read())
+
+        return self._loaded[1]
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+
+        pieces = []
+
+        while size > 0 and self.position < self.size:
+            index = bisect.bisect_right(self.offsets, self.position) - 1
+            data = self._chunk(index)
+            start = self.position - self.offsets[index]
+
+            piece = data[start:start + size]
+            if not piece:
+                break
+
+            pieces.append(piece)
+            self.position += len(piece)
+            size -= len(piece)
+
+        return b''.join(pieces)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self._loaded = (None, b'')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
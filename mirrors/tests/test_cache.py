@@ -0,0 +1,386 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+
+from mirrors import bus, cache
+from mirrors.models import Component
+from mirrors.serializers import ComponentSerializer
+from mirrors.serializers import ComponentWithDataSerializer
+from mirrors.tests.utils import use_empty_cache
+
+
+class ComponentCacheTests(TestCase):
+    fixtures = ['serializer.json']
+
+    def setUp(self):
+        use_empty_cache(self)
+
+    def _serialize(self, slug, **kwargs):
+        component = Component.objects.get(slug=slug)
+
+        if component.data_uri is not None:
+            serializer_class = ComponentWithDataSerializer
+        else:
+            serializer_class = ComponentSerializer
+
+        return serializer_class(component, **kwargs).data
+
+    def test_render_matches_serializer(self):
+        for slug in ('test-component-with-list-attribute',
+                     'test-component-mixed-attributes',
+                     'test-component-with-no-attributes'):
+            expected = self._serialize(slug)
+
+            self.assertEqual(cache.render_component(slug), expected)
+            # and again from the cache
+            self.assertEqual(cache.render_component(slug), expected)
+
+    def test_render_options_match_serializer(self):
+        slug = 'test-component-with-list-attribute'
+
+        self.assertEqual(cache.render_component(slug, max_depth=0),
+                         self._serialize(slug, max_depth=0))
+        self.assertEqual(cache.render_component(slug, shared=True),
+                         self._serialize(slug, shared=True))
+
+    def test_hits_only_look_up_keys(self):
+        slug = 'test-component-with-list-attribute'
+        cache.render_component(slug, max_depth=5)
+
+        with self.assertNumQueries(1):
+            cache.render_component(slug, max_depth=5)
+
+    def test_new_revision_changes_key(self):
+        slug = 'test-component-with-list-attribute'
+        cache.render_component(slug)
+        cache.reset_stats()
+
+        child = Component.objects.get(slug='attribute-3')
+        child.new_revision(metadata={'title': 'a new title'})
+
+        data = cache.render_component(slug)
+        titles = [c['metadata'].get('title')
+                  for c in data['attributes']['my_list_attribute']]
+        self.assertIn('a new title', titles)
+
+        counts = cache.stats()
+        self.assertEqual(counts['tree_misses'], 1)
+        self.assertEqual(counts['misses'], 1)
+        self.assertTrue(counts['hits'] > 0)
+
+    @override_settings(MIRRORS_LOCAL_CACHE_SIZE=0)
+    def test_stats(self):
+        slug = 'test-component-with-no-attributes'
+
+        cache.render_component(slug, max_depth=5)
+        cache.render_component(slug, max_depth=5)
+        cache.render_component(slug)
+        cache.render_component(slug)
+
+        self.assertEqual(cache.stats(), {
+            'hits': 2, 'misses': 1, 'hit_rate': 2.0 / 3,
+            'tree_hits': 1, 'tree_misses': 1, 'tree_hit_rate': 0.5,
+            'suppressed': 0, 'stale': 0,
+        })
+
+        cache.reset_stats()
+        self.assertEqual(cache.stats()['hits'], 0)
+
+    def test_missing_component(self):
+        self.assertIsNone(cache.render_component('doesnt-exist'))
+        self.assertIsNone(cache.render_component('doesnt-exist',
+                                                 max_depth=1))
+
+    def test_tree_hits_take_no_queries(self):
+        slug = 'test-component-mixed-attributes'
+        expected = cache.render_component(slug)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.render_component(slug), expected)
+
+    def test_tree_dependencies(self):
+        cache.render_component('test-component-mixed-attributes')
+
+        depends = cache.tree_dependencies('test-component-mixed-attributes')
+        self.assertEqual(sorted(dep[0] for dep in depends),
+                         ['attribute-1', 'attribute-3', 'attribute-4',
+                          'test-component-mixed-attributes'])
+        self.assertIsNone(cache.tree_dependencies(
+            'test-component-mixed-attributes', shared=True))
+
+    @override_settings(MIRRORS_CACHE_TREES=None)
+    def test_trees_not_cached_in_process_memory(self):
+        slug = 'test-component-mixed-attributes'
+        self.assertFalse(cache.trees_cached())
+
+        # a write in another process couldn't invalidate it
+        self.assertEqual(cache.render_component(slug),
+                         self._serialize(slug))
+        self.assertIsNone(cache.tree_dependencies(slug))
+
+    def test_change_invalidates_only_trees_including_it(self):
+        slugs = ['test-component-with-list-attribute',
+                 'test-component-mixed-attributes',
+                 'test-component-with-one-named-attribute']
+        for slug in slugs:
+            cache.render_component(slug)
+
+        child = Component.objects.get(slug='attribute-3')
+        child.new_revision(metadata={'title': 'a new byline'})
+
+        self.assertIsNone(cache.tree_dependencies(slugs[0]))
+        self.assertIsNone(cache.tree_dependencies(slugs[1]))
+        self.assertIsNotNone(cache.tree_dependencies(slugs[2]))
+
+        data = cache.render_component(slugs[1], shared=True)
+        self.assertEqual(data['components']['attribute-3']['metadata'],
+                         {'title': 'a new byline'})
+
+    def test_attribute_change_invalidates_tree(self):
+        parent = Component.objects.get(slug='test-component-mixed-attributes')
+        cache.render_component(parent.slug)
+
+        child = Component.objects.get(slug='attribute-2')
+        parent.new_attribute('extra', child)
+
+        data = cache.render_component(parent.slug)
+        self.assertEqual(data['attributes']['extra']['slug'], 'attribute-2')
+
+    def test_deleted_component_is_not_served(self):
+        cache.render_component('test-component-mixed-attributes')
+        cache.render_component('attribute-4')
+
+        Component.objects.get(slug='attribute-4').delete()
+
+        self.assertIsNone(cache.render_component('attribute-4'))
+        data = cache.render_component('test-component-mixed-attributes')
+        self.assertNotIn('my_attribute', data['attributes'])
+
+    def test_local_tier_serves_trees(self):
+        slug = 'test-component-mixed-attributes'
+        expected = cache.render_component(slug)
+
+        with mock.patch.object(cache.get_cache(), 'get_many') as get_many:
+            self.assertEqual(cache.render_component(slug), expected)
+        self.assertFalse(get_many.called)
+
+    def test_local_tier_checks_generation(self):
+        slug = 'test-component-mixed-attributes'
+        cache.render_component(slug)
+        cache.reset_stats()
+
+        # invalidated by another process, which the default bus doesn't
+        # hear about
+        cache.get_cache().set(cache.generation_key(slug), 'elsewhere', None)
+        cache.render_component(slug)
+
+        self.assertEqual(cache.stats()['tree_misses'], 1)
+
+    @override_settings(MIRRORS_CACHE_STATS_FLUSH_INTERVAL=60)
+    def test_stats_counted_in_process(self):
+        slug = 'test-component-mixed-attributes'
+        cache.render_component(slug)
+        cache.reset_stats()
+
+        with mock.patch.object(cache.get_cache(), 'incr') as incr:
+            cache.render_component(slug)
+        self.assertFalse(incr.called)
+
+        # from the local tier, and added to the shared counts by stats()
+        self.assertEqual(cache.stats()['tree_hits'], 1)
+
+    def test_bus_evicts_local_trees(self):
+        slug = 'test-component-mixed-attributes'
+        cache.render_component(slug)
+        cache.reset_stats()
+
+        bus.get_bus().publish([slug])
+        cache.render_component(slug)
+
+        # from the shared cache this time
+        self.assertEqual(cache.stats()['tree_hits'], 1)
+
+    def test_local_tier_sees_changes(self):
+        slug = 'test-component-with-list-attribute'
+        cache.render_component(slug)
+
+        child = Component.objects.get(slug='attribute-3')
+        child.new_revision(metadata={'title': 'changed'})
+
+        data = cache.render_component(slug)
+        titles = [c['metadata'].get('title')
+                  for c in data['attributes']['my_list_attribute']]
+        self.assertIn('changed', titles)
+
+    def test_stale_tree_served_while_rebuilding(self):
+        slug = 'test-component-with-list-attribute'
+        before = cache.render_component(slug)
+
+        child = Component.objects.get(slug='attribute-3')
+        child.new_revision(metadata={'title': 'changed'})
+        cache.reset_stats()
+
+        # another process is making the new tree
+        cache.get_cache().add(cache.tree_key(slug) + ':lock', True)
+
+        with self.assertNumQueries(0):
+            stale = cache.render_component(slug)
+        self.assertEqual(stale, before)
+        self.assertIsInstance(stale, cache.StaleDocument)
+        self.assertEqual(cache.stats()['stale'], 1)
+        self.assertEqual(cache.stats()['suppressed'], 1)
+
+        cache.get_cache().delete(cache.tree_key(slug) + ':lock')
+        fresh = cache.render_component(slug)
+        self.assertNotEqual(fresh, before)
+        self.assertNotIsInstance(fresh, cache.StaleDocument)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        use_empty_cache(self)
+        self.builds = []
+        self.release = threading.Event()
+
+    def _build(self):
+        self.builds.append(threading.current_thread().name)
+        self.release.wait(5)
+        return 'fresh'
+
+    def _start_leader(self):
+        leader = threading.Thread(target=cache.single_flight,
+                                  args=('some-key', self._build),
+                                  name='leader')
+        leader.start()
+        self.addCleanup(leader.join)
+        self.addCleanup(self.release.set)
+
+        while not self.builds:
+            time.sleep(0.01)
+        return leader
+
+    def test_followers_wait_for_leader(self):
+        self._start_leader()
+        results = []
+
+        def follow():
+            results.append(cache.single_flight('some-key', self._build))
+
+        followers = [threading.Thread(target=follow) for n in range(5)]
+        for follower in followers:
+            follower.start()
+
+        time.sleep(0.1)
+        self.release.set()
+        for follower in followers:
+            follower.join(5)
+
+        self.assertEqual(results, ['fresh'] * 5)
+        self.assertEqual(self.builds, ['leader'])
+
+    def test_followers_get_stale_value(self):
+        self._start_leader()
+
+        self.assertEqual(cache.single_flight('some-key', self._build,
+                                             stale='stale'), 'stale')
+        self.assertEqual(self.builds, ['leader'])
+        self.assertEqual(cache.stats()['stale'], 1)
+
+    def test_other_process_holds_lock(self):
+        cache.get_cache().add('some-key:lock', True)
+        checks = []
+
+        def ready():
+            checks.append(1)
+            return 'made elsewhere' if len(checks) > 2 else None
+
+        self.assertEqual(cache.single_flight('some-key', self._build,
+                                             ready=ready), 'made elsewhere')
+        self.assertEqual(self.builds, [])
+
+    def test_other_process_gives_up(self):
+        cache.get_cache().add('some-key:lock', True)
+        self.release.set()
+
+        def ready():
+            cache.get_cache().delete('some-key:lock')
+
+        self.assertEqual(cache.single_flight('some-key', self._build,
+                                             ready=ready), 'fresh')
+        self.assertEqual(len(self.builds), 1)
+
+
+class LocalCacheTests(TestCase):
+    def test_least_recently_used_go_first(self):
+        local = cache.LocalCache(max_entries=2)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+
+        self.assertEqual(local.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+
+    def test_entries_expire(self):
+        local = cache.LocalCache(timeout=-1)
+        local.set('a', 1)
+
+        self.assertIsNone(local.get('a'))
+        self.assertEqual(len(local), 0)
+
+    def test_no_stale_stores(self):
+        local = cache.LocalCache()
+        evictions = local.evictions
+
+        local.evict_trees(['some-component'])
+        local.set(cache.tree_key('some-component'), {}, since=evictions)
+
+        self.assertIsNone(local.get(cache.tree_key('some-component')))
+
+    def test_evict_everything(self):
+        local = cache.LocalCache()
+        local.set(cache.tree_key('some-component'), {})
+        local.set('mirrors:component:some-component:1:1:0', {})
+
+        local.evict_trees(None)
+
+        self.assertEqual(len(local), 1)
+
+
+class PostgresBusTests(TransactionTestCase):
+    def test_publish(self):
+        received = []
+        evicted = []
+        delivered = threading.Event()
+
+        def receive(slugs):
+            if slugs is None:
+                evicted.append(slugs)
+            else:
+                received.extend(slugs)
+                delivered.set()
+
+        postgres_bus = bus.PostgresBus(channel='mirrors_test',
+                                       poll_interval=0.1)
+        postgres_bus.subscribe(receive)
+        postgres_bus.start()
+        self.addCleanup(postgres_bus.stop)
+
+        # give the listener time to connect
+        time.sleep(0.5)
+        postgres_bus.publish(['a-component', 'another-component'])
+
+        self.assertTrue(delivered.wait(5))
+        self.assertEqual(received, ['a-component', 'another-component'])
+
+        # connecting the first time doesn't throw away warmed up trees
+        self.assertEqual(evicted, [])
+
+    def test_long_messages_are_split(self):
+        slugs = ['component-{:04}'.format(n) for n in range(1000)]
+        chunks = list(bus.PostgresBus()._chunks(slugs))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual([slug for chunk in chunks for slug in chunk], slugs)
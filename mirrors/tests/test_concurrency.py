@@ -0,0 +1,59 @@
+import sys
+import threading
+import time
+
+from django.db import connection
+from django.test import TransactionTestCase
+
+from mirrors.models import Component
+
+
+class VersionAllocationStressTest(TransactionTestCase):
+    THREADS = 8
+    REVISIONS_PER_THREAD = 25
+
+    def setUp(self):
+        self.component = Component.objects.create(slug='hammered-component',
+                                                  content_type='text/plain')
+
+    def _hammer(self, errors):
+        try:
+            component = Component.objects.get(pk=self.component.pk)
+
+            for n in range(self.REVISIONS_PER_THREAD):
+                component.new_revision(metadata={
+                    'thread': threading.current_thread().name,
+                    'n': n
+                })
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    def test_concurrent_new_revisions(self):
+        errors = []
+        threads = [threading.Thread(target=self._hammer, args=(errors,),
+                                    name='writer-{}'.format(i))
+                   for i in range(self.THREADS)]
+
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        self.assertEqual(errors, [])
+
+        total = self.THREADS * self.REVISIONS_PER_THREAD
+        versions = sorted(self.component.revisions.values_list('version',
+                                                               flat=True))
+        self.assertEqual(versions, list(range(1, total + 1)))
+
+        component = Component.objects.get(pk=self.component.pk)
+        self.assertEqual(component.head_version, total)
+        self.assertEqual(component.head_metadata_revision.version, total)
+
+        sys.stderr.write('\n{} revisions from {} threads in {:.2f}s '
+                         '({:.0f} revisions/s)\n'.format(
+                             total, self.THREADS, elapsed, total / elapsed))
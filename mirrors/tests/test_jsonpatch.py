@@ -0,0 +1,50 @@
+import json
+
+from django.test import TestCase
+
+from mirrors import jsonpatch
+
+
+class JSONPatchTests(TestCase):
+    def assertRoundTrip(self, src, dst):
+        patch = jsonpatch.diff(src, dst)
+        # as JSON, so that 1, 1.0 and True don't pass for each other
+        self.assertEqual(json.dumps(jsonpatch.apply(src, patch),
+                                    sort_keys=True),
+                         json.dumps(dst, sort_keys=True))
+        return patch
+
+    def test_no_changes(self):
+        self.assertEqual(self.assertRoundTrip({'a': 1}, {'a': 1}), [])
+
+    def test_changed_key(self):
+        patch = self.assertRoundTrip({'a': 1, 'b': 'x'}, {'a': 2, 'b': 'x'})
+        self.assertEqual(patch, [{'op': 'replace', 'path': '/a', 'value': 2}])
+
+    def test_changed_type(self):
+        self.assertRoundTrip({'a': 1}, {'a': True})
+        self.assertRoundTrip({'a': 0}, {'a': False})
+        self.assertRoundTrip({'a': [1, 2]}, {'a': [1.0, 2]})
+        self.assertRoundTrip({'a': {'b': True}}, {'a': {'b': 1}})
+
+    def test_added_and_removed_keys(self):
+        self.assertRoundTrip({'a': 1, 'b': 2}, {'a': 1, 'c': 3})
+
+    def test_nested(self):
+        self.assertRoundTrip(
+            {'title': 'x', 'tags': ['a', 'b'], 'byline': {'name': 'one'}},
+            {'title': 'x', 'tags': ['a', 'c'], 'byline': {'name': 'two'}})
+
+    def test_lists_of_different_lengths(self):
+        self.assertRoundTrip({'tags': ['a']}, {'tags': ['a', 'b', 'c']})
+
+    def test_escaped_keys(self):
+        self.assertRoundTrip({'a/b': 1, 'c~d': 2}, {'a/b': 3, 'c~d': 4})
+
+    def test_whole_document(self):
+        self.assertRoundTrip({'a': 1}, ['not', 'a', 'dict'])
+
+    def test_apply_does_not_change_source(self):
+        src = {'a': {'b': 1}}
+        jsonpatch.apply(src, [{'op': 'replace', 'path': '/a/b', 'value': 2}])
+        self.assertEqual(src, {'a': {'b': 1}})
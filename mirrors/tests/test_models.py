@@ -1,19 +1,29 @@
 import datetime
+import hashlib
 import json
 
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
 
 from mirrors.exceptions import LockEnforcementError
-from mirrors.models import Component
+from mirrors.models import ATTRIBUTE_WEIGHT_GAP, Component
+from mirrors.models import collect_changes, component_changed
 from mirrors.models import ComponentLock
 from mirrors.models import ComponentAttribute
+from mirrors.models import ComponentRevision
+from mirrors.tests.utils import use_temporary_blob_storage
 
 
 class ComponentModelTests(TestCase):
     fixtures = ['components.json']
 
+    def setUp(self):
+        use_temporary_blob_storage(self)
+
     def test_get_binary_data(self):
         c = Component.objects.get(
             slug='test-component-with-multiple-revisions')
@@ -28,13 +38,26 @@ class ComponentModelTests(TestCase):
         self.assertIsNone(c.data_uri)
 
     def test_get_data_uri(self):
-        expected_url = reverse('component-detail', kwargs={
-            'slug': 'component-with-binary-data'
-        }) + '/data'
+        expected_url = reverse('component-revision-data', kwargs={
+            'slug': 'component-with-binary-data',
+            'version': 1
+        })
 
         c = Component.objects.get(slug='component-with-binary-data')
         self.assertEqual(c.data_uri, expected_url)
 
+    def test_data_uri_pinned_to_data_revision(self):
+        c = Component.objects.get(slug='component-with-binary-data')
+        c.new_revision(metadata={'title': 'only the metadata changed'})
+        self.assertEqual(c.data_uri, reverse('component-revision-data',
+                                             kwargs={'slug': c.slug,
+                                                     'version': 1}))
+
+        c.new_revision(data=b'new data')
+        self.assertEqual(c.data_uri, reverse('component-revision-data',
+                                             kwargs={'slug': c.slug,
+                                                     'version': 3}))
+
     def test_get_str(self):
         c = Component.objects.get(
             slug='test-component-with-multiple-revisions')
@@ -82,6 +105,47 @@ class ComponentModelTests(TestCase):
 
         self.assertIs(c.binary_data_at_version(1), None)
 
+    def test_head_computed_for_fixture_rows(self):
+        c = Component.objects.get(
+            slug='test-component-with-multiple-revisions'
+        )
+        self.assertIsNone(c.head_version)
+
+        self.assertEqual(c.max_version, c.revisions.count())
+
+        c = Component.objects.get(pk=c.pk)
+        self.assertEqual(c.head_version, c.revisions.count())
+        self.assertIsNotNone(c.head_data_revision_id)
+
+    def test_head_reads_use_constant_queries(self):
+        c = Component.objects.get(
+            slug='test-component-with-multiple-revisions'
+        )
+        for i in range(10):
+            c.new_revision(metadata={'title': 'revision {}'.format(i)})
+
+        c = Component.objects.get(pk=c.pk)
+
+        with self.assertNumQueries(3):
+            c.max_version
+            c.data_uri
+            c.metadata
+            c.binary_data
+
+    def test_data_uri_only_reads_version(self):
+        c = Component.objects.get(slug='component-with-binary-data')
+        c.refresh_head()
+
+        c = Component.objects.get(pk=c.pk)
+        with CaptureQueriesContext(connection) as queries:
+            c.data_uri
+
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"mirrors_componentrevision"."data"',
+                         queries[0]['sql'])
+        self.assertNotIn('"mirrors_componentrevision"."metadata"',
+                         queries[0]['sql'])
+
 
 class ComponentLockTests(TestCase):
     fixtures = ['users.json', 'component_lock_data.json']
@@ -131,6 +195,9 @@ class ComponentLockTests(TestCase):
 class ComponentRevisionModelTests(TestCase):
     fixtures = ['components.json']
 
+    def setUp(self):
+        use_temporary_blob_storage(self)
+
     def test_new_revision_first(self):
         c = Component.objects.get(slug='test-component-with-no-revisions')
 
@@ -142,7 +209,293 @@ class ComponentRevisionModelTests(TestCase):
 
         self.assertEqual(c.revisions.count(), 1)
         self.assertEqual(cr.component, c)
-        self.assertEqual(bytes(cr.data), b'this is a new revision')
+        self.assertEqual(cr.read_data(), b'this is a new revision')
+        self.assertEqual(cr.blob.size, len(b'this is a new revision'))
+
+    def test_new_revision_descriptors(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+
+        meta_rev = c.new_revision(metadata={'title': 'first'})
+        data_rev = c.new_revision(data=b'some data')
+
+        self.assertTrue(meta_rev.has_metadata)
+        self.assertFalse(meta_rev.has_data)
+        self.assertIsNone(meta_rev.data_size)
+
+        data_rev = ComponentRevision.objects.get(pk=data_rev.pk)
+        self.assertFalse(data_rev.has_metadata)
+        self.assertTrue(data_rev.has_data)
+        self.assertEqual(data_rev.data_size, len(b'some data'))
+        self.assertEqual(data_rev.data_hash,
+                         hashlib.sha256(b'some data').hexdigest())
+
+    def test_stale_save_keeps_head_pointers(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+        c.new_revision(metadata={'title': 'first'})
+        stale = Component.objects.get(pk=c.pk)
+
+        rev = c.new_revision(data=b'some data')
+        c.new_attribute('an_attribute',
+                        Component.objects.exclude(pk=c.pk).first())
+
+        # eg. a PATCH of the content type that overlapped the upload
+        stale.content_type = 'text/plain'
+        stale.save()
+
+        c = Component.objects.get(pk=c.pk)
+        self.assertEqual(c.content_type, 'text/plain')
+        self.assertEqual(c.head_version, rev.version)
+        self.assertEqual(c.head_data_revision_id, rev.pk)
+        self.assertEqual(c.attribute_generation, 1)
+
+        # and the next version handed out is a new one
+        self.assertEqual(c.new_revision(metadata={'title': 'next'}).version,
+                         rev.version + 1)
+
+    def test_descriptors_only_follow_saved_fields(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+        rev = c.new_revision(data=b'some data', metadata={'title': 'first'})
+        rev = ComponentRevision.objects.get(pk=rev.pk)
+
+        # the data isn't looked at again when only the metadata changes
+        rev.metadata = {'title': 'second'}
+        with self.assertNumQueries(1):
+            rev.save(update_fields=['metadata', 'has_metadata'])
+
+        rev.blob = None
+        rev.data = b'other data'
+        rev.save(update_fields=['blob', 'data', 'has_data', 'data_size',
+                                'data_hash'])
+
+        rev = ComponentRevision.objects.get(pk=rev.pk)
+        self.assertEqual(rev.data_size, len(b'other data'))
+        self.assertEqual(rev.data_hash,
+                         hashlib.sha256(b'other data').hexdigest())
+
+    def test_new_revision_large_metadata(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+        metadata = {'title': 'long', 'body': 'lots of words ' * 200}
+
+        rev = c.new_revision(metadata=metadata)
+        rev = ComponentRevision.objects.get(pk=rev.pk)
+
+        self.assertIsNone(rev.metadata)
+        self.assertIsNotNone(rev.packed_metadata)
+        self.assertTrue(rev.has_metadata)
+        self.assertEqual(rev.read_metadata(), metadata)
+
+        c = Component.objects.get(pk=c.pk)
+        self.assertEqual(c.metadata, metadata)
+        self.assertEqual(c.metadata_at_version(1), metadata)
+
+    def _article(self, n):
+        return {
+            'title': 'an article',
+            'body': 'a long paragraph of text ' * 20,
+            'revision': n,
+        }
+
+    def test_new_revision_metadata_deltas(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+
+        for n in range(5):
+            c.new_revision(metadata=self._article(n))
+
+        revs = list(c.revisions.order_by('version'))
+        self.assertIsNotNone(revs[0].metadata)
+        self.assertIsNone(revs[0].metadata_delta)
+
+        for rev in revs[1:]:
+            self.assertIsNone(rev.metadata)
+            self.assertTrue(rev.has_metadata)
+            self.assertEqual(rev.metadata_keyframe_id, revs[0].pk)
+            self.assertEqual(rev.metadata_delta, [
+                {'op': 'replace', 'path': '/revision',
+                 'value': rev.version - 1}
+            ])
+
+        c = Component.objects.get(pk=c.pk)
+        self.assertEqual(c.metadata, self._article(4))
+        for n in range(5):
+            self.assertEqual(c.metadata_at_version(n + 1), self._article(n))
+
+    @override_settings(MIRRORS_METADATA_KEYFRAME_INTERVAL=3)
+    def test_metadata_keyframe_interval(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+
+        for n in range(7):
+            c.new_revision(metadata=self._article(n))
+
+        revs = c.revisions.order_by('version')
+        self.assertEqual([r.metadata_delta is None for r in revs],
+                         [True, False, False, True, False, False, True])
+
+        c = Component.objects.get(pk=c.pk)
+        c.max_version
+
+        # the effective revision, then its keyframe and deltas
+        with self.assertNumQueries(2):
+            self.assertEqual(c.metadata_at_version(6), self._article(5))
+
+    def test_metadata_deltas_with_data_revisions(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+
+        c.new_revision(metadata=self._article(0))
+        c.new_revision(data=b'some data')
+        c.new_revision(metadata=self._article(1))
+
+        c = Component.objects.get(pk=c.pk)
+        self.assertEqual(c.metadata_at_version(2), self._article(0))
+        self.assertEqual(c.metadata_at_version(3), self._article(1))
+
+    def test_small_metadata_not_delta_encoded(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+
+        c.new_revision(metadata={'title': 'first'})
+        rev = c.new_revision(metadata={'title': 'second'})
+
+        self.assertEqual(rev.metadata, {'title': 'second'})
+        self.assertIsNone(rev.metadata_delta)
+
+    @override_settings(MIRRORS_AUTOSAVE_COALESCE_SECONDS=30)
+    def test_autosaves_coalesced(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+        user = User.objects.create_user('editor')
+
+        first = c.new_revision(metadata={'title': 'one'}, user=user)
+        updated_at = Component.objects.get(pk=c.pk).updated_at
+
+        second = c.new_revision(metadata={'title': 'two'}, user=user)
+        third = c.new_revision(metadata={'title': 'three'}, user=user)
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(first.pk, third.pk)
+        self.assertEqual(c.revisions.count(), 1)
+
+        c = Component.objects.get(pk=c.pk)
+        self.assertEqual(c.max_version, 1)
+        self.assertEqual(c.metadata, {'title': 'three'})
+        self.assertGreater(c.updated_at, updated_at)
+
+    @override_settings(MIRRORS_AUTOSAVE_COALESCE_SECONDS=30)
+    def test_autosaves_coalesced_into_delta(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+        user = User.objects.create_user('editor')
+
+        c.new_revision(metadata=self._article(0))
+        c.new_revision(metadata=self._article(1), user=user)
+        rev = c.new_revision(metadata=self._article(2), user=user)
+
+        self.assertEqual(rev.version, 2)
+        self.assertIsNotNone(rev.metadata_delta)
+
+        c = Component.objects.get(pk=c.pk)
+        self.assertEqual(c.metadata_at_version(1), self._article(0))
+        self.assertEqual(c.metadata_at_version(2), self._article(2))
+
+    @override_settings(MIRRORS_AUTOSAVE_COALESCE_SECONDS=30)
+    def test_autosaves_not_coalesced(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+        editor = User.objects.create_user('editor')
+        other = User.objects.create_user('other')
+
+        c.new_revision(metadata={'title': 'one'}, user=editor)
+        # somebody else's change
+        c.new_revision(metadata={'title': 'two'}, user=other)
+        # a data change
+        c.new_revision(data=b'some data', user=other)
+        c.new_revision(metadata={'title': 'three'}, user=other)
+        # no user
+        c.new_revision(metadata={'title': 'four'})
+
+        self.assertEqual(c.revisions.count(), 5)
+
+    @override_settings(MIRRORS_AUTOSAVE_COALESCE_SECONDS=30)
+    def test_autosaves_outside_window(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+        user = User.objects.create_user('editor')
+
+        first = c.new_revision(metadata={'title': 'one'}, user=user)
+        ComponentRevision.objects.filter(pk=first.pk).update(
+            created_at=timezone.now() - datetime.timedelta(minutes=5))
+
+        second = c.new_revision(metadata={'title': 'two'}, user=user)
+        self.assertNotEqual(first.pk, second.pk)
+
+    @override_settings(MIRRORS_AUTOSAVE_COALESCE_LOCKS=True)
+    def test_autosaves_coalesced_within_lock(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+        user = User.objects.create_user('editor')
+
+        before_lock = c.new_revision(metadata={'title': 'one'}, user=user)
+        ComponentRevision.objects.filter(pk=before_lock.pk).update(
+            created_at=timezone.now() - datetime.timedelta(minutes=5))
+
+        c.lock_by(user)
+        first = c.new_revision(metadata={'title': 'two'}, user=user)
+        self.assertNotEqual(first.pk, before_lock.pk)
+
+        second = c.new_revision(metadata={'title': 'three'}, user=user)
+        self.assertEqual(first.pk, second.pk)
+
+        c.unlock(user)
+        third = c.new_revision(metadata={'title': 'four'}, user=user)
+        self.assertNotEqual(first.pk, third.pk)
+
+    def test_fixture_descriptors(self):
+        c = Component.objects.get(
+            slug='test-component-with-multiple-revisions')
+        rev = c.revisions.get(version=2)
+
+        self.assertFalse(rev.has_metadata)
+        self.assertTrue(rev.has_data)
+        self.assertEqual(rev.data_size, len(b'this is the second revision'))
+        self.assertEqual(
+            rev.data_hash,
+            hashlib.sha256(b'this is the second revision').hexdigest())
+
+    def test_new_revision_updates_head(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+
+        meta_rev = c.new_revision(metadata={'title': 'first'})
+        data_rev = c.new_revision(data=b'some data')
+
+        c = Component.objects.get(pk=c.pk)
+        self.assertEqual(c.head_version, 2)
+        self.assertEqual(c.head_metadata_revision, meta_rev)
+        self.assertEqual(c.head_data_revision, data_rev)
+        self.assertEqual(c.metadata, {'title': 'first'})
+        self.assertEqual(c.binary_data, b'some data')
+
+    def test_new_revision_effective_revisions(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+
+        meta_rev = c.new_revision(metadata={'title': 'first'})
+        data_rev = c.new_revision(data=b'some data')
+        latest = c.new_revision(metadata={'title': 'second'})
+
+        self.assertIsNone(meta_rev.metadata_revision_id)
+        self.assertEqual(data_rev.metadata_revision_id, meta_rev.pk)
+        self.assertEqual(latest.data_revision_id, data_rev.pk)
+
+        c = Component.objects.get(pk=c.pk)
+        c.max_version
+
+        with self.assertNumQueries(1):
+            self.assertEqual(c.metadata_at_version(2), {'title': 'first'})
+
+        with self.assertNumQueries(1):
+            self.assertEqual(c.binary_data_at_version(3), b'some data')
+
+    def test_new_revision_reuses_blob(self):
+        c = Component.objects.get(slug='test-component-with-no-revisions')
+
+        first = c.new_revision(data=b'the same bytes')
+        second = c.new_revision(data=b'the same bytes')
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.blob.revisions.count(), 2)
+        self.assertEqual(c.binary_data_at_version(1), b'the same bytes')
 
     def test_new_revision_no_data(self):
         c = Component.objects.get(slug='test-component-with-no-revisions')
@@ -150,6 +503,16 @@ class ComponentRevisionModelTests(TestCase):
         with self.assertRaises(ValueError):
             c.new_revision()
 
+    def test_duplicate_version_rejected(self):
+        c = Component.objects.get(
+            slug='test-component-with-multiple-revisions'
+        )
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                ComponentRevision.objects.create(component=c, version=1,
+                                                 metadata={'dup': True})
+
     def test_revision_to_str(self):
         c = Component.objects.filter(
             slug='test-component-with-multiple-revisions'
@@ -253,6 +616,179 @@ class ComponentAttributeModelTests(TestCase):
 
         self.assertEqual(c.attributes.filter(name='my_attribute').count(), 2)
 
+    def test_set_attribute(self):
+        parent = Component.objects.create(slug='a-homepage')
+        children = [Component.objects.create(slug='item-{}'.format(n))
+                    for n in range(20)]
+        parent.set_attribute('items', [(c, n) for n, c in
+                                       enumerate(children)])
+
+        rows = dict((a.child_id, a.pk) for a in
+                    parent.attributes.filter(name='items'))
+        generation = Component.objects.get(pk=parent.pk).attribute_generation
+
+        # move the last item to the front, drop one and add a new one
+        new = Component.objects.create(slug='new-item')
+        wanted = ([(children[19], -1)] +
+                  [(c, n) for n, c in enumerate(children[:19]) if n != 5] +
+                  [(new, 100)])
+
+        # lock, read, delete, update, insert, bump the generation and find
+        # the cached trees to invalidate
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(parent.set_attribute('items', wanted))
+        self.assertEqual(len(self._statements(queries)), 7)
+
+        stored = list(parent.attributes.filter(name='items').order_by(
+            'weight').values_list('child_id', 'weight'))
+        self.assertEqual(stored, [(c.pk, w) for c, w in wanted])
+
+        # rows that were kept weren't recreated
+        for a in parent.attributes.filter(name='items').exclude(child=new):
+            self.assertEqual(a.pk, rows[a.child_id])
+
+        self.assertEqual(
+            Component.objects.get(pk=parent.pk).attribute_generation,
+            generation + 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(parent.set_attribute('items', wanted))
+        self.assertEqual(len(self._statements(queries)), 2)
+
+    def _statements(self, queries):
+        # leave out the savepoints of the test's transaction
+        return [q for q in queries.captured_queries
+                if 'SAVEPOINT' not in q['sql']]
+
+    def _slugs(self, component, name):
+        return [a.child.slug for a in component.attributes.filter(
+            name=name).order_by('weight')]
+
+    def test_insert_attribute(self):
+        parent = Component.objects.create(slug='a-homepage')
+        a, b, c, d = [Component.objects.create(slug=slug)
+                      for slug in ('a', 'b', 'c', 'd')]
+
+        parent.insert_attribute('items', a)
+        parent.insert_attribute('items', c)
+        parent.insert_attribute('items', b, before=c)
+        parent.insert_attribute('items', d, after=a)
+
+        self.assertEqual(self._slugs(parent, 'items'), ['a', 'd', 'b', 'c'])
+
+        weights = list(parent.attributes.filter(name='items').order_by(
+            'weight').values_list('weight', flat=True))
+        self.assertEqual(weights[0], ATTRIBUTE_WEIGHT_GAP)
+        self.assertEqual(weights[-1], 2 * ATTRIBUTE_WEIGHT_GAP)
+
+        with self.assertRaises(KeyError):
+            parent.insert_attribute('items', a, before=parent)
+
+        with self.assertRaises(ValueError):
+            parent.insert_attribute('items', a, before=b, after=c)
+
+    def test_changes_sent_after_commit(self):
+        parent = Component.objects.create(slug='a-homepage')
+        a, b = [Component.objects.create(slug=slug) for slug in ('a', 'b')]
+        parent.set_attribute('items', [(a, 1), (b, 2)])
+
+        sent = []
+
+        def listener(sender, component_id, **kwargs):
+            sent.append(component_id)
+
+        component_changed.connect(listener)
+        self.addCleanup(component_changed.disconnect, listener)
+
+        with collect_changes():
+            # runs out of room, so renumbers the list first
+            parent.insert_attribute('items', a, before=b)
+            parent.move_attribute('items', b)
+            self.assertEqual(sent, [])
+
+        self.assertEqual(sent, [parent.pk])
+
+        with self.assertRaises(KeyError):
+            with collect_changes():
+                parent.insert_attribute('items', b)
+                parent.move_attribute('items', parent)
+
+        self.assertEqual(sent, [parent.pk])
+
+    def test_move_attribute(self):
+        parent = Component.objects.create(slug='a-homepage')
+        children = [Component.objects.create(slug=slug)
+                    for slug in ('a', 'b', 'c', 'd')]
+        for child in children:
+            parent.insert_attribute('items', child)
+
+        untouched = dict(parent.attributes.filter(
+            name='items').values_list('child__slug', 'weight'))
+
+        parent.move_attribute('items', children[3], before=children[0])
+        parent.move_attribute('items', children[1], after=children[2])
+
+        self.assertEqual(self._slugs(parent, 'items'), ['d', 'a', 'c', 'b'])
+
+        # only the moved entries changed
+        weights = dict(parent.attributes.filter(
+            name='items').values_list('child__slug', 'weight'))
+        self.assertEqual(weights['a'], untouched['a'])
+        self.assertEqual(weights['c'], untouched['c'])
+
+        with self.assertRaises(KeyError):
+            parent.move_attribute('items', parent)
+
+    def test_renumber_when_out_of_room(self):
+        parent = Component.objects.create(slug='a-homepage')
+        a, b, c = [Component.objects.create(slug=slug)
+                   for slug in ('a', 'b', 'c')]
+        parent.set_attribute('items', [(a, 1), (b, 2)])
+
+        self.assertEqual(Component.objects.crowded_attributes(),
+                         [(parent.pk, 'items')])
+
+        parent.insert_attribute('items', c, before=b)
+
+        self.assertEqual(self._slugs(parent, 'items'), ['a', 'c', 'b'])
+        self.assertEqual(Component.objects.crowded_attributes(), [])
+
+    def test_referenced_by(self):
+        asset = Component.objects.create(slug='shared-asset')
+        article = Component.objects.create(slug='an-article')
+        issue = Component.objects.create(slug='an-issue')
+        other = Component.objects.create(slug='another-article')
+
+        article.new_attribute('image', asset)
+        other.new_attribute('images', asset, 10)
+        issue.new_attribute('articles', article, 10)
+        issue.new_attribute('articles', other, 20)
+        # a cycle back down to the asset
+        asset.new_attribute('appears_in', issue)
+
+        with self.assertNumQueries(1):
+            refs = Component.objects.referenced_by(asset)
+
+        self.assertEqual([(r.slug, r.depth) for r in refs],
+                         [('an-article', 1), ('another-article', 1)])
+
+        refs = Component.objects.referenced_by(asset, depth=5)
+        self.assertEqual([(r.slug, r.depth) for r in refs],
+                         [('an-article', 1), ('another-article', 1),
+                          ('an-issue', 2)])
+
+    @override_settings(MIRRORS_REFERENCED_BY_MAX_DEPTH=1)
+    def test_referenced_by_max_depth(self):
+        asset = Component.objects.create(slug='shared-asset')
+        article = Component.objects.create(slug='an-article')
+        issue = Component.objects.create(slug='an-issue')
+
+        article.new_attribute('image', asset)
+        issue.new_attribute('article', article)
+
+        refs = Component.objects.referenced_by(asset, depth=5)
+        self.assertEqual([r.slug for r in refs], ['an-article'])
+
     def test_get_str_on_single_attribute(self):
         ca = ComponentAttribute.objects.get(pk=10)
         e_str = 'test-component-with-one-attribute[my_attribute] = attribute-1'
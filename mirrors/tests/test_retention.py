@@ -0,0 +1,224 @@
+import datetime
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from mirrors import cache, retention, storage
+from mirrors.models import Blob, Component, ComponentRevision
+from mirrors.tests.utils import use_empty_cache
+from mirrors.tests.utils import use_temporary_blob_storage
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        use_temporary_blob_storage(self)
+
+        # noon, so that revisions a few hours apart fall on the same day
+        self.now = timezone.now().replace(hour=12, minute=0, second=0,
+                                          microsecond=0)
+        self.component = Component.objects.create(slug='retained-component',
+                                                  content_type='text/plain')
+
+    def _make_history(self, ages):
+        """Make a revision for each age (in days, oldest first), each with
+        slightly different metadata and the data set only by the first one.
+        """
+        for n, age in enumerate(ages):
+            if n == 0:
+                self.component.new_revision(data=b'the original data',
+                                            metadata={'n': n, 'body': 'x'})
+            else:
+                self.component.new_revision(metadata={'n': n, 'body': 'x'})
+
+            ComponentRevision.objects.filter(
+                component=self.component, version=n + 1
+            ).update(created_at=self.now - datetime.timedelta(days=age))
+
+        self.component = Component.objects.get(pk=self.component.pk)
+
+    def _versions(self):
+        return list(self.component.revisions.order_by(
+            'version').values_list('version', flat=True))
+
+    def test_policy(self):
+        ages = [500, 499.9, 420, 100, 99.3, 99.2, 40, 10, 5, 1]
+        self._make_history(ages)
+
+        revisions = list(self.component.revisions.order_by('version'))
+        keep = retention.RetentionPolicy().select(self.component, revisions,
+                                                  self.now)
+        kept = sorted(rev.version for rev in revisions if rev.pk in keep)
+
+        # all of the last 30 days, the last of each day up to a year, the
+        # last of each month before that, and the source of the current data
+        self.assertIn(1, kept)
+        self.assertIn(10, kept)
+        self.assertIn(9, kept)
+        self.assertIn(8, kept)
+        self.assertIn(7, kept)
+        self.assertIn(6, kept)
+        self.assertNotIn(5, kept)
+        self.assertIn(4, kept)
+        self.assertIn(3, kept)
+
+    def test_compaction_keeps_content(self):
+        ages = [400 - n for n in range(25)] + [1]
+        self._make_history(ages)
+
+        before = dict((v, (self.component.metadata_at_version(v),
+                           self.component.binary_data_at_version(v)))
+                      for v in self._versions())
+
+        report = retention.compact(policy=retention.RetentionPolicy(
+            keep_all_days=30, daily_days=None, monthly=False), now=self.now,
+            collect=False)
+
+        self.component = Component.objects.get(pk=self.component.pk)
+        remaining = self._versions()
+
+        # the first revision is kept since the current data comes from it
+        self.assertEqual(remaining, [1, 26])
+        self.assertEqual(report.revisions, 24)
+        self.assertTrue(report.bytes > 0)
+
+        for version in remaining:
+            self.assertEqual((self.component.metadata_at_version(version),
+                              self.component.binary_data_at_version(version)),
+                             before[version])
+
+        self.assertEqual(self.component.metadata, {'n': 25, 'body': 'x'})
+        self.assertEqual(self.component.binary_data, b'the original data')
+
+        with self.assertRaises(IndexError):
+            self.component.metadata_at_version(3)
+
+    def test_compaction_keeps_deltas_readable(self):
+        ages = [100 + (30 - n) / 10.0 for n in range(30)] + [1]
+        self._make_history(ages)
+
+        before = dict((v, self.component.metadata_at_version(v))
+                      for v in self._versions())
+
+        retention.compact(now=self.now, collect=False)
+
+        self.component = Component.objects.get(pk=self.component.pk)
+        remaining = self._versions()
+        self.assertTrue(len(remaining) < 31)
+
+        for version in remaining:
+            self.assertEqual(self.component.metadata_at_version(version),
+                             before[version])
+
+    def test_pinned_revisions_are_kept(self):
+        self._make_history([400, 300, 200, 1])
+        self.component.new_revision(data=b'the new data')
+        self.component.pin(2)
+
+        retention.compact(policy=retention.RetentionPolicy(
+            daily_days=None, monthly=False), now=self.now, collect=False)
+
+        self.assertEqual(self._versions(), [2, 4, 5])
+
+        # version 2 had its data from version 1, which is gone now
+        self.component = Component.objects.get(pk=self.component.pk)
+        self.assertEqual(self.component.binary_data_at_version(2),
+                         b'the original data')
+        self.assertEqual(self.component.metadata_at_version(2),
+                         {'n': 1, 'body': 'x'})
+
+    def test_compaction_invalidates_trees(self):
+        use_empty_cache(self)
+        self._make_history([400, 300, 200, 1])
+
+        cache.render_component('retained-component')
+        self.assertIsNotNone(cache.tree_dependencies('retained-component'))
+
+        retention.compact(policy=retention.RetentionPolicy(
+            daily_days=None, monthly=False), now=self.now, collect=False)
+
+        self.assertIsNone(cache.tree_dependencies('retained-component'))
+
+    def test_dry_run(self):
+        self._make_history([400, 300, 200, 1])
+
+        report = retention.compact(policy=retention.RetentionPolicy(
+            daily_days=None, monthly=False), now=self.now, dry_run=True)
+
+        self.assertEqual(report.revisions, 2)
+        self.assertEqual(self._versions(), [1, 2, 3, 4])
+
+    def test_collect_garbage(self):
+        used = storage.store_blob(b'still in use', 'text/plain')
+        self.component.new_revision(data=used)
+        unused = storage.store_blob(b'nothing uses this', 'text/plain')
+
+        backend = storage.get_storage()
+        path = storage.blob_path(unused.sha256, unused.encoding)
+        self.assertTrue(backend.exists(path))
+
+        report = retention.RetentionReport()
+        retention.collect_garbage(report)
+        self.assertEqual(report.blobs, 0)
+
+        retention.collect_garbage(report, grace=datetime.timedelta(0))
+
+        self.assertEqual(report.blobs, 1)
+        self.assertFalse(Blob.objects.filter(pk=unused.pk).exists())
+        self.assertTrue(Blob.objects.filter(pk=used.pk).exists())
+        self.assertFalse(backend.exists(path))
+
+    def test_storing_again_starts_grace_period(self):
+        blob = storage.store_blob(b'stored a long time ago', 'text/plain')
+        Blob.objects.filter(pk=blob.pk).update(
+            created_at=self.now - datetime.timedelta(days=30))
+
+        # an upload of the same content dedupes onto the old blob, which
+        # must then outlive a collection that runs before it is used
+        self.assertEqual(
+            storage.store_blob(b'stored a long time ago', 'text/plain').pk,
+            blob.pk)
+
+        report = retention.RetentionReport()
+        retention.collect_garbage(report)
+
+        self.assertEqual(report.blobs, 0)
+        self.assertTrue(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertTrue(storage.get_storage().exists(
+            storage.blob_path(blob.sha256, blob.encoding)))
+
+    def test_pin(self):
+        self._make_history([400, 300])
+
+        self.component.pin(1)
+        self.assertTrue(self.component.revisions.get(version=1).pinned)
+
+        self.component.pin(1, pinned=False)
+        self.assertFalse(self.component.revisions.get(version=1).pinned)
+
+        with self.assertRaises(IndexError):
+            self.component.pin(3)
+
+    def test_pin_command(self):
+        self._make_history([400, 300, 200, 1])
+
+        out = StringIO()
+        call_command('pin_revision', 'retained-component', '2', stdout=out)
+        self.assertTrue(self.component.revisions.get(version=2).pinned)
+        self.assertIn('Pinned version 2 of retained-component',
+                      out.getvalue())
+
+        call_command('pin_revision', 'retained-component', '2', unpin=True,
+                     stdout=out)
+        self.assertFalse(self.component.revisions.get(version=2).pinned)
+
+    def test_command(self):
+        self._make_history([400, 300, 200, 1])
+
+        out = StringIO()
+        call_command('compact_revisions', 'retained-component',
+                     daily_days=0, monthly=False, stdout=out)
+
+        self.assertEqual(self._versions(), [1, 4])
+        self.assertIn('2 revisions removed', out.getvalue())
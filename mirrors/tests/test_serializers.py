@@ -3,6 +3,8 @@ import json
 import jsonschema
 
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import serializers
 from rest_framework.test import APITestCase
@@ -115,6 +117,95 @@ class ComponentResourceTests(APITestCase):
         with self.assertRaises(serializers.ValidationError):
             serializer.validate_metadata({'metadata': 32}, 'metadata')
 
+    def test_serialize_cyclic_attributes(self):
+        c = Component.objects.get(slug='test-component-with-list-attribute')
+        child = Component.objects.get(slug='attribute-1')
+        child.new_attribute('parent', c)
+
+        content = ComponentSerializer(child).data
+        parent = content['attributes']['parent']
+
+        self.assertEqual(parent['slug'], 'test-component-with-list-attribute')
+        self.assertIn('attribute-1', parent['attributes']['my_list_attribute'])
+
+
+class ComponentTreeTests(APITestCase):
+    def setUp(self):
+        # long enough that every revision after the first is stored as a
+        # delta
+        self.body = 'the body of the component ' * 20
+
+        self.root = Component.objects.create(slug='root', content_type='none')
+        for n in range(3):
+            self.root.new_revision(metadata={'title': 'root', 'n': n,
+                                             'body': self.body})
+
+        author = Component.objects.create(slug='author', content_type='none')
+        author.new_revision(metadata={'name': 'an author'})
+
+        for n in range(40):
+            child = Component.objects.create(slug='child-{}'.format(n),
+                                             content_type='none')
+            child.new_revision(metadata={'n': None, 'body': self.body})
+            child.new_revision(metadata={'n': n, 'body': self.body})
+            child.new_attribute('author', author)
+            self.root.new_attribute('related', child, weight=n)
+
+    def test_constant_queries(self):
+        root = Component.objects.get(slug='root')
+        child = Component.objects.get(slug='child-7')
+        self.assertIsNotNone(root.head_metadata_revision.metadata_delta)
+        self.assertIsNotNone(child.head_metadata_revision.metadata_delta)
+
+        # the components, the metadata deltas, the attributes and the
+        # revisions
+        with CaptureQueriesContext(connection) as queries:
+            content = ComponentSerializer(root).data
+
+        self.assertEqual(len(queries), 4)
+        replays = [q for q in queries.captured_queries
+                   if '"metadata_keyframe_id" IN' in q['sql']]
+        self.assertEqual(len(replays), 1)
+
+        self.assertEqual(content['metadata'], {'title': 'root', 'n': 2,
+                                               'body': self.body})
+        self.assertEqual(content['revisions'], ['root v1', 'root v2',
+                                                'root v3'])
+
+        related = content['attributes']['related']
+        self.assertEqual([c['slug'] for c in related],
+                         ['child-{}'.format(n) for n in range(40)])
+        self.assertEqual(related[7]['metadata'], {'n': 7, 'body': self.body})
+        self.assertEqual(related[7]['attributes']['author']['metadata'],
+                         {'name': 'an author'})
+
+    def test_depth(self):
+        root = Component.objects.get(slug='root')
+        content = ComponentSerializer(root, max_depth=1).data
+
+        child = content['attributes']['related'][0]
+        self.assertEqual(child['metadata']['n'], 0)
+        self.assertEqual(child['attributes']['author'], 'author')
+
+        content = ComponentSerializer(root, max_depth=0).data
+        self.assertEqual(content['attributes']['related'][:2],
+                         ['child-0', 'child-1'])
+
+    def test_components_map(self):
+        root = Component.objects.get(slug='root')
+        content = ComponentSerializer(root, shared=True).data
+
+        self.assertEqual(content['attributes']['related'][0], 'child-0')
+        self.assertEqual(len(content['components']), 41)
+        self.assertEqual(content['components']['child-3']['attributes'],
+                         {'author': 'author'})
+        self.assertEqual(content['components']['author']['metadata'],
+                         {'name': 'an author'})
+
+        content = ComponentSerializer(root, shared=True, max_depth=1).data
+        self.assertEqual(len(content['components']), 40)
+        self.assertNotIn('author', content['components'])
+
 
 class ComponentAttributeResourceTests(APITestCase):
     fixtures = ['users.json', 'componentattributes.json']
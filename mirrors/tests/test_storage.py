@@ -0,0 +1,227 @@
+import datetime
+import gzip
+import hashlib
+import io
+import os
+import random
+import tracemalloc
+
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from mirrors import chunking, compression, storage
+from mirrors.models import Blob, Chunk
+from mirrors.tests.utils import use_temporary_blob_storage
+
+
+@override_settings(MIRRORS_CHUNKING_THRESHOLD=None)
+class BlobStorageTests(TestCase):
+    def setUp(self):
+        use_temporary_blob_storage(self)
+
+    def _chunks(self, count, size=64 * 1024):
+        for i in range(count):
+            yield bytes([i % 256]) * size
+
+    def test_store_stream(self):
+        expected = hashlib.sha256(b''.join(self._chunks(16))).hexdigest()
+
+        blob = storage.store_stream(self._chunks(16))
+
+        self.assertEqual(blob.sha256, expected)
+        self.assertEqual(blob.size, 16 * 64 * 1024)
+        self.assertTrue(storage.get_storage().exists(
+            storage.blob_path(expected)))
+
+    def test_store_stream_constant_memory(self):
+        tracemalloc.start()
+        try:
+            storage.store_stream(self._chunks(512))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # 32MB went through, but only a few chunks should ever be held
+        self.assertLess(peak, 4 * 1024 * 1024)
+
+    def test_store_file_hash_mismatch(self):
+        f = ContentFile(b'some content')
+
+        with self.assertRaises(ValueError):
+            storage.store_file(f, sha256=hashlib.sha256(b'other').hexdigest())
+
+        self.assertEqual(Blob.objects.count(), 0)
+
+    def test_store_file_existing_content(self):
+        first = storage.store_blob(b'some content')
+        second = storage.store_file(ContentFile(b'some content'))
+
+        self.assertEqual(first.sha256, second.sha256)
+        self.assertEqual(Blob.objects.count(), 1)
+
+        with second.open() as f:
+            self.assertEqual(f.read(), b'some content')
+
+    def test_store_blob_compressed(self):
+        content = b'<p>some text that compresses well</p>' * 100
+        blob = storage.store_blob(content, 'text/html; charset=utf-8')
+
+        self.assertEqual(blob.encoding, 'gzip')
+        self.assertEqual(blob.size, len(content))
+        self.assertLess(blob.stored_size, blob.size)
+        self.assertTrue(storage.get_storage().exists(
+            storage.blob_path(blob.sha256, 'gzip')))
+
+        with blob.open_raw() as f:
+            self.assertEqual(gzip.decompress(f.read()), content)
+
+        with blob.open() as f:
+            self.assertEqual(f.read(), content)
+
+    def test_compressed_blob_seek(self):
+        content = b'0123456789' * 1000
+        blob = storage.store_blob(content, 'text/plain')
+
+        with blob.open() as f:
+            f.seek(5000)
+            self.assertEqual(f.read(10), content[5000:5010])
+
+    def test_store_blob_not_compressed(self):
+        blob = storage.store_blob(b'x' * 1000, 'image/png')
+        self.assertEqual(blob.encoding, '')
+        self.assertEqual(blob.stored_size, 1000)
+
+    def test_store_blob_incompressible(self):
+        content = os.urandom(4096)
+        blob = storage.store_blob(content, 'text/plain')
+
+        self.assertEqual(blob.encoding, '')
+        with blob.open() as f:
+            self.assertEqual(f.read(), content)
+
+    @override_settings(MIRRORS_COMPRESSION=[('application/json', 'lzma', 9)])
+    def test_store_blob_policy(self):
+        content = b'{"key": "value"}' * 200
+
+        blob = storage.store_blob(content, 'application/json')
+        self.assertEqual(blob.encoding, 'lzma')
+        with blob.open() as f:
+            self.assertEqual(f.read(), content)
+
+        # text isn't compressed once the policy doesn't mention it
+        blob = storage.store_blob(b'text ' * 200, 'text/plain')
+        self.assertEqual(blob.encoding, '')
+
+    def test_claim_blob(self):
+        blob = storage.store_blob(b'stored a while ago', 'text/plain')
+        old = timezone.now() - datetime.timedelta(days=30)
+        Blob.objects.filter(pk=blob.pk).update(created_at=old)
+
+        with transaction.atomic():
+            claimed = storage.claim_blob(blob.sha256)
+            self.assertIsNone(storage.claim_blob(
+                hashlib.sha256(b'never stored').hexdigest()))
+
+        self.assertEqual(claimed.pk, blob.pk)
+        # its grace period starts again
+        self.assertGreater(claimed.created_at, old)
+
+    def test_pack_metadata(self):
+        small = {'title': 'a title'}
+        self.assertEqual(compression.pack_metadata(small), (small, None))
+
+        large = {'body': 'some words ' * 500}
+        metadata, packed = compression.pack_metadata(large)
+        self.assertIsNone(metadata)
+        self.assertLess(len(packed), len('some words ' * 500))
+        self.assertEqual(compression.unpack_metadata(packed), large)
+
+
+@override_settings(MIRRORS_CHUNKING_THRESHOLD=64 * 1024)
+class ChunkedStorageTests(TestCase):
+    def setUp(self):
+        use_temporary_blob_storage(self)
+
+        size = 4 * 1024 * 1024
+        rand = random.Random(0)
+        self.content = rand.getrandbits(size * 8).to_bytes(size, 'little')
+
+    def test_split_round_trip(self):
+        chunks = list(chunking.split(io.BytesIO(self.content)))
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(c) <= chunking.MAX_CHUNK_SIZE
+                            for c in chunks))
+        self.assertEqual(b''.join(chunks), self.content)
+
+    def test_store_chunked_blob(self):
+        blob = storage.store_blob(self.content)
+
+        self.assertTrue(blob.chunked)
+        self.assertEqual(blob.size, len(self.content))
+        self.assertEqual(blob.manifest.count(), Chunk.objects.count())
+
+        with blob.open() as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_near_identical_versions_share_chunks(self):
+        storage.store_blob(self.content)
+        first = sum(Chunk.objects.values_list('stored_size', flat=True))
+
+        edited = (self.content[:1000000] + b'an edit' +
+                  self.content[1000100:])
+        blob = storage.store_blob(edited)
+        second = sum(Chunk.objects.values_list('stored_size', flat=True))
+
+        # the second version should cost a small fraction of the first
+        self.assertLess(second - first, first / 10)
+
+        with blob.open() as f:
+            self.assertEqual(f.read(), edited)
+
+    def test_chunked_range_read(self):
+        blob = storage.store_blob(self.content)
+        offset = 3 * 1024 * 1024
+
+        with mock.patch.object(storage, 'open_chunk',
+                               wraps=storage.open_chunk) as open_chunk:
+            with blob.open() as f:
+                f.seek(offset)
+                self.assertEqual(f.read(1000),
+                                 self.content[offset:offset + 1000])
+
+        # only the chunks covering the range were fetched
+        self.assertLessEqual(open_chunk.call_count, 2)
+
+    def test_chunks_looked_up_at_once(self):
+        storage.store_blob(self.content)
+        edited = self.content[:2000000] + b'an edit'
+
+        with CaptureQueriesContext(connection) as queries:
+            storage.store_blob(edited)
+
+        lookups = [q for q in queries.captured_queries
+                   if q['sql'].startswith('SELECT') and
+                   'FROM "mirrors_chunk"' in q['sql']]
+        self.assertEqual(len(lookups), 1)
+
+    def test_chunking_is_opt_in(self):
+        with mock.patch.object(chunking, 'settings', object()):
+            self.assertFalse(chunking.should_chunk(1024 * 1024 * 1024))
+
+    def test_chunks_compressed(self):
+        content = b''.join('line {}\n'.format(i).encode('ascii')
+                           for i in range(50000))
+        blob = storage.store_blob(content, 'text/plain')
+
+        self.assertTrue(blob.chunked)
+        self.assertLess(blob.stored_size, blob.size)
+        self.assertTrue(Chunk.objects.filter(encoding='gzip').exists())
+
+        with blob.open() as f:
+            self.assertEqual(f.read(), content)
@@ -1,24 +1,32 @@
+import gzip
 import hashlib
+import io
 import json
 import os
 
+from unittest import mock
+
 import jsonschema
 
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
-from django.test import Client
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
 
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from mirrors import components
-from mirrors.models import Component
+from mirrors import cache, components
+from mirrors.models import Component, ComponentRevision
+from mirrors.responses import file_response
+from mirrors.tests.utils import use_empty_cache, use_temporary_blob_storage
 
 
 class ComponentViewTest(APITestCase):
     fixtures = ['users.json', 'serializer.json']
 
     def setUp(self):
+        use_empty_cache(self)
         self.valid_component = {
             'content_type': 'application/x-markdown',
             'schema_name': 'article',
@@ -217,11 +225,149 @@ class ComponentViewTest(APITestCase):
         res = self.client.delete(url)
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_get_component_validators(self):
+        url = reverse('component-detail', kwargs={
+            'slug': 'test-component-with-one-named-attribute'
+        })
+
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', res)
+        self.assertEqual(res['Last-Modified'],
+                         'Thu, 06 Feb 2014 00:03:40 GMT')
+
+    # counting the read could write out the counts of earlier tests
+    @override_settings(MIRRORS_ACCESS_FLUSH_INTERVAL=None)
+    def test_get_component_not_modified(self):
+        url = reverse('component-detail', kwargs={
+            'slug': 'test-component-with-one-named-attribute'
+        })
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(res.content, b'')
+
+    def test_get_component_if_modified_since(self):
+        url = reverse('component-detail', kwargs={
+            'slug': 'test-component-with-one-named-attribute'
+        })
+
+        res = self.client.get(url, HTTP_IF_MODIFIED_SINCE='Thu, 06 Feb 2014 '
+                                                         '00:03:40 GMT')
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        res = self.client.get(url, HTTP_IF_MODIFIED_SINCE='Wed, 05 Feb 2014 '
+                                                         '00:00:00 GMT')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_get_component_modified_by_new_revision(self):
+        url = reverse('component-detail', kwargs={
+            'slug': 'test-component-with-one-named-attribute'
+        })
+        etag = self.client.get(url)['ETag']
+
+        c = Component.objects.get(
+            slug='test-component-with-one-named-attribute')
+        c.new_revision(metadata={'title': 'changed'})
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_get_component_modified_by_child(self):
+        url = reverse('component-detail', kwargs={
+            'slug': 'test-component-with-one-named-attribute'
+        })
+        etag = self.client.get(url)['ETag']
+
+        child = Component.objects.get(slug='attribute-1')
+        child.new_revision(metadata={'title': 'changed child'})
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_get_stale_component_has_no_validators(self):
+        slug = 'test-component-with-one-named-attribute'
+        url = reverse('component-detail', kwargs={'slug': slug})
+        etag = self.client.get(url)['ETag']
+
+        child = Component.objects.get(slug='attribute-1')
+        child.new_revision(metadata={'title': 'changed child'})
+
+        # another process is making the new tree, so the old one is served
+        cache.get_cache().add(cache.tree_key(slug) + ':lock', True)
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn('ETag', res)
+        self.assertNotIn('Last-Modified', res)
+        self.assertEqual(res['Cache-Control'], 'no-cache')
+
+    def test_get_component_modified_by_new_attribute(self):
+        url = reverse('component-detail', kwargs={
+            'slug': 'test-component-with-one-named-attribute'
+        })
+        etag = self.client.get(url)['ETag']
+
+        c = Component.objects.get(
+            slug='test-component-with-one-named-attribute')
+        c.new_attribute('another_attribute',
+                        Component.objects.get(slug='attribute-1'))
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_get_404_component_conditional(self):
+        url = reverse('component-detail', kwargs={
+            'slug': 'doesnt-exist'
+        })
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_component_map(self):
+        url = reverse('component-detail', kwargs={
+            'slug': 'test-component-with-one-named-attribute'
+        })
+        etag = self.client.get(url)['ETag']
+
+        res = self.client.get(url, {'components': '1'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+        data = json.loads(res.content.decode('UTF-8'))
+        self.assertEqual(data['attributes']['my_named_attribute'],
+                         'attribute-1')
+        self.assertEqual(data['components']['attribute-1']['slug'],
+                         'attribute-1')
+
+    def test_get_component_depth(self):
+        url = reverse('component-detail', kwargs={
+            'slug': 'test-component-with-one-named-attribute'
+        })
+
+        res = self.client.get(url, {'depth': '0'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        data = json.loads(res.content.decode('UTF-8'))
+        self.assertEqual(data['attributes']['my_named_attribute'],
+                         'attribute-1')
+
+        res = self.client.get(url, {'depth': 'lots'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class ComponentAttributeViewTests(APITestCase):
     fixtures = ['users.json', 'componentattributes.json']
 
     def setUp(self):
+        use_empty_cache(self)
         user = User.objects.get(username='test_admin')
         self.client.force_authenticate(user=user)
 
@@ -453,11 +599,80 @@ class ComponentAttributeViewTests(APITestCase):
         res = self.client.delete(url)
         self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_insert_into_attribute_list(self):
+        url = reverse('component-attribute-detail', kwargs={
+            'slug': 'component-with-list-attribute',
+            'name': 'list_attribute'
+        })
+
+        res = self.client.post(url, {'child': 'attribute-1',
+                                     'before': 'attribute-4'})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        data = json.loads(res.content.decode('UTF-8'))
+        self.assertEqual([a['child'] for a in data],
+                         ['attribute-3', 'attribute-1', 'attribute-4'])
+
+        res = self.client.post(url, {'child': 'attribute-2',
+                                     'after': 'attribute-5'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_move_within_attribute_list(self):
+        url = reverse('component-attribute-detail', kwargs={
+            'slug': 'component-with-list-attribute',
+            'name': 'list_attribute'
+        })
+
+        res = self.client.patch(url, {'child': 'attribute-4',
+                                      'before': 'attribute-3'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        data = json.loads(res.content.decode('UTF-8'))
+        self.assertEqual([a['child'] for a in data],
+                         ['attribute-4', 'attribute-3'])
+        self.assertEqual(data[1]['weight'], 100)
+
+        res = self.client.patch(url, {'child': 'no-such-component'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_referenced_by(self):
+        parent = Component.objects.get(slug='component-with-regular-attribute')
+        parent.new_attribute('list', Component.objects.get(
+            slug='component-with-list-attribute'))
+
+        url = reverse('component-referenced-by', kwargs={
+            'slug': 'attribute-3'
+        })
+
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(res.content.decode('UTF-8')), [
+            {'slug': 'component-with-list-attribute', 'depth': 1}
+        ])
+
+        res = self.client.get(url, {'depth': 2})
+        self.assertEqual(json.loads(res.content.decode('UTF-8')), [
+            {'slug': 'component-with-list-attribute', 'depth': 1},
+            {'slug': 'component-with-regular-attribute', 'depth': 2}
+        ])
+
+        res = self.client.get(url, {'depth': 0})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_referenced_by_404(self):
+        url = reverse('component-referenced-by', kwargs={
+            'slug': 'doesnt-exist'
+        })
+
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class ComponentDataViewTest(APITestCase):
     fixtures = ['users.json', 'component_data.json']
 
     def setUp(self):
+        use_empty_cache(self)
         self.svg_hash = '01d5a1a9d1452f1b013bfc74da44d52e'
         self.jpeg_hash = '6367446e537b50e363f26e385f47e99d'
         self.md_hash = 'eb867962bfff036e98b5e59dc6153caf'
@@ -465,6 +680,8 @@ class ComponentDataViewTest(APITestCase):
         user = User.objects.get(username='test_admin')
         self.client.force_authenticate(user=user)
 
+        use_temporary_blob_storage(self)
+
     def test_get_data(self):
         url = reverse('component-data', kwargs={
             'slug': 'component-with-svg-data'
@@ -475,9 +692,168 @@ class ComponentDataViewTest(APITestCase):
         self.assertEqual(res.get('Content-Type'), 'image/svg+xml')
 
         md5_hash = hashlib.md5()
-        md5_hash.update(res.content)
+        md5_hash.update(b''.join(res.streaming_content))
         self.assertEqual(md5_hash.hexdigest(), self.svg_hash)
 
+    def test_get_data_streams_with_length(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+
+        res = self.client.get(url)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+
+        content = b''.join(res.streaming_content)
+        self.assertEqual(int(res['Content-Length']), len(content))
+
+    def test_head_data(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+        full = b''.join(self.client.get(url).streaming_content)
+
+        with mock.patch.object(ComponentRevision, 'open_data') as open_data:
+            res = self.client.head(url)
+
+        self.assertFalse(open_data.called)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/svg+xml')
+        self.assertEqual(res['Content-Length'], str(len(full)))
+        self.assertTrue(res['ETag'].startswith('"{}-'.format(
+            hashlib.sha256(full).hexdigest())))
+        self.assertEqual(res.content, b'')
+
+    def test_head_data_at_version(self):
+        c = Component.objects.get(slug='component-with-svg-data')
+        rev = c.new_revision(data=b'pinned data')
+        url = reverse('component-revision-data', kwargs={
+            'slug': 'component-with-svg-data',
+            'version': rev.version
+        })
+
+        with mock.patch.object(ComponentRevision, 'open_data') as open_data:
+            res = self.client.head(url)
+
+        self.assertFalse(open_data.called)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Length'], str(len(b'pinned data')))
+        self.assertEqual(res['Cache-Control'],
+                         'public, max-age=86400')
+
+    def test_head_data_queries(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+        # fills in the head pointers of the fixture
+        self.client.get(url)
+
+        # the component, its data revision along with the blob, and its
+        # metadata for the filename
+        with self.assertNumQueries(3):
+            res = self.client.head(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_unread_data_closed_with_response(self):
+        f = io.BytesIO(b'never sent')
+        res = file_response(RequestFactory().get('/'), f, 10, 'text/plain')
+
+        # eg. the client went away before the body was sent
+        res.close()
+        self.assertTrue(f.closed)
+
+    def test_get_data_gzip_passthrough(self):
+        svg = b'<svg><rect width="10" height="10"/></svg>' * 50
+        c = Component.objects.get(slug='component-with-svg-data')
+        c.new_revision(data=svg)
+
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+
+        res = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res['Vary'])
+
+        content = b''.join(res.streaming_content)
+        self.assertEqual(int(res['Content-Length']), len(content))
+        self.assertEqual(gzip.decompress(content), svg)
+
+        res = self.client.get(url)
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(res.streaming_content), svg)
+
+        res = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0, *')
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    def test_get_data_range_not_encoded(self):
+        svg = b'<svg><rect width="10" height="10"/></svg>' * 50
+        c = Component.objects.get(slug='component-with-svg-data')
+        c.new_revision(data=svg)
+
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+
+        res = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip',
+                              HTTP_RANGE='bytes=0-3')
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(res.streaming_content), b'<svg')
+
+    def test_head_no_data(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-no-data'
+        })
+
+        res = self.client.head(url)
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_data_range(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+        full = b''.join(self.client.get(url).streaming_content)
+
+        res = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(res['Content-Range'],
+                         'bytes 10-19/{}'.format(len(full)))
+        self.assertEqual(res['Content-Length'], '10')
+        self.assertEqual(b''.join(res.streaming_content), full[10:20])
+
+    def test_get_data_suffix_range(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+        full = b''.join(self.client.get(url).streaming_content)
+
+        res = self.client.get(url, HTTP_RANGE='bytes=-6')
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(res.streaming_content), full[-6:])
+
+    def test_get_data_open_ended_range(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+        full = b''.join(self.client.get(url).streaming_content)
+
+        res = self.client.get(url, HTTP_RANGE='bytes=100-')
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(res.streaming_content), full[100:])
+
+    def test_get_data_unsatisfiable_range(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+
+        res = self.client.get(url, HTTP_RANGE='bytes=99999999-')
+        self.assertEqual(res.status_code,
+                         status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertTrue(res['Content-Range'].startswith('bytes */'))
+
     def test_get_data_component_without_data(self):
         url = reverse('component-data', kwargs={
             'slug': 'component-with-no-data'
@@ -529,14 +905,87 @@ class ComponentDataViewTest(APITestCase):
 
             rev = component.revisions.first()
             md5_hash = hashlib.md5()
-            md5_hash.update(rev.data)
+            md5_hash.update(rev.read_data())
             self.assertEqual(md5_hash.hexdigest(), self.md_hash)
 
+    def test_post_data_hash_already_stored(self):
+        component = Component.objects.get(slug='component-with-no-data')
+        rev = component.new_revision(data=b'already uploaded')
+
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+
+        res = self.client.post(url, {'sha256': rev.blob_id})
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        data = json.loads(res.content.decode('UTF-8'))
+        self.assertEqual(data, {'received': 0, 'sha256': rev.blob_id})
+
+        c = Component.objects.get(slug='component-with-svg-data')
+        self.assertEqual(c.binary_data, b'already uploaded')
+
+    def test_post_data_hash_not_stored(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+
+        res = self.client.post(url, {
+            'sha256': hashlib.sha256(b'never uploaded').hexdigest()
+        })
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_post_data_hash_mismatch(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-no-data'
+        })
+        file_path = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                 '..',
+                                                 'fixtures',
+                                                 'binary-data',
+                                                 'fake_article.md'))
+
+        with open(file_path, 'rb') as upload_file:
+            res = self.client.post(url, data={
+                'file': upload_file,
+                'sha256': hashlib.sha256(b'something else').hexdigest()
+            }, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_data_not_modified(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+        res = self.client.get(url)
+        etag = res['ETag']
+        self.assertIn('Last-Modified', res)
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        c = Component.objects.get(slug='component-with-svg-data')
+        c.new_revision(data=b'new data')
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), b'new data')
+
+    def test_get_data_if_range_mismatch(self):
+        url = reverse('component-data', kwargs={
+            'slug': 'component-with-svg-data'
+        })
+
+        res = self.client.get(url, HTTP_RANGE='bytes=0-9',
+                              HTTP_IF_RANGE='"not-the-etag"')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
 
 class ComponentRevisionViewTest(APITestCase):
     fixtures = ['users.json', 'componentrevisions.json']
 
     def setUp(self):
+        use_empty_cache(self)
         self.valid_component = {
             'content_type': 'application/x-markdown',
             'schema_name': 'article',
@@ -576,9 +1025,51 @@ class ComponentRevisionViewTest(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res['Content-Type'], 'text/plain')
 
-        data = res.content.decode('UTF-8')
+        data = b''.join(res.streaming_content).decode('UTF-8')
         self.assertEqual(data, 'second data')
 
+    def test_get_component_data_at_version_cached(self):
+        url = reverse('component-revision-data', kwargs={
+            'slug': 'component-with-many-revisions',
+            'version': 3
+        })
+
+        res = self.client.get(url)
+        self.assertEqual(res['Cache-Control'],
+                         'public, max-age=86400')
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['Cache-Control'],
+                         'public, max-age=86400')
+
+    def test_get_component_data_at_version_content_type_changed(self):
+        url = reverse('component-revision-data', kwargs={
+            'slug': 'component-with-many-revisions',
+            'version': 3
+        })
+        etag = self.client.get(url)['ETag']
+
+        Component.objects.filter(
+            slug='component-with-many-revisions'
+        ).update(content_type='text/markdown')
+
+        # same data, but sent as something else
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'text/markdown')
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_get_component_data_at_version_range(self):
+        url = reverse('component-revision-data', kwargs={
+            'slug': 'component-with-many-revisions',
+            'version': 3
+        })
+
+        res = self.client.get(url, HTTP_RANGE='bytes=7-')
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(res.streaming_content), b'data')
+
     def test_get_component_data_at_version_with_filename(self):
         url = reverse('component-revision-data', kwargs={
             'slug': 'component-with-data-and-filename',
@@ -589,7 +1080,7 @@ class ComponentRevisionViewTest(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res['Content-Type'], 'text/plain')
 
-        data = res.content.decode('UTF-8')
+        data = b''.join(res.streaming_content).decode('UTF-8')
         self.assertEqual(data, 'this is some data')
         self.assertEqual(res.get('Content-Disposition'),
                          'inline; filename=file.txt')
@@ -612,6 +1103,21 @@ class ComponentRevisionViewTest(APITestCase):
         res = self.client.get(url)
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_get_component_at_removed_version(self):
+        # as if compacted away by mirrors.retention
+        ComponentRevision.objects.filter(
+            component__slug='component-with-many-revisions', version=2
+        ).delete()
+
+        for name in ('component-revision-detail', 'component-revision-data'):
+            url = reverse(name, kwargs={
+                'slug': 'component-with-many-revisions',
+                'version': 2
+            })
+
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class ComponentRevisionSummaryViewTests(APITestCase):
     fixtures = ['users.json', 'componentrevisions.json']
@@ -678,6 +1184,7 @@ class ComponentLockRequestTest(APITestCase):
     fixtures = ['component_lock_data.json', 'users.json']
 
     def setUp(self):
+        use_empty_cache(self)
         # Friendly note:
         # The account 'test_user' is the one that has locked the component
         # 'locked-component'
@@ -0,0 +1,109 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from mirrors import access, cache, warmup
+from mirrors.models import Component, ComponentAccessStat
+from mirrors.tests.utils import use_empty_cache
+
+
+class AccessCountTests(APITestCase):
+    fixtures = ['users.json', 'serializer.json']
+
+    def _counts(self):
+        return dict(ComponentAccessStat.objects.values_list(
+            'component__slug', 'count'))
+
+    @override_settings(MIRRORS_ACCESS_FLUSH_INTERVAL=0)
+    def test_counts(self):
+        access.record_access('attribute-1')
+        access.record_access('attribute-1')
+        access.record_access('attribute-2')
+        access.record_access('doesnt-exist')
+
+        self.assertEqual(self._counts(), {'attribute-1': 2,
+                                          'attribute-2': 1})
+        self.assertEqual(access.hottest(1), ['attribute-1'])
+
+    @override_settings(MIRRORS_ACCESS_FLUSH_INTERVAL=3600)
+    def test_counts_are_buffered(self):
+        access.record_access('attribute-1')
+        access.record_access('attribute-1')
+        self.assertEqual(self._counts(), {})
+
+        access.flush()
+        self.assertEqual(self._counts(), {'attribute-1': 2})
+
+        access.record_access('attribute-1')
+        access.flush()
+        self.assertEqual(self._counts(), {'attribute-1': 3})
+
+    @override_settings(MIRRORS_ACCESS_FLUSH_INTERVAL=None)
+    def test_counting_off(self):
+        access.record_access('attribute-1')
+        access.flush()
+
+        self.assertEqual(self._counts(), {})
+
+    @override_settings(MIRRORS_ACCESS_FLUSH_INTERVAL=0)
+    def test_reads_are_counted(self):
+        use_empty_cache(self)
+        self.client.force_authenticate(
+            user=User.objects.get(username='test_admin'))
+
+        url = reverse('component-detail', kwargs={'slug': 'attribute-1'})
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._counts(), {'attribute-1': 1})
+
+
+class WarmUpTests(APITestCase):
+    fixtures = ['serializer.json']
+
+    def setUp(self):
+        use_empty_cache(self)
+
+    def test_choose_hottest(self):
+        access.write_counts({'attribute-1': 5, 'attribute-2': 10,
+                             'attribute-3': 1}, timezone.now())
+
+        self.assertEqual(warmup.choose(top=2), ['attribute-2', 'attribute-1'])
+        self.assertEqual(warmup.choose(slugs=['attribute-4']),
+                         ['attribute-4'])
+
+    def test_choose_by_schema(self):
+        Component.objects.filter(slug__in=['attribute-1', 'attribute-3']
+                                 ).update(schema_name='byline')
+        access.write_counts({'attribute-3': 3}, timezone.now())
+
+        self.assertEqual(warmup.choose(schema_names=['byline']),
+                         ['attribute-3', 'attribute-1'])
+        self.assertEqual(warmup.choose(schema_names=['byline'], top=1),
+                         ['attribute-3'])
+
+    def test_warm(self):
+        slug = 'test-component-with-list-attribute'
+
+        report = warmup.warm([slug, 'doesnt-exist'], workers=1)
+
+        self.assertEqual(report.warmed, 1)
+        self.assertEqual(report.failed, ['doesnt-exist'])
+
+        with self.assertNumQueries(0):
+            cache.render_component(slug)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('warm_cache', 'test-component-mixed-attributes',
+                     workers=1, shared=True, stdout=out)
+
+        self.assertIn('1 components warmed', out.getvalue())
+        self.assertIsNotNone(cache.tree_dependencies(
+            'test-component-mixed-attributes', shared=True))
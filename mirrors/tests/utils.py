@@ -0,0 +1,47 @@
+import shutil
+import tempfile
+import uuid
+
+from django.test.utils import override_settings
+
+
+def use_temporary_blob_storage(test_case):
+    """Point the blob store at an empty temporary directory for the duration
+    of a single test.
+
+    :param test_case: the test that is being set up
+    :type test_case: :class:`unittest.TestCase`
+    """
+    location = tempfile.mkdtemp()
+    blob_settings = override_settings(
+        MIRRORS_BLOB_STORAGE='django.core.files.storage.FileSystemStorage',
+        MIRRORS_BLOB_STORAGE_OPTIONS={'location': location}
+    )
+    blob_settings.enable()
+
+    test_case.addCleanup(shutil.rmtree, location, True)
+    test_case.addCleanup(blob_settings.disable)
+
+
+def use_empty_cache(test_case):
+    """Give a single test a cache of its own, in the shared and in the
+    in-process tier, so that trees cached by other tests (whose changes to the
+    database have been rolled back) don't show up in it. It is kept in memory,
+    but stands in for a shared one, so trees are cached too.
+
+    :param test_case: the test that is being set up
+    :type test_case: :class:`unittest.TestCase`
+    """
+    cache_settings = override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'mirrors-test-{}'.format(uuid.uuid4().hex),
+            }
+        },
+        MIRRORS_CACHE='default',
+        MIRRORS_CACHE_TREES=True
+    )
+    cache_settings.enable()
+
+    test_case.addCleanup(cache_settings.disable)
@@ -0,0 +1,185 @@
+"""Loading a component together with everything its serialized form needs.
+
+Serializing a component means serializing every component it refers to
+through its attributes, and their attributes in turn. Doing that one
+component at a time costs several queries per node, so :class:`ComponentTree`
+loads the whole attribute graph up front, in a fixed number of queries however
+large it is, and the serializers render from that.
+"""
+import collections
+
+from mirrors.models import Component, ComponentAttribute, ComponentRevision
+from mirrors.models import read_metadata_in_bulk
+
+
+# every component reachable from the root through attributes, found in the
+# same query that loads them. UNION rather than UNION ALL stops at components
+# that were already reached, so cycles don't recurse forever.
+TREE_SQL = """
+mirrors_component.id IN (
+    WITH RECURSIVE tree(id) AS (
+        SELECT %s::integer
+      UNION
+        SELECT a.child_id
+        FROM mirrors_componentattribute a
+        JOIN tree t ON a.parent_id = t.id
+    )
+    SELECT id FROM tree
+)
+"""
+
+# the head revisions only need their metadata and descriptors
+DEFERRED = (
+    'head_metadata_revision__data',
+    'head_data_revision__data',
+    'head_data_revision__metadata',
+    'head_data_revision__packed_metadata',
+    'head_data_revision__metadata_delta',
+)
+
+
+class ComponentTree(object):
+    """A component and every component reachable from it through attributes,
+    along with their current metadata, attributes and revision lists.
+
+    Loading it takes four queries at most: one for the components and their
+    head revisions, one to replay any metadata stored as deltas, one for the
+    attributes and one for the revisions. Components loaded from fixtures
+    that haven't had their head pointers filled in yet cost a few more, once.
+    """
+    def __init__(self, root, components, metadata, attributes, revisions):
+        self.root = root
+        self._components = components
+        self._metadata = metadata
+        self._attributes = attributes
+        self._revisions = revisions
+
+    @classmethod
+    def load(cls, root):
+        """Load the tree under a component.
+
+        :param root: the component at the top of the tree
+        :type root: :class:`mirrors.models.Component`
+        :rtype: :class:`ComponentTree`
+        """
+        nodes = Component.objects.extra(
+            where=[TREE_SQL], params=[root.pk]
+        ).select_related(
+            'head_metadata_revision', 'head_data_revision'
+        ).defer(*DEFERRED)
+
+        components = dict((c.pk, c) for c in nodes)
+
+        for component in components.values():
+            component._ensure_head()
+
+        heads = [c.head_metadata_revision for c in components.values()
+                 if c.head_metadata_revision_id is not None]
+        head_metadata = read_metadata_in_bulk(heads)
+
+        metadata = {}
+        for pk, component in components.items():
+            if component.head_metadata_revision_id is not None:
+                metadata[pk] = head_metadata[
+                    component.head_metadata_revision_id]
+            else:
+                metadata[pk] = {}
+
+        named = collections.defaultdict(collections.OrderedDict)
+        attrs = ComponentAttribute.objects.filter(
+            parent_id__in=components.keys()
+        ).order_by('parent', 'name', 'weight', 'pk').values_list(
+            'parent_id', 'name', 'child_id', 'weight')
+
+        for parent_id, name, child_id, weight in attrs:
+            named[parent_id].setdefault(name, []).append((child_id, weight))
+
+        attributes = {}
+        for parent_id, names in named.items():
+            attributes[parent_id] = collections.OrderedDict()
+
+            for name, children in names.items():
+                # the same rules as Component.get_attribute
+                if len(children) == 1 and children[0][1] == -1:
+                    value = components[children[0][0]]
+                else:
+                    value = [components[child_id]
+                             for child_id, weight in children]
+                attributes[parent_id][name] = value
+
+        revisions = collections.defaultdict(list)
+        versions = ComponentRevision.objects.filter(
+            component_id__in=components.keys()
+        ).order_by('component', 'version').values_list('component_id',
+                                                        'version')
+
+        for component_id, version in versions:
+            revisions[component_id].append('{} v{}'.format(
+                components[component_id].slug, version))
+
+        return cls(components.get(root.pk, root), components, metadata,
+                   attributes, revisions)
+
+    def __contains__(self, component):
+        return component.pk in self._components
+
+    def __len__(self):
+        return len(self._components)
+
+    def __iter__(self):
+        return iter(self._components.values())
+
+    def metadata(self, component):
+        """Get the current metadata of a component in the tree.
+
+        :rtype: dict
+        """
+        return self._metadata[component.pk]
+
+    def attributes(self, component):
+        """Get the attributes of a component in the tree, by name. Each one
+        is either a component or a list of them, as with
+        :meth:`mirrors.models.Component.get_attribute`.
+
+        :rtype: :class:`collections.OrderedDict`
+        """
+        return self._attributes.get(component.pk, collections.OrderedDict())
+
+    def revisions(self, component):
+        """Get the names of the revisions of a component in the tree, oldest
+        first.
+
+        :rtype: list of str
+        """
+        return self._revisions[component.pk]
+
+    def walk(self, component, max_depth=None):
+        """Go through the components below one in the tree, breadth first and
+        each only once, however many ways there are to reach it.
+
+        :param component: the component to start from, which isn't included
+        :type component: :class:`mirrors.models.Component`
+        :param max_depth: how many attributes away from ``component`` to go,
+                          or None for no limit
+        :type max_depth: int
+        :rtype: generator of ``(component, depth)`` tuples
+        """
+        seen = set([component.pk])
+        level = [component]
+        depth = 0
+
+        while level and (max_depth is None or depth < max_depth):
+            depth += 1
+            next_level = []
+
+            for parent in level:
+                for attr in self.attributes(parent).values():
+                    children = attr if isinstance(attr, list) else [attr]
+
+                    for child in children:
+                        if child.pk not in seen:
+                            seen.add(child.pk)
+                            next_level.append(child)
+                            yield child, depth
+
+            level = next_level
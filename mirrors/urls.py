@@ -24,6 +24,9 @@ urlpatterns = patterns(
     url(r'^component/(?P<slug>[-\w]+)/revision$',
         views.ComponentRevisionList.as_view(),
         name='component-revision-list'),
+    url(r'^component/(?P<slug>[-\w]+)/referenced-by$',
+        views.ComponentReferencedBy.as_view(),
+        name='component-referenced-by'),
     url(r'^component/(?P<slug>[-\w]+)/valid$',
         views.ComponentValidity.as_view(),
         name='component-validity'),
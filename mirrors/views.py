@@ -1,15 +1,13 @@
+import hashlib
 import json
 import logging
 
 import jsonschema
 
-# TODO: these will have to be used at some point, but not yet
-# from django.core.files.storage import default_storage
-# from django.core.files import File
 from django.core.urlresolvers import reverse
-from django.db import transaction
 from django.http import HttpResponse, Http404
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
 
 from rest_framework import generics, mixins, status, permissions
 from rest_framework.authentication import SessionAuthentication
@@ -18,12 +16,19 @@ from rest_framework.response import Response
 from mirrors.exceptions import LockEnforcementError
 from mirrors.components import get_component, MissingComponentException
 from mirrors.models import Component, ComponentAttribute
+from mirrors.models import collect_changes
+from mirrors.responses import CACHE_VERSIONED, accepts_encoding
+from mirrors.responses import file_head_response, file_response
+from mirrors.responses import is_not_modified, not_modified, set_validators
 from mirrors.serializers import ComponentSerializer
 from mirrors.serializers import ComponentWithDataSerializer
 from mirrors.serializers import ComponentAttributeSerializer
 from mirrors.serializers import ComponentRevisionSerializer
 from mirrors.serializers import ComponentLockSerializer
+from mirrors import access, cache
 from mirrors import components
+from mirrors import compression
+from mirrors import storage
 
 LOGGER = logging.getLogger(__name__)
 
@@ -48,6 +53,142 @@ def can_update_component(user, component_slug):
         return True
 
 
+def component_validators(request, slug, suffix=''):
+    """Get the ``ETag`` and ``Last-Modified`` values for the serialized form
+    of a :class:`Component`. They cover the component and everything it
+    refers to through its attributes, and are worked out with a single query
+    so that conditional requests can be answered before doing anything
+    expensive.
+
+    :param request: the request being answered
+    :param slug: the slug of the component
+    :type slug: str
+    :param suffix: extra text to distinguish representations that depend on
+                   more than the component's state
+    :type suffix: str
+    :rtype: an ``(etag, last_modified)`` tuple
+    :raises: :class:`django.http.Http404`
+    """
+    state = Component.objects.tree_state(slug)
+
+    if state is None:
+        raise Http404
+
+    etag = '{}-{}{}'.format(state.etag, request.accepted_renderer.format,
+                            suffix)
+    return etag, state.last_modified
+
+
+def tree_options(request):
+    """Read the query parameters that control how much of the attribute
+    graph of a component is rendered: ``depth``, how many attributes deep to
+    render components in full, and ``components``, which when set renders
+    every component once in a top-level ``components`` map instead.
+
+    :param request: the request being answered
+    :rtype: a ``(serializer keyword arguments, etag suffix)`` tuple
+    :raises: :class:`ValueError` if ``depth`` isn't a non-negative integer
+    """
+    options = {}
+    suffix = ''
+
+    depth = request.QUERY_PARAMS.get('depth', None)
+    if depth is not None:
+        depth = int(depth)
+        if depth < 0:
+            raise ValueError('depth must not be negative')
+
+        options['max_depth'] = depth
+        suffix += '-d{}'.format(depth)
+
+    if request.QUERY_PARAMS.get('components', '') in ('1', 'true'):
+        options['shared'] = True
+        suffix += '-map'
+
+    return options, suffix
+
+
+def revision_data_response(request, component, rev, version=None,
+                           with_content=True):
+    """Send the data stored with a revision. Data that is stored gzipped is
+    sent as it is, with a ``Content-Encoding`` header, to clients that accept
+    that and didn't ask for a range.
+
+    :param request: the request being answered
+    :param component: the component the data belongs to
+    :type component: :class:`mirrors.models.Component`
+    :param rev: the revision that holds the data
+    :type rev: :class:`mirrors.models.ComponentRevision`
+    :param version: the version asked for, or None for the current data.
+                    The data of a particular version never changes, so those
+                    responses can be cached for a day at a time.
+    :type version: int
+    :param with_content: whether to send the data or just the headers, as
+                         for a ``HEAD`` request
+    :type with_content: bool
+    :rtype: :class:`django.http.HttpResponse`
+    """
+    blob = rev.blob if rev.blob_id is not None else None
+    negotiable = (blob is not None and
+                  blob.encoding in compression.HTTP_ENCODINGS)
+    encoded = (negotiable and 'HTTP_RANGE' not in request.META and
+               accepts_encoding(request, blob.encoding))
+
+    # if we have a real filename stored in metadata, we should provide
+    # that to the browser as the filename. if not, just give it the slug
+    if version is None:
+        metadata = component.metadata
+    else:
+        metadata = component.metadata_at_version(version)
+
+    if metadata is not None and 'filename' in metadata:
+        filename = metadata['filename']
+    else:
+        filename = component.slug
+
+    # the content type and the filename are sent with the data but can
+    # change without it (the component's content type is mutable, and
+    # coalescing rewrites metadata), so they are part of the etag too. each
+    # encoding is a different representation, so needs its own etag as well
+    headers = hashlib.sha1('{}\n{}'.format(component.content_type,
+                                           filename).encode('UTF-8'))
+    etag = '{}-{}'.format(rev.data_hash, headers.hexdigest()[:16])
+    if encoded:
+        etag = '{}-{}'.format(etag, blob.encoding)
+
+    if is_not_modified(request, etag, rev.created_at):
+        resp = not_modified(etag, rev.created_at)
+    else:
+        if encoded:
+            size = blob.stored_size
+        else:
+            size = rev.data_size
+
+        if not with_content:
+            resp = file_head_response(size, component.content_type, filename)
+        elif encoded:
+            resp = file_response(request, blob.open_raw(), size,
+                                 component.content_type, filename, etag=etag)
+        else:
+            resp = file_response(request, rev.open_data(), size,
+                                 component.content_type, filename, etag=etag)
+
+        if encoded:
+            resp['Content-Encoding'] = blob.encoding
+
+    if negotiable:
+        patch_vary_headers(resp, ('Accept-Encoding',))
+
+    if version is not None and resp.status_code in (
+            status.HTTP_200_OK, status.HTTP_206_PARTIAL_CONTENT,
+            status.HTTP_304_NOT_MODIFIED):
+        # the data of a revision never changes, though the headers it is
+        # sent with may
+        resp['Cache-Control'] = CACHE_VERSIONED
+
+    return set_validators(resp, etag, rev.created_at)
+
+
 class ComponentList(mixins.CreateModelMixin,
                     generics.GenericAPIView):
     """Handle the POST requests made to ``/component`` to allow the creation of
@@ -73,14 +214,33 @@ class ComponentDetail(mixins.RetrieveModelMixin,
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
-        component = get_object_or_404(Component, slug=self.kwargs['slug'])
+        try:
+            options, suffix = tree_options(request)
+        except ValueError:
+            return Response({'depth': ['Must be a non-negative integer']},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        if component.data_uri is not None:
-            self.serializer_class = ComponentWithDataSerializer
-        else:
-            self.serializer_class = ComponentSerializer
+        etag, last_modified = component_validators(request,
+                                                   self.kwargs['slug'],
+                                                   suffix)
+        access.record_access(self.kwargs['slug'])
 
-        return self.retrieve(request, *args, **kwargs)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+
+        data = cache.render_component(self.kwargs['slug'], **options)
+
+        if data is None:
+            raise Http404
+
+        resp = Response(data, status=status.HTTP_200_OK)
+        if isinstance(data, cache.StaleDocument):
+            # made from an older state than the validators describe, so
+            # clients have to ask again rather than keep it as current
+            resp['Cache-Control'] = 'no-cache'
+            return resp
+
+        return set_validators(resp, etag, last_modified)
 
     @requires_lock_access
     def patch(self, request, *args, **kwargs):
@@ -88,7 +248,9 @@ class ComponentDetail(mixins.RetrieveModelMixin,
 
     @requires_lock_access
     def delete(self, request, *args, **kwargs):
-        return self.destroy(request, *args, **kwargs)
+        # the attributes of and to the component are deleted along with it
+        with collect_changes():
+            return self.destroy(request, *args, **kwargs)
 
 
 class ComponentAttributeList(mixins.CreateModelMixin,
@@ -165,6 +327,12 @@ class ComponentAttributeDetail(mixins.UpdateModelMixin,
         return queryset
 
     def get(self, request, *args, **kwargs):
+        etag, last_modified = component_validators(
+            request, self.kwargs['slug'], '-' + self.kwargs['name'])
+
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+
         queryset = self.get_queryset()
 
         if queryset.count() == 0:
@@ -174,7 +342,8 @@ class ComponentAttributeDetail(mixins.UpdateModelMixin,
         else:
             serializer = ComponentAttributeSerializer(queryset, many=True)
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        resp = Response(serializer.data, status=status.HTTP_200_OK)
+        return set_validators(resp, etag, last_modified)
 
     @requires_lock_access
     def put(self, request, *args, **kwargs):
@@ -188,15 +357,18 @@ class ComponentAttributeDetail(mixins.UpdateModelMixin,
         serializer = ComponentAttributeSerializer(data=data, many=has_many)
 
         if serializer.is_valid():
-            with transaction.atomic():
-                qs = self.get_queryset()
-                if qs.count() > 0:
-                    qs.delete()
-                serializer.save()
+            attrs = serializer.object if has_many else [serializer.object]
+            parent = get_object_or_404(Component, slug=self.kwargs['slug'])
+
+            # only the rows that differ from what was submitted are written
+            parent.set_attribute(self.kwargs['name'],
+                                 [(attr.child, attr.weight) for attr in attrs])
 
             if has_many:
-                serializer = ComponentAttributeSerializer(self.get_queryset(),
-                                                          many=True)
+                serializer = ComponentAttributeSerializer(
+                    parent.attributes.filter(
+                        name=self.kwargs['name']).order_by('weight'),
+                    many=True)
 
             return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -204,12 +376,79 @@ class ComponentAttributeDetail(mixins.UpdateModelMixin,
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
 
+    @requires_lock_access
+    def post(self, request, *args, **kwargs):
+        """Insert a single entry into a list attribute, before or after
+        another entry.
+        """
+        return self._place(request, insert=True)
+
+    @requires_lock_access
+    def patch(self, request, *args, **kwargs):
+        """Move a single entry of a list attribute to before or after
+        another entry.
+        """
+        return self._place(request, insert=False)
+
+    def _place(self, request, insert):
+        parent = get_object_or_404(Component, slug=self.kwargs['slug'])
+        data = request.DATA
+        components = {}
+        errors = {}
+
+        if not isinstance(data, dict):
+            return Response({'error': 'Expected a JSON object'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        for field in ('child', 'before', 'after'):
+            if data.get(field) is None:
+                continue
+
+            try:
+                components[field] = Component.objects.get(slug=data[field])
+            except Component.DoesNotExist:
+                errors[field] = ['No such component']
+
+        if 'child' not in data:
+            errors['child'] = ['This field is required.']
+
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if insert:
+            place = parent.insert_attribute
+        else:
+            place = parent.move_attribute
+
+        try:
+            place(self.kwargs['name'], components['child'],
+                  before=components.get('before'),
+                  after=components.get('after'))
+        except KeyError as e:
+            return Response({'error': e.args[0]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({'error': str(e)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = ComponentAttributeSerializer(self.get_queryset(),
+                                                  many=True)
+        if insert:
+            code = status.HTTP_201_CREATED
+        else:
+            code = status.HTTP_200_OK
+
+        return Response(serializer.data, status=code)
+
     @requires_lock_access
     def delete(self, request, *args, **kwargs):
         if self.get_queryset().count() == 0:
             raise Http404
 
-        self.get_queryset().delete()
+        # each deleted row marks the parent as changed, which is only sent
+        # once the deletion has committed
+        with collect_changes():
+            self.get_queryset().delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -218,14 +457,44 @@ class ComponentRevisionList(mixins.RetrieveModelMixin,
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
+        etag, last_modified = component_validators(request, kwargs['slug'],
+                                                   '-revisions')
+
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+
         component = get_object_or_404(Component, slug=kwargs['slug'])
-        qs = component.revisions.order_by('version')
+        qs = component.revisions.defer('data', 'metadata').order_by('version')
 
         if qs.count() == 0:
             raise Http404
 
         serializer = ComponentRevisionSerializer(qs, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        resp = Response(serializer.data, status=status.HTTP_200_OK)
+        return set_validators(resp, etag, last_modified)
+
+
+class ComponentReferencedBy(generics.GenericAPIView):
+    """List the components that refer to one through their attributes,
+    directly or, with ``?depth=<n>``, through up to ``n`` levels of
+    attributes.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            depth = int(request.QUERY_PARAMS.get('depth', 1))
+            if depth < 1:
+                raise ValueError('depth must be positive')
+        except ValueError:
+            return Response({'depth': ['Must be a positive integer']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        component = get_object_or_404(Component, slug=kwargs['slug'])
+        references = Component.objects.referenced_by(component, depth)
+
+        return Response([{'slug': r.slug, 'depth': r.depth}
+                         for r in references], status=status.HTTP_200_OK)
 
 
 class ComponentRevisionDetail(mixins.RetrieveModelMixin,
@@ -233,14 +502,28 @@ class ComponentRevisionDetail(mixins.RetrieveModelMixin,
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
+        try:
+            options, suffix = tree_options(request)
+        except ValueError:
+            return Response({'depth': ['Must be a non-negative integer']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        etag, last_modified = component_validators(
+            request, kwargs['slug'], '-v' + kwargs['version'] + suffix)
+
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+
         component = get_object_or_404(Component, slug=kwargs['slug'])
         version = int(kwargs['version'])
 
-        if not component._version_in_range(version):
+        if not component.has_version(version):
             raise Http404()
 
-        serializer = ComponentSerializer(component, version=version)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        serializer = ComponentSerializer(component, version=version,
+                                         **options)
+        resp = Response(serializer.data, status=status.HTTP_200_OK)
+        return set_validators(resp, etag, last_modified)
 
 
 class ComponentRevisionData(mixins.RetrieveModelMixin,
@@ -248,73 +531,108 @@ class ComponentRevisionData(mixins.RetrieveModelMixin,
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
-        component = get_object_or_404(Component, slug=kwargs['slug'])
-        version = int(kwargs['version'])
-        data = component.binary_data_at_version(version)
+        return self.send_data(request, kwargs['slug'], int(kwargs['version']))
 
-        if data is None:
+    def head(self, request, *args, **kwargs):
+        return self.send_data(request, kwargs['slug'], int(kwargs['version']),
+                              with_content=False)
+
+    def send_data(self, request, slug, version, with_content=True):
+        component = get_object_or_404(Component, slug=slug)
+
+        try:
+            rev = component.data_revision_at_version(version)
+        except IndexError:
             raise Http404
 
-        if 'filename' in component.metadata:
-            filename = component.metadata['filename']
-        else:
-            filename = component.slug
+        if rev is None:
+            raise Http404
 
-        resp = HttpResponse(data,
-                            content_type=component.content_type,
-                            status=status.HTTP_200_OK)
-        resp['Content-Disposition'] = "inline; filename={}".format(filename)
-        return resp
+        return revision_data_response(request, component, rev, version,
+                                      with_content)
 
 
 class ComponentData(generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
-        component = get_object_or_404(Component, slug=kwargs['slug'])
-        data = component.binary_data
+        return self.send_data(request, kwargs['slug'])
 
-        if data is None:
-            raise Http404
+    def head(self, request, *args, **kwargs):
+        return self.send_data(request, kwargs['slug'], with_content=False)
 
-        # if we have a real filename stored in metadata, we should provide that
-        # to the browser as the filename. if not, just give it the slug instead
-        metadata = component.metadata
+    def send_data(self, request, slug, with_content=True):
+        component = get_object_or_404(Component, slug=slug)
+        rev = component.data_revision
 
-        if metadata is not None and 'filename' in metadata:
-            filename = metadata['filename']
-        else:
-            filename = component.slug
+        if rev is None:
+            raise Http404
 
-        resp = HttpResponse(data,
-                            content_type=component.content_type,
-                            status=status.HTTP_200_OK)
-        resp['Content-Disposition'] = "inline; filename={}".format(filename)
-        return resp
+        return revision_data_response(request, component, rev,
+                                      with_content=with_content)
 
-    def handle_uploaded_file(self, f):
-        data = b''
-        for chunk in f.chunks():
-            # destination.write(chunk)
-            data = data + chunk
+    def handle_uploaded_file(self, f, sha256=None, content_type=None):
+        """Copy an uploaded file into the blob store chunk by chunk, so that
+        the size of the upload doesn't affect how much memory is used.
+        ``content_type`` decides whether it is stored compressed.
 
+        :rtype: :class:`mirrors.models.Blob`
+        :raises: :class:`ValueError` if ``sha256`` doesn't match the file
+        """
         LOGGER.info("received file {} ({} bytes)".format(f.name,
                                                          f.size))
 
-        return data
+        return storage.store_file(f, sha256=sha256,
+                                  content_type=content_type)
 
     @requires_lock_access
     def post(self, request, *args, **kwargs):
         component = get_object_or_404(Component, slug=kwargs['slug'])
+        sha256 = request.DATA.get('sha256', None)
+
+        if sha256 is not None:
+            sha256 = sha256.lower()
+
+        if len(request.FILES) == 0 and sha256 is not None:
+            # the client only sent the hash of the file, to find out whether
+            # it needs to upload it at all. if we already have that content
+            # the new revision can just point at it, claimed in the same
+            # transaction so that garbage collection can't take it away.
+            with collect_changes():
+                blob = storage.claim_blob(sha256)
+
+                if blob is not None:
+                    component.new_revision(data=blob, user=request.user)
+
+            if blob is None:
+                error = {'sha256': ['No data with this hash exists']}
+                return HttpResponse(json.dumps(error),
+                                    content_type='application/json',
+                                    status=status.HTTP_404_NOT_FOUND)
+
+            return HttpResponse(json.dumps({'received': 0,
+                                            'sha256': blob.sha256}),
+                                content_type='application/json',
+                                status=status.HTTP_201_CREATED)
 
         if len(request.FILES) != 1:
             error = {'File': ['Exactly one file per upload allowed']}
             return HttpResponse(error, status=status.HTTP_400_BAD_REQUEST)
 
-        filedata = self.handle_uploaded_file(request.FILES['file'])
-        component.new_revision(data=filedata)
+        try:
+            blob = self.handle_uploaded_file(
+                request.FILES['file'], sha256=sha256,
+                content_type=component.content_type)
+        except ValueError:
+            error = {'sha256': ['Does not match the uploaded file']}
+            return HttpResponse(json.dumps(error),
+                                content_type='application/json',
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        component.new_revision(data=blob, user=request.user)
 
-        return HttpResponse({'received': len(filedata)},
+        return HttpResponse(json.dumps({'received': blob.size,
+                                        'sha256': blob.sha256}),
                             content_type='application/json',
                             status=status.HTTP_201_CREATED)
 
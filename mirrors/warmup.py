@@ -0,0 +1,148 @@
+"""Filling the component caches ahead of time, so that the first requests
+after a deploy or a cache flush don't all have to render.
+
+:func:`warm_up` picks the components that are read the most, or the ones
+asked for, and renders their trees into the shared cache and the cache of the
+current process, several at a time. It is what the ``warm_cache`` management
+command runs, and it can also be called when a server loads the application
+before forking its workers (such as gunicorn's ``--preload``), so that every
+worker starts out with the trees in memory.
+"""
+import collections
+import concurrent.futures
+import logging
+import time
+
+from django.db import connection
+
+from mirrors import access, cache
+from mirrors.models import Component
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TOP = 100
+DEFAULT_WORKERS = 4
+
+
+class WarmUpReport(object):
+    """What a warm-up did."""
+    def __init__(self):
+        self.warmed = 0
+        self.failed = []
+        self.seconds = 0.0
+
+    def __str__(self):
+        summary = '{} components warmed in {:.1f}s'.format(self.warmed,
+                                                           self.seconds)
+        if self.failed:
+            summary += ', {} failed: {}'.format(len(self.failed),
+                                                ', '.join(self.failed))
+        return summary
+
+
+def choose(top=DEFAULT_TOP, slugs=(), schema_names=(), since=None):
+    """Choose the components to warm up: the ones given by slug, then the
+    ones with the given schemas, or failing both the ones read the most.
+    Components with a schema are taken most read first, ``top`` at most.
+
+    :param top: how many to take by access count or schema
+    :type top: int
+    :param slugs: the slugs of components to warm up
+    :type slugs: list of str
+    :param schema_names: the schemas of components to warm up
+    :type schema_names: list of str
+    :param since: only count components read since then
+    :type since: :class:`datetime.datetime`
+    :rtype: list of slugs
+    """
+    chosen = collections.OrderedDict((slug, None) for slug in slugs)
+
+    if schema_names:
+        components = Component.objects.filter(schema_name__in=schema_names)
+        if since is not None:
+            components = components.filter(
+                access_stat__last_accessed__gte=since)
+
+        for slug in components.extra(
+                select={'reads': 'COALESCE((SELECT count FROM '
+                                 'mirrors_componentaccessstat s WHERE '
+                                 's.component_id = mirrors_component.id), 0)'},
+                order_by=['-reads', 'slug']
+        ).values_list('slug', flat=True)[:top]:
+            chosen[slug] = None
+    elif not slugs:
+        for slug in access.hottest(top, since):
+            chosen[slug] = None
+
+    return list(chosen.keys())
+
+
+def warm(slugs, workers=DEFAULT_WORKERS, shared=False):
+    """Render the trees of some components into the caches.
+
+    :param slugs: the slugs of the components
+    :type slugs: list of str
+    :param workers: how many to render at a time; with 1 they are rendered in
+                    the calling thread
+    :type workers: int
+    :param shared: whether to also render the form with a ``components`` map
+    :type shared: bool
+    :rtype: :class:`WarmUpReport`
+    """
+    report = WarmUpReport()
+    started = time.time()
+    forms = (False, True) if shared else (False,)
+
+    if workers <= 1:
+        results = [_warm_one(slug, forms) for slug in slugs]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(lambda slug: _warm_in_thread(slug, forms),
+                                    slugs))
+
+    for slug, ok in zip(slugs, results):
+        if ok:
+            report.warmed += 1
+        else:
+            report.failed.append(slug)
+
+    report.seconds = time.time() - started
+    return report
+
+
+def _warm_one(slug, forms):
+    try:
+        for shared in forms:
+            if cache.render_tree(slug, shared) is None:
+                return False
+        return True
+    except Exception:
+        LOGGER.exception('failed to warm up {}'.format(slug))
+        return False
+
+
+def _warm_in_thread(slug, forms):
+    try:
+        return _warm_one(slug, forms)
+    finally:
+        # each thread of the pool has a connection of its own
+        connection.close()
+
+
+def warm_up(top=DEFAULT_TOP, slugs=(), schema_names=(), since=None,
+            workers=DEFAULT_WORKERS, shared=False):
+    """Choose components with :func:`choose` and warm them up with
+    :func:`warm`. The database connection of the calling thread is closed
+    afterwards, so that it isn't shared by processes forked from this one.
+
+    :rtype: :class:`WarmUpReport`
+    """
+    try:
+        chosen = choose(top, slugs, schema_names, since)
+        report = warm(chosen, workers, shared)
+    finally:
+        connection.close()
+
+    LOGGER.info('cache warm-up: {}'.format(report))
+    return report
@@ -127,3 +127,52 @@ USE_TZ = True
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 STATIC_URL = '/static/'
+
+# Uploaded component data
+# Mirrors keeps it in the default storage unless MIRRORS_BLOB_STORAGE names a
+# different storage class (configured with MIRRORS_BLOB_STORAGE_OPTIONS)
+
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+
+# Which content types are stored compressed, as (pattern, encoding, level)
+# tuples; see mirrors.compression.DEFAULT_POLICY for the default
+# MIRRORS_COMPRESSION = [('text/*', 'gzip', 9), ('application/json', 'lzma', 6)]
+# Metadata whose JSON is longer than this many bytes is stored compressed
+# MIRRORS_METADATA_COMPRESSION_THRESHOLD = 1024
+# Metadata changes are stored as JSON patches, with a full copy at least every
+# this many revisions (None stores every revision in full)
+# MIRRORS_METADATA_KEYFRAME_INTERVAL = 10
+# Merge metadata changes by the same user into the latest revision if it was
+# saved less than this many seconds ago, or while the user holds a lock
+# MIRRORS_AUTOSAVE_COALESCE_SECONDS = 30
+# MIRRORS_AUTOSAVE_COALESCE_LOCKS = True
+# Data at least this many bytes long is stored in content-defined chunks, so
+# that similar versions share most of their storage (off unless set)
+# MIRRORS_CHUNKING_THRESHOLD = 1024 * 1024
+# How many levels up /component/<slug>/referenced-by will look
+# MIRRORS_REFERENCED_BY_MAX_DEPTH = 10
+# Which of CACHES serialized components are kept in (None turns it off), and
+# for how many seconds
+# MIRRORS_CACHE = 'default'
+# MIRRORS_CACHE_TIMEOUT = 60 * 60 * 24
+# Whether fully expanded components are cached whole; unless set, only if that
+# cache is shared between processes (not LocMemCache)
+# MIRRORS_CACHE_TREES = True
+# How many components each process keeps in memory in front of that cache
+# (0 turns it off), and for how many seconds at most
+# MIRRORS_LOCAL_CACHE_SIZE = 1000
+# MIRRORS_LOCAL_CACHE_TIMEOUT = 60
+# How processes tell each other which cached trees are stale; the default only
+# reaches the current process, PostgresBus reaches every one using the database
+# MIRRORS_INVALIDATION_BUS = 'mirrors.bus.PostgresBus'
+# MIRRORS_INVALIDATION_BUS_OPTIONS = {'channel': 'mirrors_invalidate'}
+# For how many seconds after it expires or changes a tree may be served while
+# a new one is made, and how long to wait for another process to make it
+# MIRRORS_CACHE_STALE_TIMEOUT = 60 * 5
+# MIRRORS_CACHE_LOCK_TIMEOUT = 10
+# How often each process adds its cache hit and miss counts to the shared ones
+# that cache_stats reports, in seconds
+# MIRRORS_CACHE_STATS_FLUSH_INTERVAL = 10
+# How often each process adds up the reads of each component it has counted,
+# in seconds (None turns counting off); warm_cache uses the counts
+# MIRRORS_ACCESS_FLUSH_INTERVAL = 60